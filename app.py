@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
+import time
+import json
+import uuid
+import hashlib
+import threading
 import logging
 from dotenv import load_dotenv
  
@@ -7,24 +12,33 @@ from dotenv import load_dotenv
 # This makes the app's configuration more robust and independent of the current working directory.
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path=dotenv_path)
-from datetime import datetime, timedelta, UTC
+from datetime import date, datetime, time as dt_time, timedelta, UTC
+from decimal import Decimal
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, jsonify, current_app
+import click
+from flask import Flask, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, session, Response, jsonify, current_app
 from flask_caching import Cache
 
 # NEW: Import password hashing utilities
 from werkzeug.security import check_password_hash, generate_password_hash
-import pandas as pd
-import numpy as np
 
 # NEW: SQLAlchemy and database imports
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, or_, and_
-
-# NEW: Cloudinary for image uploads
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+from sqlalchemy import func, or_, and_, text, event, bindparam, case, update
+from sqlalchemy.orm import validates, selectinload
+from sqlalchemy.exc import IntegrityError
+
+# NEW: In-process n-gram index used to narrow down keyword searches
+from search_index import NgramIndex
+from id_allocator import BlockIdAllocator
+from cache_tags import TaggedCache
+from rollups import CountRollup, track_rollups
+from task_queue import TaskQueue
+from image_variants import image_variants, register_template_filters
+from field_schema import FieldError, FieldSchema, coercer_for
+from coercion import clean_decimal, clean_time, is_blank, parse_date, parse_time
+from cloudinary_cleanup import chunked, delete_batch, iter_orphans, public_id_from_url, public_ids_from_urls, split_urls
+from search_backends import DigitsSearchBackend, LikeSearchBackend, MySQLFulltextBackend, SQLiteFTS5Backend, digits_only, looks_like_identifier
 
 # =================================================================================
 # FLASK APP INITIALIZATION AND CONFIGURATION
@@ -32,20 +46,47 @@ import cloudinary.api
 
 app = Flask(__name__)
 
-# --- Secret Key Configuration ---
-# IMPORTANT: Set this in your environment variables for production
-SECRET_KEY = os.environ.get('SECRET_KEY')
-if not SECRET_KEY:
-    raise ValueError("No SECRET_KEY set for Flask application. Please set it in your environment variables.")
-app.secret_key = SECRET_KEY
+# REVISED: Extensions are created unbound and attached by create_app(). Note that a plain import still
+# calls create_app() at the bottom of this module (see MAIN EXECUTION), so it needs SECRET_KEY and the
+# database settings and builds the engine; only CREATE_APP_ON_IMPORT=0 (tests, tools) skips that.
+db = SQLAlchemy()
 
-# --- Logging Configuration ---
-# This sets up a file-based logger which is crucial for debugging on a server.
-if not app.debug:
+# --- Cache Configuration ---
+# REVISED: Two-tier cache (per-worker L1 + a SQLite file shared by all workers on the host), so every
+# gunicorn worker reads the same warm entries and an invalidation in one worker reaches all of them.
+cache = Cache()
+# NEW: Cached entries declare tags; writes invalidate only the tags they affect instead of cache.clear().
+tagged_cache = TaggedCache(cache)
+
+# NEW: {{ url | image_variant('thumb') }} / {{ url | image_srcset }} for Cloudinary galleries
+register_template_filters(app)
+
+# NEW: Schema changes to existing databases go through Alembic migrations ('flask db upgrade').
+def _include_in_migrations(obj, name, type_, reflected, compare_to):
+    # The SQLite FTS5 table and its shadow tables are managed by search_backends, not by the models.
+    return not (type_ == 'table' and name.startswith('customer_records_fts'))
+
+def _database_uri_from_env():
+    """MySQL URI from the DB_* settings; a full DATABASE_URL (e.g. a scratch SQLite file for benchmarks) takes precedence."""
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        return database_url
+    db_password = os.environ.get('DB_PASSWORD') # It's better to not have a default password
+    if not db_password:
+        raise ValueError("No DB_PASSWORD set for Flask application. Please set it in your environment variables.")
+    db_user = os.environ.get('DB_USER', 'root')
+    db_host = os.environ.get('DB_HOST', 'localhost')
+    db_name = os.environ.get('DB_NAME', 'loan_system')
+    return f'mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}?charset=utf8mb4'
+
+def _configure_logging(app):
+    # This sets up a file-based logger which is crucial for debugging on a server.
+    if app.debug or app.testing:
+        return
     # Create a directory for logs if it doesn't exist
     if not os.path.exists('logs'):
         os.mkdir('logs')
-    
+
     # Set up a rotating file handler
     from logging.handlers import RotatingFileHandler
     file_handler = RotatingFileHandler('logs/customer_app.log', maxBytes=10240, backupCount=10)
@@ -55,36 +96,104 @@ if not app.debug:
     app.logger.setLevel(logging.INFO)
     app.logger.info('Customer App startup')
 
-# --- Database Configuration (MySQL with SQLAlchemy) ---
-DB_USER = os.environ.get('DB_USER', 'root')
-DB_PASSWORD = os.environ.get('DB_PASSWORD') # It's better to not have a default password
-DB_HOST = os.environ.get('DB_HOST', 'localhost')
-DB_NAME = os.environ.get('DB_NAME', 'loan_system')
+# NEW: Deferred configuration of the module-level `app`. This is not an app factory: the routes are
+# registered on that single `app` at import, so create_app() configures it once per process (environment
+# plus `config`, then the extensions) and every call returns the same object, never a fresh Flask app.
+_create_app_config = None
 
-if not DB_PASSWORD:
-    raise ValueError("No DB_PASSWORD set for Flask application. Please set it in your environment variables.")
+def create_app(config=None):
+    """
+    Configures the module-level `app` and returns it (the same object on every call; no new app is built).
+    `config` (a dict) overrides the environment, e.g. the tests pass SQLALCHEMY_DATABASE_URI and
+    SECRET_KEY. Raises ValueError if SECRET_KEY or the database settings are missing.
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}?charset=utf8mb4'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_recycle': 280} # Prevents connection timeouts
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=365) # ตั้งค่า Cookie ให้อยู่นาน 1 ปี (เพื่อรองรับ Superadmin)
+    Only the first call configures the app. A later call without `config`, or with the same one,
+    returns it unchanged; a later call with a different `config` raises RuntimeError instead of
+    silently ignoring it.
+    """
+    global _create_app_config
+    if 'sqlalchemy' in app.extensions:
+        if config and dict(config) != _create_app_config:
+            raise RuntimeError("create_app() already configured this process's app with different settings; "
+                               "set CREATE_APP_ON_IMPORT=0 and call create_app(config) once, before anything else")
+        return app
+    _create_app_config = dict(config or {})
+    config = dict(config or {})
+
+    # --- Secret Key Configuration ---
+    # IMPORTANT: Set this in your environment variables for production
+    config.setdefault('SECRET_KEY', os.environ.get('SECRET_KEY'))
+    if not config['SECRET_KEY']:
+        raise ValueError("No SECRET_KEY set for Flask application. Please set it in your environment variables.")
+
+    # --- Database Configuration (MySQL with SQLAlchemy) ---
+    if 'SQLALCHEMY_DATABASE_URI' not in config:
+        config['SQLALCHEMY_DATABASE_URI'] = _database_uri_from_env()
+    config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {'pool_recycle': 280}) # Prevents connection timeouts
+    config.setdefault('PERMANENT_SESSION_LIFETIME', timedelta(days=365)) # ตั้งค่า Cookie ให้อยู่นาน 1 ปี (เพื่อรองรับ Superadmin)
+    app.config.update(config)
+
+    _configure_logging(app)
+    db.init_app(app)
+    cache.init_app(app, config={
+        'CACHE_TYPE': 'two_tier_cache.TwoTierCache',
+        'CACHE_DIR': os.environ.get('CACHE_DIR'),  # Default: the Flask instance folder
+        'CACHE_THRESHOLD': 500,  # Max entries held in each worker's L1
+        'CACHE_DEFAULT_TIMEOUT': 300
+    })
+    # Alembic adds ~100 ms to every import and only 'flask db ...' uses it, so it is attached
+    # only when the app is loaded by the flask command line, never in gunicorn workers.
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db, include_object=_include_in_migrations)
+    return app
 
 # --- Cloudinary Configuration ---
-cloudinary.config(
-    cloud_name=os.environ.get('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.environ.get('CLOUDINARY_API_KEY'),
-    api_secret=os.environ.get('CLOUDINARY_API_SECRET'),
-    secure=True
-)
-
-db = SQLAlchemy(app)
-
-# --- Cache Configuration ---
-# To fix the DeprecationWarning, we use the full path to the backend class.
-cache = Cache(app, config={
-    'CACHE_TYPE': 'flask_caching.backends.SimpleCache', 
-    'CACHE_DEFAULT_TIMEOUT': 300
-})
+_cloudinary = None
+
+def cloudinary_sdk():
+    """The Cloudinary SDK, imported and configured on first use; most requests never call Cloudinary."""
+    global _cloudinary
+    if _cloudinary is None:
+        import cloudinary
+        import cloudinary.api
+        import cloudinary.uploader
+        import cloudinary.utils
+        cloudinary.config(
+            cloud_name=os.environ.get('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.environ.get('CLOUDINARY_API_KEY'),
+            api_secret=os.environ.get('CLOUDINARY_API_SECRET'),
+            secure=True
+        )
+        _cloudinary = cloudinary
+    return _cloudinary
+
+# --- Search Index Configuration ---
+# Each worker keeps its own n-gram index. It only narrows the LIKE backend, so where a full-text
+# index exists (see get_search_backend) it serves just the keywords full-text search does not take:
+# ID-shaped and too-short ones. It is built on the first such search. Rows inserted or updated
+# (by any worker) since its snapshot are always re-checked against the database, so a stale index
+# costs speed, never results. It is rebuilt in a background thread once older than SEARCH_INDEX_MAX_AGE seconds.
+app.config.setdefault('SEARCH_INDEX_ENABLED', True)
+app.config.setdefault('SEARCH_INDEX_MAX_AGE', 600)
+# Rows updated up to this many seconds before a snapshot started are re-checked too, covering
+# transactions that were still open (not yet visible) while the snapshot was read.
+app.config.setdefault('SEARCH_INDEX_COMMIT_LAG', 300)
+# Keywords matching more candidates than this are not selective; plain LIKE is used instead.
+app.config.setdefault('SEARCH_INDEX_MAX_CANDIDATES', 2000)
+# 'auto' picks the full-text engine matching the database dialect; 'like' forces the LIKE fallback.
+app.config.setdefault('SEARCH_BACKEND', 'auto')
+
+# --- Customer ID Allocation ---
+# Each worker reserves this many customer IDs at a time from the id_sequences table.
+app.config.setdefault('CUSTOMER_ID_BLOCK_SIZE', 20)
+
+# --- Background Tasks ---
+# Each web worker runs one queue worker thread for slow side effects (Cloudinary deletions, ...).
+# Set TASK_WORKER_ENABLED=0 when a separate 'flask run-task-worker' process does the work instead.
+app.config.setdefault('TASK_WORKER_ENABLED', os.environ.get('TASK_WORKER_ENABLED', '1') == '1')
+app.config.setdefault('TASK_WORKER_POLL_INTERVAL', 5)  # seconds between checks for due retries
 
 
 # =================================================================================
@@ -120,19 +229,45 @@ class CustomerRecord(db.Model):
     home_location_link = db.Column(db.Text)
     work_location_link = db.Column(db.Text)
     remarks = db.Column(db.Text)
-    image_urls = db.Column(db.Text)
+    # REVISED: Photos live in customer_images (see `images`). The old comma-joined column is kept only so
+    # legacy imports can still fill it for 'flask backfill-customer-images'; the app never loads it.
+    legacy_image_urls = db.deferred(db.Column('image_urls', db.Text))
     logged_in_user = db.Column(db.String(100))
     inspection_date = db.Column(db.Date)
     inspection_time = db.Column(db.Time)
     inspector = db.Column(db.String(255))
+    # NEW: Digits-only copies of the free-form phone / ID card values for indexed exact and prefix lookups.
+    mobile_phone_digits = db.Column(db.String(100), index=True)
+    id_card_digits = db.Column(db.String(100), index=True)
+    # NEW: Set on every ORM / Core UPDATE; the search index re-checks rows changed since its snapshot.
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), index=True)
 
     # NEW: Add a Full-Text Search index for faster, more relevant text searching.
+    # The ngram parser is required for Thai, which has no spaces between words.
     __table_args__ = (
-        db.Index('ix_customer_records_fulltext', 'first_name', 'last_name', 'business_name', 'remarks', mysql_prefix='FULLTEXT'),
+        db.Index('ix_customer_records_fulltext', 'first_name', 'last_name', 'business_name', 'remarks', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+        # Listing order (timestamp DESC, id DESC) and the status-filtered search
+        db.Index('ix_customer_records_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_customer_records_status_timestamp', 'status', 'timestamp'),
     )
 
-    def to_dict(self):
-        """Converts the object to a dictionary, matching the old Google Sheet format."""
+    @validates('mobile_phone', 'id_card_number')
+    def _sync_digits_columns(self, key, value):
+        """Keeps the digits-only lookup columns in step with every write through the ORM."""
+        shadow_column = 'mobile_phone_digits' if key == 'mobile_phone' else 'id_card_digits'
+        setattr(self, shadow_column, digits_only(value))
+        return value
+
+    @property
+    def image_urls(self):
+        """Comma-joined photo URLs, in gallery order (the format of the old image_urls column)."""
+        return ','.join(image.url for image in self.images) or None
+
+    def to_dict(self, include_images=True):
+        """
+        Converts the object to a dictionary, matching the old Google Sheet format.
+        include_images=False leaves out 'Image URLs' so listings that never show photos skip that query.
+        """
         return {
             'row_index': self.id, # Use DB id as the unique row identifier
             'Timestamp': self.timestamp.strftime('%Y-%m-%d %H:%M:%S') if self.timestamp else '',
@@ -161,7 +296,7 @@ class CustomerRecord(db.Model):
             'ลิงค์โลเคชั่นบ้าน': self.home_location_link,
             'ลิงค์โลเคชั่นที่ทำงาน': self.work_location_link,
             'หมายเหตุ': self.remarks,
-            'Image URLs': self.image_urls,
+            'Image URLs': self.image_urls if include_images else None,
             'Logged In User': self.logged_in_user,
             'วันที่นัดตรวจ': self.inspection_date.strftime('%Y-%m-%d') if self.inspection_date else '',
             'เวลานัดตรวจ': self.inspection_time.strftime('%H:%M:%S') if self.inspection_time else '',
@@ -184,7 +319,72 @@ class Approval(db.Model):
     approved_amount = db.Column(db.DECIMAL(15, 2))
     assigned_company = db.Column(db.String(255))
     registrar = db.Column(db.String(255))
-    contract_image_urls = db.Column(db.Text)
+    # REVISED: The customer's photos copied at approval are rows in customer_images (see `contract_images`).
+    legacy_contract_image_urls = db.deferred(db.Column('contract_image_urls', db.Text))
+
+    __table_args__ = (
+        db.Index('ix_approvals_customer_id', 'customer_id'),
+        db.Index('ix_approvals_approval_date', 'approval_date'),
+    )
+
+# NEW: One row per photo, replacing the comma-joined image_urls / contract_image_urls TEXT columns.
+class CustomerImage(db.Model):
+    """A photo of a customer record, or a copy of it attached to that customer's approval (loan)."""
+    __tablename__ = 'customer_images'
+    id = db.Column(db.Integer, primary_key=True)
+    # Exactly one owner is set
+    customer_record_id = db.Column(db.Integer, db.ForeignKey('customer_records.id', ondelete='CASCADE'))
+    approval_id = db.Column(db.Integer, db.ForeignKey('approvals.id', ondelete='CASCADE'))
+    url = db.Column(db.Text, nullable=False)  # TEXT like the legacy columns, so no stored URL is ever cut short
+    public_id = db.Column(db.String(255))
+    position = db.Column(db.Integer, nullable=False, default=0)
+    bytes = db.Column(db.Integer)  # size reported by Cloudinary at upload, when known
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+
+    __table_args__ = (
+        db.Index('ix_customer_images_customer_position', 'customer_record_id', 'position'),
+        db.Index('ix_customer_images_approval_position', 'approval_id', 'position'),
+    )
+
+    @classmethod
+    def from_urls(cls, urls, sizes=None, start=0):
+        """New (unattached) rows for `urls` in order; `sizes` maps a URL to its byte size."""
+        sizes = sizes or {}
+        return [cls(url=url, public_id=public_id_from_url(url), position=start + i, bytes=sizes.get(url))
+                for i, url in enumerate(urls)]
+
+    def copy(self):
+        return CustomerImage(url=self.url, public_id=self.public_id, position=self.position, bytes=self.bytes)
+
+# NEW: Append-only history of customer status changes (replaces notes appended to remarks)
+class CustomerStatusEvent(db.Model):
+    __tablename__ = 'customer_status_events'
+    id = db.Column(db.Integer, primary_key=True)
+    customer_record_id = db.Column(db.Integer, db.ForeignKey('customer_records.id', ondelete='CASCADE'), nullable=False)
+    from_status = db.Column(db.String(100))
+    to_status = db.Column(db.String(100))
+    note = db.Column(db.Text)
+    actor = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+    __table_args__ = (db.Index('ix_customer_status_events_customer_created', 'customer_record_id', 'created_at'),)
+
+    def to_dict(self):
+        return {
+            'from_status': self.from_status,
+            'to_status': self.to_status,
+            'note': self.note,
+            'actor': self.actor,
+            # Stored in UTC; shown in Thai time like the login history
+            'timestamp': (self.created_at + timedelta(hours=7)).strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+        }
+
+CustomerRecord.status_events = db.relationship(CustomerStatusEvent, lazy='dynamic', cascade='all, delete-orphan',
+                                               order_by=(CustomerStatusEvent.created_at.desc(), CustomerStatusEvent.id.desc()))
+CustomerRecord.images = db.relationship(CustomerImage, order_by=CustomerImage.position,
+                                        foreign_keys=CustomerImage.customer_record_id, cascade='all, delete-orphan')
+Approval.contract_images = db.relationship(CustomerImage, order_by=CustomerImage.position,
+                                           foreign_keys=CustomerImage.approval_id, cascade='all, delete-orphan')
 
 class BadDebtRecord(db.Model):
     __tablename__ = 'bad_debt_records'
@@ -198,6 +398,8 @@ class BadDebtRecord(db.Model):
     marked_by = db.Column(db.String(100))
     notes = db.Column(db.Text)
 
+    __table_args__ = (db.Index('ix_bad_debt_records_timestamp', 'timestamp'),)
+
 class PullPlugRecord(db.Model):
     __tablename__ = 'pull_plug_records'
     id = db.Column(db.Integer, primary_key=True)
@@ -209,6 +411,8 @@ class PullPlugRecord(db.Model):
     marked_by = db.Column(db.String(100))
     notes = db.Column(db.Text)
 
+    __table_args__ = (db.Index('ix_pull_plug_records_timestamp', 'timestamp'),)
+
 class ReturnPrincipalRecord(db.Model):
     __tablename__ = 'return_principal_records'
     id = db.Column(db.Integer, primary_key=True)
@@ -220,6 +424,8 @@ class ReturnPrincipalRecord(db.Model):
     marked_by = db.Column(db.String(100))
     notes = db.Column(db.Text)
 
+    __table_args__ = (db.Index('ix_return_principal_records_timestamp', 'timestamp'),)
+
 class AllPidJob(db.Model):
     __tablename__ = 'all_pid_jobs'
     id = db.Column(db.Integer, primary_key=True)
@@ -243,6 +449,13 @@ class AllPidJob(db.Model):
     table3_lost_amount = db.Column(db.DECIMAL(15, 2), default=0)
     main_assigned_company = db.Column(db.String(255))
 
+    __table_args__ = (
+        # Per-customer balance / latest interest, newest first
+        db.Index('ix_all_pid_jobs_customer_date_time', 'customer_id', 'transaction_date', 'transaction_time'),
+        # /api/daily-jobs: one date, optionally one company, ordered by time
+        db.Index('ix_all_pid_jobs_date_company_time', 'transaction_date', 'company_name', 'transaction_time'),
+    )
+
     def to_dict(self):
         """Converts the AllPidJob object to a dictionary for API responses."""
         return {
@@ -267,6 +480,66 @@ class AllPidJob(db.Model):
             'Table3_LostAmount': float(self.table3_lost_amount) if self.table3_lost_amount is not None else None,
         }
 
+# NEW: Long-format ledger, one row per (job, table, action) amount. all_pid_jobs keeps its wide layout as the
+# compatibility view read by /api/daily-jobs; every ORM insert there is mirrored here (see _mirror_jobs_to_ledger).
+LEDGER_ACTIONS = ('opening_balance', 'net_opening', 'principal_returned', 'lost_amount')
+LEDGER_TABLE_NUMBERS = (1, 2, 3)
+
+class LedgerEntry(db.Model):
+    __tablename__ = 'ledger_entries'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('all_pid_jobs.id', ondelete='CASCADE'), nullable=False)
+    customer_id = db.Column(db.String(50))
+    transaction_date = db.Column(db.Date)
+    transaction_time = db.Column(db.Time)
+    company_name = db.Column(db.String(255))
+    table_no = db.Column(db.SmallInteger, nullable=False)
+    action = db.Column(db.String(30), nullable=False)  # One of LEDGER_ACTIONS
+    amount = db.Column(db.DECIMAL(15, 2), nullable=False)
+
+    job = db.relationship('AllPidJob', backref=db.backref('ledger_entries', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.UniqueConstraint('job_id', 'table_no', 'action', name='uq_ledger_entries_job_table_action'),
+        db.Index('ix_ledger_entries_customer_action', 'customer_id', 'action'),
+        db.Index('ix_ledger_entries_date_company_time', 'transaction_date', 'company_name', 'transaction_time'),
+    )
+
+    @classmethod
+    def entries_for_job(cls, job):
+        """One entry per non-zero table{n}_{action} amount of a wide AllPidJob row."""
+        entries = []
+        for table_no in LEDGER_TABLE_NUMBERS:
+            for action in LEDGER_ACTIONS:
+                amount = getattr(job, f'table{table_no}_{action}')
+                if amount is not None and Decimal(str(amount)) != 0:
+                    entries.append(cls(job=job, customer_id=job.customer_id, transaction_date=job.transaction_date,
+                                       transaction_time=job.transaction_time, company_name=job.company_name,
+                                       table_no=table_no, action=action, amount=amount))
+        return entries
+
+@event.listens_for(db.session, 'before_flush')
+def _mirror_jobs_to_ledger(session, flush_context, instances):
+    """Dual-writes every new AllPidJob into ledger_entries within the same flush."""
+    for obj in list(session.new):
+        if isinstance(obj, AllPidJob) and not obj.ledger_entries:
+            session.add_all(LedgerEntry.entries_for_job(obj))
+
+# NEW: Running totals of all_pid_jobs per customer, updated in the same transaction as every ledger write.
+class CustomerLoanSummary(db.Model):
+    __tablename__ = 'customer_loan_summary'
+    customer_id = db.Column(db.String(50), primary_key=True)
+    total_given_out = db.Column(db.DECIMAL(15, 2), nullable=False, default=0)
+    total_returned = db.Column(db.DECIMAL(15, 2), nullable=False, default=0)
+    total_lost = db.Column(db.DECIMAL(15, 2), nullable=False, default=0)
+    last_interest = db.Column(db.DECIMAL(15, 2))
+    last_interest_date = db.Column(db.Date)
+    last_interest_time = db.Column(db.Time)
+    last_transaction_date = db.Column(db.Date)
+    last_transaction_time = db.Column(db.Time)
+    status = db.Column(db.String(100))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+
 class ContractDocument(db.Model):
     __tablename__ = 'contract_documents'
     id = db.Column(db.Integer, primary_key=True)
@@ -275,12 +548,76 @@ class ContractDocument(db.Model):
     uploaded_by = db.Column(db.String(100))
     upload_timestamp = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
 
+    __table_args__ = (db.Index('ix_contract_documents_customer_uploaded', 'customer_id', 'upload_timestamp'),)
+
+class IdSequence(db.Model):
+    """Next free value of each named id sequence, handed out in blocks by BlockIdAllocator."""
+    __tablename__ = 'id_sequences'
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False)
+
+# NEW: Pre-aggregated customer counts for the dashboard charts, kept current by track_rollups() below.
+class CustomerMonthlyRollup(db.Model):
+    """Customers per (year, month, main_customer_group) of application_date."""
+    __tablename__ = 'customer_monthly_rollup'
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    main_customer_group = db.Column(db.String(255), primary_key=True)  # '' when not set
+    customer_count = db.Column(db.Integer, nullable=False, default=0)
+
+class CustomerChannelProvinceRollup(db.Model):
+    """Customers per (year, month, province, application_channel, main_customer_group)."""
+    __tablename__ = 'customer_channel_province_rollup'
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    # Shorter than the source columns so the composite primary key fits MySQL's index size limit.
+    province = db.Column(db.String(150), primary_key=True)
+    application_channel = db.Column(db.String(150), primary_key=True)
+    main_customer_group = db.Column(db.String(150), primary_key=True)
+    customer_count = db.Column(db.Integer, nullable=False, default=0)
+
 class LoginHistory(db.Model):
     __tablename__ = 'login_history'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), nullable=False)
     login_timestamp = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
 
+    __table_args__ = (db.Index('ix_login_history_login_timestamp', 'login_timestamp'),)
+
+# NEW: Responses of write endpoints, keyed by the client's Idempotency-Key header (see @idempotent)
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), nullable=False)
+    idempotency_key = db.Column(db.String(100), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    # NULL until the original request has produced its response
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+    __table_args__ = (
+        db.UniqueConstraint('username', 'idempotency_key', name='uq_idempotency_keys_username_key'),
+        db.Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+# NEW: Durable queue of slow side effects, run off the request path by task_queue.TaskQueue
+class BackgroundTask(db.Model):
+    __tablename__ = 'background_tasks'
+    id = db.Column(db.Integer, primary_key=True)
+    task_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending / running / dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(32))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_background_tasks_status_run_after', 'status', 'run_after'),)
+
 
 # =================================================================================
 # AUTHENTICATION & DECORATORS
@@ -324,6 +661,101 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# NEW: Idempotency-Key support for write endpoints, so a double tap on a slow connection is booked once.
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_PRUNE_INTERVAL = 600  # seconds between TTL prunes, per worker
+# A claim is only visible once the view's writes have committed, so one still unfinished after this long means
+# the worker died before storing the response. The view must not run again; the key is closed as "outcome unknown".
+IDEMPOTENCY_PENDING_TIMEOUT = timedelta(minutes=2)
+IDEMPOTENCY_UNKNOWN_OUTCOME = {'success': False, 'error': 'The request with this Idempotency-Key was saved but its response was lost; '
+                                                          'check the record before sending it again with a new key'}
+MAX_IDEMPOTENCY_KEY_LENGTH = 100
+_idempotency_last_pruned = 0.0
+
+def _prune_idempotency_keys():
+    """Deletes keys older than the TTL, at most once per IDEMPOTENCY_PRUNE_INTERVAL in this worker."""
+    global _idempotency_last_pruned
+    now = time.time()
+    if now - _idempotency_last_pruned < IDEMPOTENCY_PRUNE_INTERVAL:
+        return
+    _idempotency_last_pruned = now
+    cutoff = (datetime.now(UTC) - IDEMPOTENCY_KEY_TTL).replace(tzinfo=None)
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+def _replay_idempotent_response(username, key, request_hash):
+    """
+    The stored response for `key`, an error response if it cannot be replayed, or None if the key is new.
+    A claim left unfinished for IDEMPOTENCY_PENDING_TIMEOUT is completed with a 409 "outcome unknown" response.
+    """
+    record = IdempotencyKey.query.filter_by(username=username, idempotency_key=key).first()
+    if record is None:
+        return None
+    if record.endpoint != request.endpoint or record.request_hash != request_hash:
+        return jsonify({'success': False, 'error': 'Idempotency-Key was already used for a different request'}), 422
+    if record.status_code is None:
+        stale_before = (datetime.now(UTC) - IDEMPOTENCY_PENDING_TIMEOUT).replace(tzinfo=None)
+        if record.created_at.replace(tzinfo=None) >= stale_before:
+            return jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still being processed'}), 409
+        # Conditional update: if the original request stored its response meanwhile, that response is kept.
+        IdempotencyKey.query.filter_by(id=record.id, status_code=None).update(
+            {'status_code': 409, 'response_body': json.dumps(IDEMPOTENCY_UNKNOWN_OUTCOME)}, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(record)
+    response = Response(record.response_body, status=record.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(f):
+    """
+    Makes a JSON write endpoint safe to retry. Without an Idempotency-Key header the view runs as usual.
+    With one, the key is claimed in the view's own transaction, so it only persists if the view's writes
+    commit; a repeat of the key then gets the stored response back without running the view again.
+    Must be applied below @login_required (keys are scoped per user). 5xx responses are not stored.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({'success': False, 'error': 'Idempotency-Key is too long'}), 400
+
+        username = session.get('username')
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        _prune_idempotency_keys()
+        replay = _replay_idempotent_response(username, key, request_hash)
+        if replay is not None:
+            return replay
+
+        record = IdempotencyKey(username=username, idempotency_key=key, endpoint=request.endpoint,
+                                request_hash=request_hash, created_at=datetime.now(UTC))
+        try:
+            # Flushing takes the unique index entry now; a concurrent duplicate waits here or fails.
+            db.session.add(record)
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return _replay_idempotent_response(username, key, request_hash) or (
+                jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still being processed'}), 409)
+
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code >= 500:
+            # The view rolled back (taking the claim with it); make sure nothing is left pending.
+            db.session.rollback()
+            return response
+
+        try:
+            record.status_code = response.status_code
+            record.response_body = response.get_data(as_text=True)
+            db.session.add(record)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return _replay_idempotent_response(username, key, request_hash) or response
+        return response
+    return decorated_function
+
 # REFACTORED: Now loads users from the database
 @cache.cached(timeout=60, key_prefix='user_login_data')
 def load_users():
@@ -350,23 +782,412 @@ def get_all_customer_records():
         current_app.logger.error(f"Error fetching customer records: {e}")
         return []
 
-# REFACTORED: Generates next ID based on the database's max ID.
+# NEW: Keyset pagination over (timestamp, id) so large listings never load the whole table.
+CUSTOMER_STREAM_BATCH_SIZE = 500
+
+def encode_customer_cursor(record):
+    """Builds a keyset cursor string from a record's (timestamp, id) sort key."""
+    timestamp_str = record.timestamp.isoformat() if record.timestamp else ''
+    return f"{timestamp_str}_{record.id}"
+
+def decode_customer_cursor(cursor):
+    """Parses a cursor from encode_customer_cursor(). Raises ValueError if it is malformed."""
+    timestamp_str, _, id_str = cursor.rpartition('_')
+    timestamp = datetime.fromisoformat(timestamp_str) if timestamp_str else None
+    return timestamp, int(id_str)
+
+def iter_customer_records(after=None, limit=None, batch_size=CUSTOMER_STREAM_BATCH_SIZE):
+    """
+    Yields CustomerRecord objects newest-first, starting after the given (timestamp, id) key.
+    Rows are fetched with yield_per, so only one batch is held in memory at a time.
+    """
+    query = CustomerRecord.query.order_by(CustomerRecord.timestamp.desc(), CustomerRecord.id.desc())
+    if after is not None:
+        after_timestamp, after_id = after
+        if after_timestamp is None:
+            # NULL timestamps sort last in descending order (MySQL and SQLite), so only the NULL tail remains.
+            query = query.filter(CustomerRecord.timestamp.is_(None), CustomerRecord.id < after_id)
+        else:
+            query = query.filter(or_(
+                CustomerRecord.timestamp < after_timestamp,
+                and_(CustomerRecord.timestamp == after_timestamp, CustomerRecord.id < after_id),
+                CustomerRecord.timestamp.is_(None)
+            ))
+    if limit is not None:
+        query = query.limit(limit)
+    yield from query.yield_per(batch_size)
+
+# REVISED: Customer IDs come from a hi/lo block allocator instead of scanning MAX(customer_id) per insert.
+def _initial_customer_id(conn):
+    """Seeds the sequence from the highest existing numeric ID (runs once, when the sequence row is created)."""
+    last_id_scalar = conn.execute(db.select(func.max(func.cast(CustomerRecord.customer_id, db.Integer)))).scalar()
+    # If no records exist, start from 1001. Otherwise, take the last number and add 1.
+    return (last_id_scalar or 1000) + 1
+
+customer_id_allocator = BlockIdAllocator(
+    IdSequence.__table__, 'customer_id',
+    # Read when a block is reserved, so create_app(config) can still override it after import
+    block_size=lambda: app.config['CUSTOMER_ID_BLOCK_SIZE'],
+    initial_value=_initial_customer_id
+)
+
 def generate_next_customer_id():
-    """Generates a new numeric customer ID based on the last ID in the database."""
+    """Returns a new numeric customer ID that is unique across all workers."""
     try:
-        # This query finds the highest numeric ID by casting the column to an integer.
-        # This is more robust than string parsing.
-        last_id_scalar = db.session.query(func.max(func.cast(CustomerRecord.customer_id, db.Integer))).scalar()
-        
-        # If no records exist, start from 1001. Otherwise, take the last number and add 1.
-        next_id_num = (last_id_scalar or 1000) + 1
-        return f"{next_id_num}"
-
+        return f"{customer_id_allocator.next_id(db.engine)}"
     except Exception as e:
         current_app.logger.error(f"Error generating next customer ID: {e}")
         # Fallback to a timestamp-based ID to avoid collision
         return f"ERR-{int(datetime.now().timestamp())}"
 
+# NEW: Background task queue. Requests enqueue in their own transaction and return; workers do the slow part.
+task_queue = TaskQueue(BackgroundTask.__table__)
+task_queue.watch(db.session)
+_task_worker_lock = threading.Lock()
+_task_worker_thread = None
+
+CLOUDINARY_UPLOAD_FOLDER = 'customer_app_images'
+
+# Kept so 'cloudinary.destroy' tasks queued before batching existed still run
+@task_queue.task('cloudinary.destroy')
+def _destroy_cloudinary_image(payload):
+    result = cloudinary_sdk().uploader.destroy(payload['public_id'])
+    # 'not found' means an earlier attempt (or someone else) already removed it
+    if result.get('result') not in ('ok', 'not found'):
+        raise RuntimeError(f"Cloudinary destroy of {payload['public_id']} returned {result}")
+    current_app.logger.info(f"Successfully deleted image {payload['public_id']} from Cloudinary.")
+
+@task_queue.task('cloudinary.delete_resources')
+def _delete_cloudinary_resources(payload):
+    # One Admin API call for up to 100 assets; a retry resends the whole chunk, which is harmless ('not_found').
+    failed = delete_batch(cloudinary_sdk().api, payload['public_ids'])
+    if failed:
+        raise RuntimeError(f"Cloudinary could not delete {len(failed)} of {len(payload['public_ids'])} assets: {failed[:10]}")
+    current_app.logger.info(f"Deleted {len(payload['public_ids'])} images from Cloudinary.")
+
+def enqueue_public_id_deletions(public_ids):
+    """Queues deletion of `public_ids` in delete_resources-sized chunks, to run once the current transaction commits."""
+    for chunk in chunked(public_ids):
+        task_queue.enqueue(db.session, 'cloudinary.delete_resources', {'public_ids': chunk})
+
+def enqueue_cloudinary_deletions(urls):
+    """Queues the Cloudinary assets behind `urls` for deletion once the current transaction commits."""
+    enqueue_public_id_deletions(public_ids_from_urls(urls))
+
+def referenced_cloudinary_public_ids():
+    """
+    Every public_id some stored URL still points at (customer photos, loan copies, contract documents),
+    including the legacy image_urls / contract_image_urls columns that migrate_data.py still fills and
+    that keep their URLs until `flask backfill-customer-images` has run.
+    """
+    referenced = {public_id for (public_id,) in db.session.execute(
+        db.select(CustomerImage.public_id).where(CustomerImage.public_id.isnot(None)).distinct())}
+    url_columns = (ContractDocument.document_url, CustomerRecord.legacy_image_urls, Approval.legacy_contract_image_urls)
+    for column in url_columns:
+        for (value,) in db.session.execute(db.select(column).where(column.isnot(None)).execution_options(yield_per=1000)):
+            referenced.update(public_ids_from_urls(split_urls(value)))
+    return referenced
+
+# NEW: Status history
+STATUS_EVENTS_DEFAULT_LIMIT = 20
+
+def record_status_change(customer, new_status, note=None):
+    """Sets the customer's status and appends a status event in the same transaction (no-op if unchanged and no note)."""
+    old_status = customer.status
+    note = (note or '').strip() or None
+    if new_status == old_status and note is None:
+        return None
+    customer.status = new_status
+    event = CustomerStatusEvent(from_status=old_status, to_status=new_status, note=note, actor=session.get('username'))
+    customer.status_events.append(event)
+    return event
+
+# NEW: customer_images maintenance
+def uploaded_image_sizes(form):
+    """{url: bytes} sent by the upload forms next to the URLs (optional; missing or bad values are ignored)."""
+    try:
+        sizes = json.loads(form.get('image_sizes') or '{}')
+    except ValueError:
+        return {}
+    return {url: int(size) for url, size in sizes.items() if isinstance(size, (int, float))} if isinstance(sizes, dict) else {}
+
+def sync_customer_images(customer, urls, sizes=None):
+    """
+    Makes customer.images match `urls` (in order) touching only what changed: removed photos are deleted,
+    new ones inserted, and kept ones only updated when their position moved. Returns the removed URLs.
+    """
+    wanted = list(dict.fromkeys(urls))
+    existing = {image.url: image for image in customer.images}
+    removed = [url for url in existing if url not in wanted]
+    for url in removed:
+        customer.images.remove(existing[url])
+    for position, url in enumerate(wanted):
+        image = existing.get(url)
+        if image is None:
+            image, = CustomerImage.from_urls([url], sizes, start=position)
+            customer.images.append(image)
+        elif image.position != position:
+            image.position = position
+    return removed
+
+def backfill_customer_images():
+    """
+    Moves photo URLs from the legacy comma-joined columns into customer_images for rows that have
+    none yet (e.g. data loaded by migrate_data.py), and clears the legacy value in the same
+    transaction so photos deleted later are not brought back by the next run.
+    Does not commit; returns the number of rows added.
+    """
+    added = 0
+    for model, column, owner in ((CustomerRecord, CustomerRecord.legacy_image_urls, CustomerImage.customer_record_id),
+                                 (Approval, Approval.legacy_contract_image_urls, CustomerImage.approval_id)):
+        owner_key = owner.key
+        pending = db.select(model.id, column).where(
+            column.isnot(None), column != '', ~db.exists().where(owner == model.id))
+        rows, owner_ids = [], []
+        for owner_id, value in db.session.execute(pending).all():
+            owner_ids.append(owner_id)
+            # Same duplicate handling as the 9d2b7e4f1c83 migration: the first occurrence keeps its position
+            for image in CustomerImage.from_urls(dict.fromkeys(split_urls(value))):
+                rows.append({owner_key: owner_id, 'url': image.url, 'public_id': image.public_id,
+                             'position': image.position, 'created_at': datetime.now(UTC)})
+        if rows:
+            db.session.execute(db.insert(CustomerImage), rows)
+            added += len(rows)
+        for chunk in chunked(owner_ids, 1000):
+            db.session.execute(db.update(model).where(model.id.in_(chunk)).values({column: None}))
+    return added
+
+def _run_task_worker():
+    with app.app_context():
+        task_queue.run_forever(db.engine, poll_interval=app.config['TASK_WORKER_POLL_INTERVAL'])
+
+@app.before_request
+def start_task_worker():
+    """Starts this process's queue worker thread on its first request (i.e. after gunicorn has forked)."""
+    global _task_worker_thread
+    if _task_worker_thread is not None or app.testing or not app.config['TASK_WORKER_ENABLED']:
+        return
+    with _task_worker_lock:
+        if _task_worker_thread is None:
+            _task_worker_thread = task_queue.start_thread(_run_task_worker)
+
+# NEW: In-process n-gram search index over the columns searched by search_customer_data.
+SEARCH_INDEX_COLUMNS = ('customer_id', 'first_name', 'last_name', 'mobile_phone', 'id_card_number', 'business_name', 'remarks')
+customer_search_index = NgramIndex(n=2)
+
+def _search_index_rows(after_id=0):
+    """Yields (id, searchable values) for customers with an id above after_id, in id order."""
+    columns = [getattr(CustomerRecord, name) for name in SEARCH_INDEX_COLUMNS]
+    query = db.session.query(CustomerRecord.id, *columns).filter(CustomerRecord.id > after_id).order_by(CustomerRecord.id)
+    for row in query.yield_per(5000):
+        yield row[0], row[1:]
+
+# Rows with updated_at at or after this were changed after (or while) the current snapshot was read.
+_search_index_changed_since = None
+_search_index_rebuild_lock = threading.Lock()
+
+def rebuild_customer_search_index():
+    """Rebuilds this worker's search index from the customer_records table."""
+    global _search_index_changed_since
+    snapshot_started = datetime.now(UTC)
+    customer_search_index.rebuild(_search_index_rows())
+    # Set after the swap: a search in between pairs the new postings with the older (wider) watermark.
+    _search_index_changed_since = snapshot_started - timedelta(seconds=app.config['SEARCH_INDEX_COMMIT_LAG'])
+
+def _rebuild_search_index_in_background(flask_app):
+    with flask_app.app_context():
+        try:
+            rebuild_customer_search_index()
+        except Exception as e:
+            flask_app.logger.error(f"Error rebuilding the search index: {e}")
+        finally:
+            db.session.remove()
+            _search_index_rebuild_lock.release()
+
+def refresh_customer_search_index():
+    """
+    Starts a rebuild when the index was never built or is older than SEARCH_INDEX_MAX_AGE.
+    The rebuild runs in a background thread, so searches keep using the previous index
+    (or plain LIKE before the first build) instead of waiting for a full table read.
+    """
+    built_at = customer_search_index.built_at
+    if built_at is not None and time.monotonic() - built_at <= app.config['SEARCH_INDEX_MAX_AGE']:
+        return
+    if not _search_index_rebuild_lock.acquire(blocking=False):
+        return  # a rebuild is already running
+    if current_app.testing:
+        # Tests share one in-memory SQLite connection, which a second thread must not use.
+        try:
+            rebuild_customer_search_index()
+        finally:
+            _search_index_rebuild_lock.release()
+        return
+    threading.Thread(target=_rebuild_search_index_in_background, args=(current_app._get_current_object(),),
+                     name='search-index-rebuild', daemon=True).start()
+
+def index_customer_record(record):
+    """Re-indexes a customer after a committed insert or edit (no-op until the index is built)."""
+    if customer_search_index.built_at is not None:
+        customer_search_index.add(record.id, [getattr(record, name) for name in SEARCH_INDEX_COLUMNS])
+
+def search_index_recheck_filter():
+    """Rows the index may not reflect: inserted after its snapshot, or updated by any worker since."""
+    return or_(CustomerRecord.id > customer_search_index.max_id,
+               CustomerRecord.updated_at >= _search_index_changed_since)
+
+def find_search_candidates(keyword):
+    """
+    Returns (ids of customers that may match `keyword`, filter for the rows the index
+    may not reflect yet), or None when the index cannot help (disabled, not built yet,
+    keyword too short, too many candidates or an error).
+    """
+    if not app.config['SEARCH_INDEX_ENABLED']:
+        return None
+    try:
+        refresh_customer_search_index()
+        if customer_search_index.built_at is None or _search_index_changed_since is None:
+            return None
+        # Read the watermarks before the postings: a rebuild swapping in meanwhile only widens the recheck.
+        recheck = search_index_recheck_filter()
+        candidate_ids = customer_search_index.candidates(keyword)
+    except Exception as e:
+        current_app.logger.error(f"Error using search index for '{keyword}': {e}")
+        return None
+    if candidate_ids is None or len(candidate_ids) > app.config['SEARCH_INDEX_MAX_CANDIDATES']:
+        return None
+    return candidate_ids, recheck
+
+# NEW: Full-text search backends. The full-text index covers the name, business and remarks
+# columns; numeric keywords (IDs, phone and ID card numbers) use the digits-only columns instead,
+# and other ID-shaped keywords ('PID-10', ASCII text) use LIKE, which also searches customer_id,
+# mobile_phone and id_card_number.
+FULLTEXT_COLUMNS = ('first_name', 'last_name', 'business_name', 'remarks')
+DIGITS_COLUMNS = ('customer_id', 'mobile_phone_digits', 'id_card_digits')
+like_search_backend = LikeSearchBackend(CustomerRecord, SEARCH_INDEX_COLUMNS, candidates=find_search_candidates)
+digits_search_backend = DigitsSearchBackend(CustomerRecord, DIGITS_COLUMNS)
+fulltext_search_backends = {
+    'mysql': MySQLFulltextBackend(CustomerRecord, FULLTEXT_COLUMNS, 'ix_customer_records_fulltext'),
+    'sqlite': SQLiteFTS5Backend(CustomerRecord, FULLTEXT_COLUMNS, 'customer_records_fts'),
+}
+fulltext_search_backends['sqlite'].register_ddl(CustomerRecord.__table__)
+
+def get_search_backend(keyword):
+    """
+    Chooses the search engine for a keyword based on SEARCH_BACKEND and the database dialect.
+    Full-text engines win over the n-gram narrowed LIKE scan for every keyword they support.
+    """
+    if app.config['SEARCH_BACKEND'] == 'like':
+        return like_search_backend
+    if digits_search_backend.supports(keyword):
+        return digits_search_backend
+    if looks_like_identifier(keyword):
+        return like_search_backend
+    backend = fulltext_search_backends.get(db.engine.dialect.name)
+    if backend and backend.supports(keyword) and backend.is_available(db.session):
+        return backend
+    return like_search_backend
+
+def build_customer_search_query(search_keyword, status_filter=''):
+    """Builds the filtered CustomerRecord query and ORDER BY clauses used by the search page."""
+    base_query = CustomerRecord.query
+    order_by = [CustomerRecord.timestamp.desc()]
+
+    if search_keyword:
+        # REVISED: The keyword filter and its relevance ordering come from the chosen search backend.
+        base_query, order_by = get_search_backend(search_keyword).apply(base_query, search_keyword)
+
+    # NEW: Apply status filter if provided
+    if status_filter:
+        base_query = base_query.filter(CustomerRecord.status == status_filter)
+
+    return base_query, order_by
+
+# NEW: Which cached views each customer column feeds. Only the dashboard charts are cached, so a
+# write invalidates their tags when (and only when) a column they group by changes.
+CUSTOMER_FIELD_CACHE_TAGS = {
+    'application_date': ('charts:monthly', 'charts:channel_province'),
+    'main_customer_group': ('charts:monthly', 'charts:channel_province'),
+    'province': ('charts:channel_province',),
+    'application_channel': ('charts:channel_province',),
+}
+
+def changed_customer_fields(customer):
+    """Returns the names of the columns modified on `customer` since it was loaded (call before commit)."""
+    return {attr.key for attr in db.inspect(customer).attrs if attr.history.has_changes()}
+
+def invalidate_customer_caches(customer, changed_fields=None):
+    """Invalidates the cache tags fed by a customer; changed_fields=None means the whole record (insert/delete)."""
+    tags = set()
+    fields = CUSTOMER_FIELD_CACHE_TAGS if changed_fields is None else changed_fields
+    for field in fields:
+        tags.update(CUSTOMER_FIELD_CACHE_TAGS.get(field, ()))
+    if tags:
+        tagged_cache.invalidate(*sorted(tags))
+
+# NEW: Columns PATCH /api/customers/<id> may change, compiled once into per-field coercers.
+# status is left out: it goes through /update_customer_status so the change is logged in customer_status_events.
+CUSTOMER_PATCH_SCHEMA = FieldSchema(CustomerRecord.__table__, (
+    'first_name', 'last_name', 'id_card_number', 'mobile_phone', 'main_customer_group',
+    'sub_profession_group', 'other_sub_profession', 'is_registered', 'business_name', 'province',
+    'registered_address', 'desired_credit_limit', 'approved_credit_limit', 'applied_before',
+    'check_status', 'application_channel', 'assigned_company', 'upfront_interest_deduction',
+    'processing_fee', 'application_date', 'home_location_link', 'work_location_link', 'remarks',
+    'inspection_date', 'inspection_time', 'inspector',
+))
+
+# NEW: Chart rollups. Each key function maps a customer's grouped fields to its rollup row.
+def _application_year_month(values):
+    """(year, month) of a customer's application_date, which may still be a 'YYYY-MM-DD' string if assigned as one."""
+    application_date = values['application_date']
+    if isinstance(application_date, str):
+        try:
+            application_date = parse_date(application_date[:10])
+        except ValueError:
+            return None
+    if application_date is None:
+        return None
+    return application_date.year, application_date.month
+
+def _rollup_label(value, length):
+    return (value or '')[:length]
+
+def _monthly_rollup_key(values):
+    year_month = _application_year_month(values)
+    if year_month is None:
+        return None
+    return year_month + (_rollup_label(values['main_customer_group'], 255),)
+
+def _channel_province_rollup_key(values):
+    year_month = _application_year_month(values)
+    if year_month is None:
+        return None
+    return year_month + tuple(_rollup_label(values[name], 150) for name in ('province', 'application_channel', 'main_customer_group'))
+
+monthly_rollup = CountRollup(CustomerMonthlyRollup.__table__, _monthly_rollup_key)
+channel_province_rollup = CountRollup(CustomerChannelProvinceRollup.__table__, _channel_province_rollup_key)
+track_rollups(db.session, CustomerRecord, ('application_date', 'main_customer_group', 'province', 'application_channel'),
+              [monthly_rollup, channel_province_rollup])
+
+def rebuild_chart_rollups():
+    """Recomputes both rollup tables from customer_records in one transaction (after bulk imports or raw SQL edits)."""
+    year = func.extract('year', CustomerRecord.application_date)
+    month = func.extract('month', CustomerRecord.application_date)
+
+    def label(column, length):
+        return func.substr(func.coalesce(column, ''), 1, length)
+
+    group = label(CustomerRecord.main_customer_group, 255)
+    monthly_rollup.rebuild(db.session.connection(), db.select(year, month, group, func.count(CustomerRecord.id))
+                           .where(CustomerRecord.application_date.isnot(None)).group_by(year, month, group))
+
+    province = label(CustomerRecord.province, 150)
+    channel = label(CustomerRecord.application_channel, 150)
+    group = label(CustomerRecord.main_customer_group, 150)
+    channel_province_rollup.rebuild(db.session.connection(), db.select(year, month, province, channel, group, func.count(CustomerRecord.id))
+                                    .where(CustomerRecord.application_date.isnot(None)).group_by(year, month, province, channel, group))
+    db.session.commit()
+    tagged_cache.invalidate('charts:monthly', 'charts:channel_province')
+
 # NEW HELPER: Get a single customer by their database ID
 def get_customer_by_db_id(record_id):
     try:
@@ -439,10 +1260,31 @@ def dashboard(): # <-- แก้ชื่อฟังก์ชันตรงน
 
 @app.route('/customer_data')
 @login_required
-@cache.cached(timeout=30, key_prefix='customer_data_view')
 def customer_data():
-    all_records = get_all_customer_records()
-    return render_template('customer_data.html', customer_records=all_records)
+    """
+    Lists customers newest-first. Without `limit` the whole table is streamed row by row,
+    so memory stays flat; with `limit` (and an optional `after` cursor) one keyset page is rendered.
+    """
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after')
+    try:
+        after_key = decode_customer_cursor(after) if after else None
+    except ValueError:
+        flash('ลิงก์หน้าถัดไปไม่ถูกต้อง', 'danger')
+        return redirect(url_for('customer_data'))
+
+    if limit:
+        limit = min(max(limit, 1), 1000)
+        # Fetch one extra row to know whether a next page exists.
+        records = list(iter_customer_records(after=after_key, limit=limit + 1))
+        next_cursor = encode_customer_cursor(records[limit - 1]) if len(records) > limit else None
+        return render_template('customer_data.html',
+                               customer_records=[record.to_dict(include_images=False) for record in records[:limit]],
+                               next_cursor=next_cursor,
+                               limit=limit)
+
+    records = (record.to_dict(include_images=False) for record in iter_customer_records(after=after_key))
+    return stream_template('customer_data.html', customer_records=records, next_cursor=None, limit=None)
 
 # REFACTORED: Search now uses efficient database queries
 @app.route('/search_customer_data', methods=['GET'])
@@ -458,8 +1300,6 @@ def search_customer_data():
     display_title = "แสดงข้อมูลลูกค้าทั้งหมด"
 
     try:
-        base_query = CustomerRecord.query
-
         # Build display title
         if search_keyword:
             display_title = f"ผลการค้นหาสำหรับ: '{search_keyword}'"
@@ -468,28 +1308,10 @@ def search_customer_data():
         elif status_filter:
             display_title = f"ข้อมูลลูกค้าสถานะ: '{status_filter}'"
 
-        if search_keyword:
-            like_term = f"%{search_keyword}%"
-            
-            # REVISED: Use a universal LIKE search for all databases.
-            # This avoids potential errors from MySQL-specific FULLTEXT search if the index is not set up correctly.
-            # This method is more robust and works across different environments (like testing with SQLite).
-            search_filter = or_(
-                CustomerRecord.customer_id.ilike(like_term),
-                CustomerRecord.first_name.ilike(like_term),
-                CustomerRecord.last_name.ilike(like_term),
-                CustomerRecord.mobile_phone.ilike(like_term),
-                CustomerRecord.id_card_number.ilike(like_term),
-                CustomerRecord.business_name.ilike(like_term),
-                CustomerRecord.remarks.ilike(like_term)
-            )
-            base_query = base_query.filter(search_filter)
-        
-        # NEW: Apply status filter if provided
-        if status_filter:
-            base_query = base_query.filter(CustomerRecord.status == status_filter)
+        base_query, order_by = build_customer_search_query(search_keyword, status_filter)
 
-        pagination = base_query.order_by(CustomerRecord.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        # Photos for the whole page in one extra query (the detail modal shows them)
+        pagination = base_query.options(selectinload(CustomerRecord.images)).order_by(*order_by).paginate(page=page, per_page=per_page, error_out=False)
         results_obj = pagination.items
         results = [record.to_dict() for record in results_obj]
 
@@ -515,21 +1337,8 @@ def enter_customer_data():
     if request.method == 'POST':
         try:
             new_customer_id = generate_next_customer_id()
-            inspection_time_str = request.form.get('inspection_time')
-            inspection_time_obj = None
-            if inspection_time_str:
-                try:
-                    inspection_time_obj = datetime.strptime(inspection_time_str, '%H:%M').time()
-                except ValueError:
-                    # Handle case where time is not in HH:MM format, maybe log it
-                    pass
-            
-            # REVISED: Add data validation and cleaning for numeric fields to prevent crashes
-            def clean_decimal(value):
-                if value is None or value.strip() == '':
-                    return None
-                # Remove commas and convert to numeric, return None if it fails
-                return pd.to_numeric(str(value).replace(',', ''), errors='coerce')
+            # REVISED: Shared coercion (coercion.py); an unreadable time or amount is stored as empty
+            inspection_time_obj = clean_time(request.form.get('inspection_time'))
 
             new_customer = CustomerRecord(
                 timestamp=datetime.now(),
@@ -554,20 +1363,22 @@ def enter_customer_data():
                 assigned_company=request.form.get('assigned_company') or None,
                 upfront_interest_deduction=clean_decimal(request.form.get('upfront_interest')),
                 processing_fee=clean_decimal(request.form.get('processing_fee')),
-                application_date=request.form.get('application_date') or None,
+                application_date=parse_date(request.form.get('application_date')),
                 home_location_link=request.form.get('home_location_link') or None,
                 work_location_link=request.form.get('work_location_link') or None,
                 remarks=request.form.get('remarks') or None,
-                image_urls=request.form.get('image_urls') or None,
+                # REVISED: One customer_images row per uploaded photo
+                images=CustomerImage.from_urls(split_urls(request.form.get('image_urls')), uploaded_image_sizes(request.form)),
                 logged_in_user=session.get('username', 'unknown'),
-                inspection_date=request.form.get('inspection_date') or None,
+                inspection_date=parse_date(request.form.get('inspection_date')),
                 inspection_time=inspection_time_obj,
                 inspector=request.form.get('inspector')
             )
             db.session.add(new_customer)
             db.session.commit()
+            index_customer_record(new_customer)
+            invalidate_customer_caches(new_customer)
             
-            cache.delete('customer_data_view') # Clear cache after adding new data
             # flash(f'บันทึกข้อมูลลูกค้า {new_customer_id} เรียบร้อยแล้ว!', 'success')
             return jsonify({'success': True, 'message': f'บันทึกข้อมูลลูกค้า {new_customer_id} เรียบร้อยแล้ว!', 'customer_id': new_customer_id})
         except Exception as e:
@@ -614,15 +1425,9 @@ def edit_customer_data(record_id):
             customer.business_name = request.form.get('business_name', customer.business_name)
             customer.province = request.form.get('province', customer.province)
             customer.registered_address = request.form.get('registered_address', customer.registered_address)
-            customer.status = new_status # Apply the new status
+            record_status_change(customer, new_status) # REVISED: Apply the new status and log it in the status history
             
-            # REVISED: Apply the same robust data cleaning from the data entry form to prevent crashes.
-            def clean_decimal(value):
-                if value is None or str(value).strip() == '':
-                    return None
-                # Remove commas and convert to numeric, return None if it fails
-                return pd.to_numeric(str(value).replace(',', ''), errors='coerce')
-
+            # REVISED: Same coercion as the data entry form (coercion.clean_decimal)
             customer.desired_credit_limit = clean_decimal(request.form.get('desired_credit_limit', customer.desired_credit_limit))
             customer.approved_credit_limit = clean_decimal(request.form.get('approved_credit_limit', customer.approved_credit_limit))
             
@@ -634,9 +1439,9 @@ def edit_customer_data(record_id):
             customer.upfront_interest_deduction = clean_decimal(request.form.get('upfront_interest', customer.upfront_interest_deduction))
             customer.processing_fee = clean_decimal(request.form.get('processing_fee', customer.processing_fee))
             
-            application_date_str = request.form.get('application_date')
-            if application_date_str:
-                customer.application_date = datetime.strptime(application_date_str, '%Y-%m-%d').date()
+            application_date = parse_date(request.form.get('application_date'))
+            if application_date:
+                customer.application_date = application_date
 
             customer.home_location_link = request.form.get('home_location_link', customer.home_location_link)
             customer.work_location_link = request.form.get('work_location_link', customer.work_location_link)
@@ -644,33 +1449,20 @@ def edit_customer_data(record_id):
             
             customer.inspector = request.form.get('inspector', customer.inspector)
 
-            inspection_date_str = request.form.get('inspection_date')
-            customer.inspection_date = datetime.strptime(inspection_date_str, '%Y-%m-%d').date() if inspection_date_str else None
-            
-            inspection_time_str = request.form.get('inspection_time')
-            if inspection_time_str:
-                # REVISED: Handle both 'HH:MM' and 'HH:MM:SS' formats from the time input
-                time_format = '%H:%M:%S' if len(inspection_time_str) > 5 else '%H:%M'
-                customer.inspection_time = datetime.strptime(inspection_time_str, time_format).time()
-            else:
-                customer.inspection_time = None
+            customer.inspection_date = parse_date(request.form.get('inspection_date'))
+            # REVISED: parse_time takes both 'HH:MM' and 'HH:MM:SS' from the time input
+            customer.inspection_time = parse_time(request.form.get('inspection_time'))
                 
             # --- REVISED: Handle image deletion and updates ---
             # 1. Delete images marked for removal from Cloudinary
             deleted_urls_str = request.form.get('deleted_image_urls', '')
             if deleted_urls_str:
                 deleted_urls = [url.strip() for url in deleted_urls_str.split(',') if url.strip()]
-                for url in deleted_urls:
-                    try:
-                        # Extract public_id from URL and delete from Cloudinary
-                        public_id_with_folder = '/'.join(url.split('/')[-2:])
-                        public_id = os.path.splitext(public_id_with_folder)[0]
-                        cloudinary.uploader.destroy(public_id)
-                        current_app.logger.info(f"Successfully deleted image {public_id} from Cloudinary.")
-                    except Exception as cloudinary_error:
-                        current_app.logger.warning(f"Could not delete image from Cloudinary for URL {url}: {cloudinary_error}")
-            # 2. Save the final list of URLs (kept + new) to the database
-            customer.image_urls = request.form.get('final_image_urls', customer.image_urls)
+                # REVISED: Queued, not called inline; the deletions run after this edit commits.
+                enqueue_cloudinary_deletions(deleted_urls)
+            # 2. Save the final list of URLs (kept + new): only added / removed / moved rows are written
+            if 'final_image_urls' in request.form:
+                sync_customer_images(customer, split_urls(request.form['final_image_urls']), uploaded_image_sizes(request.form))
 
             # --- NEW: Logic to create an Approval record when status is changed to 'อนุมัติ' ---
             if new_status == 'อนุมัติ' and original_status != 'อนุมัติ':
@@ -686,13 +1478,15 @@ def edit_customer_data(record_id):
                         approved_amount=customer.approved_credit_limit,
                         assigned_company=customer.assigned_company,
                         registrar=session.get('username'),
-                        contract_image_urls=customer.image_urls # Copy image URLs for reference
+                        contract_images=[image.copy() for image in customer.images] # Copy the photos for reference
                     )
                     db.session.add(new_approval)
                     flash('สร้างรายการอนุมัติในหน้าจัดการสินเชื่อเรียบร้อยแล้ว', 'info')
 
+            changed_fields = changed_customer_fields(customer)
             db.session.commit()
-            cache.clear() # Clear all cache after an edit
+            index_customer_record(customer)
+            invalidate_customer_caches(customer, changed_fields) # Only the views fed by the changed columns
             flash('อัปเดตข้อมูลลูกค้าสำเร็จ', 'success')
             return redirect(url_for('search_customer_data'))
         except Exception as e:
@@ -703,7 +1497,7 @@ def edit_customer_data(record_id):
     # For GET request, pass the customer object to the template
     # The template expects a dictionary, so we convert the object
     customer_dict = customer.to_dict()
-    customer_dict['existing_image_urls'] = [url.strip() for url in (customer.image_urls or '').split(',') if url.strip()]
+    customer_dict['existing_image_urls'] = [image.url for image in customer.images]
     return render_template('edit_customer_data.html', customer_data=customer_dict, row_index=record_id, username=session.get('username'))
 
 
@@ -728,7 +1522,7 @@ def loan_management():
                 'ชื่อ-นามสกุล': record.full_name,
                 'หมายเลขโทรศัพท์': record.phone_number,
                 'วันที่อนุมัติ': record.approval_date.strftime('%Y-%m-%d') if record.approval_date else '',
-                'วงเงินที่อนุมัติ': f"{record.approved_amount:,.0f}" if record.approved_amount is not None else '-',
+                'วงเงินที่อนุมัติ': f"{record.approved_amount:,.2f}" if record.approved_amount is not None else '-',
                 'บริษัทที่รับงาน': record.assigned_company,
                 'ชื่อผู้ลงทะเบียน': record.registrar
             })
@@ -739,6 +1533,22 @@ def loan_management():
         return render_template('loan_management.html', approove=[], username=session.get('username'), can_edit_date=False)
 
 
+# NEW: What to clean up on Cloudinary when a customer record is deleted
+def _release_customer_assets(customer):
+    """
+    URLs of the customer's assets that nothing will reference once the record is gone.
+    While a loan (Approval) exists for the customer, its copied photo links and contract documents stay.
+    """
+    urls = [image.url for image in customer.images]
+    approval = Approval.query.filter_by(customer_id=customer.customer_id).first()
+    if approval is not None:
+        kept = {image.url for image in approval.contract_images}
+        return [url for url in urls if url not in kept]
+    for document in ContractDocument.query.filter_by(customer_id=customer.customer_id):
+        urls.append(document.document_url)
+        db.session.delete(document)
+    return urls
+
 # REFACTORED: Uses database ID for deletion
 @app.route('/delete_customer/<int:record_id>', methods=['POST'])
 @login_required
@@ -746,9 +1556,12 @@ def delete_customer(record_id):
     customer = get_customer_by_db_id(record_id)
     if customer:
         try:
+            # NEW: Queue the customer's Cloudinary assets for deletion in the same transaction
+            enqueue_cloudinary_deletions(_release_customer_assets(customer))
             db.session.delete(customer)
             db.session.commit()
-            cache.clear()
+            customer_search_index.remove(record_id)
+            invalidate_customer_caches(customer)
             flash(f'ลบข้อมูลลูกค้า {customer.customer_id} สำเร็จ', 'success')
         except Exception as e:
             db.session.rollback()
@@ -819,7 +1632,9 @@ def get_customer_info(customer_id):
             'วันที่อนุมัติ': approval_record.approval_date.strftime('%Y-%m-%d') if approval_record.approval_date else '-',
             'วงเงินที่อนุมัติ': f"{approval_record.approved_amount:,.2f}" if approval_record.approved_amount is not None else '-',
             'ชื่อผู้ลงทะเบียน': approval_record.registrar,
-            'รูปถ่ายสัญญา': image_urls_str
+            'รูปถ่ายสัญญา': image_urls_str,
+            # NEW: Thumbnail / medium / full variants and srcset per document, in upload order
+            'images': [image_variants(url) for url in image_urls]
         }
 
         return jsonify(customer_info)
@@ -837,6 +1652,7 @@ def get_customer_info(customer_id):
 
 @app.route('/api/save-contract-urls', methods=['POST'])
 @login_required
+@idempotent
 def save_contract_urls():
     """
     API endpoint to save a list of contract document URLs for a customer.
@@ -867,6 +1683,161 @@ def save_contract_urls():
         current_app.logger.error(f"Error saving contract URLs for customer {customer_id}: {e}")
         return jsonify({'success': False, 'error': 'An unexpected server error occurred while saving URLs.'}), 500
 
+# NEW: Ledger arithmetic shared by the loan summary projection and its reconcile command.
+LOAN_SUMMARY_FIELDS = ('total_given_out', 'total_returned', 'total_lost', 'last_interest', 'last_interest_date',
+                       'last_interest_time', 'last_transaction_date', 'last_transaction_time')
+MAX_BATCH_CUSTOMER_IDS = 500
+
+# Which summary total each ledger action adds to
+LEDGER_ACTION_TOTALS = {
+    'opening_balance': 'total_given_out',
+    'net_opening': 'total_given_out',
+    'principal_returned': 'total_returned',
+    'lost_amount': 'total_lost',
+}
+
+def _as_decimal(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+def _empty_loan_summary_values():
+    return {'total_given_out': Decimal('0'), 'total_returned': Decimal('0'), 'total_lost': Decimal('0'),
+            'last_interest': None, 'last_interest_date': None, 'last_interest_time': None,
+            'last_transaction_date': None, 'last_transaction_time': None}
+
+def compute_ledger_figures(customer_ids=None):
+    """Computes the summary columns from the ledger for `customer_ids` (None = every customer)."""
+    def scoped(query):
+        return query if customer_ids is None else query.filter(AllPidJob.customer_id.in_(customer_ids))
+
+    def ranked(*filters):
+        # Most recent row first, per customer
+        return scoped(db.session.query(
+            AllPidJob.customer_id.label('customer_id'),
+            AllPidJob.interest.label('interest'),
+            AllPidJob.transaction_date.label('transaction_date'),
+            AllPidJob.transaction_time.label('transaction_time'),
+            func.row_number().over(
+                partition_by=AllPidJob.customer_id,
+                order_by=(AllPidJob.transaction_date.desc(), AllPidJob.transaction_time.desc(), AllPidJob.id.desc())
+            ).label('position')
+        ).filter(*filters)).subquery()
+
+    latest = ranked()
+    latest_interest = ranked(AllPidJob.interest.isnot(None))
+
+    rows = db.session.query(
+        latest.c.customer_id, latest.c.transaction_date, latest.c.transaction_time,
+        latest_interest.c.interest, latest_interest.c.transaction_date, latest_interest.c.transaction_time
+    ).outerjoin(latest_interest, and_(latest_interest.c.customer_id == latest.c.customer_id, latest_interest.c.position == 1)) \
+     .filter(latest.c.position == 1).all()
+
+    figures = {}
+    for row in rows:
+        figures[row[0]] = dict(_empty_loan_summary_values(), **{
+            'last_transaction_date': row[1],
+            'last_transaction_time': row[2],
+            'last_interest': _as_decimal(row[3]) if row[3] is not None else None,
+            'last_interest_date': row[4],
+            'last_interest_time': row[5],
+        })
+
+    # REVISED: Totals are a plain GROUP BY action over the long-format ledger.
+    totals = db.session.query(LedgerEntry.customer_id, LedgerEntry.action, func.sum(LedgerEntry.amount))
+    if customer_ids is not None:
+        totals = totals.filter(LedgerEntry.customer_id.in_(customer_ids))
+    for customer_id, action, amount in totals.group_by(LedgerEntry.customer_id, LedgerEntry.action):
+        values = figures.setdefault(customer_id, _empty_loan_summary_values())
+        values[LEDGER_ACTION_TOTALS[action]] += _as_decimal(amount)
+    return figures
+
+def backfill_ledger_entries(customer_ids=None, after_job_id=None):
+    """
+    Copies every wide all_pid_jobs amount that has no ledger entry yet (set-based, one INSERT ... SELECT per column),
+    optionally only for `customer_ids` and only for jobs with an id above `after_job_id`. Runs in the caller's transaction.
+    """
+    inserted = 0
+    scope = "AND j.customer_id IN :customer_ids " if customer_ids is not None else ""
+    if after_job_id is not None:
+        scope += f"AND j.id > {int(after_job_id)} "
+    for table_no in LEDGER_TABLE_NUMBERS:
+        for action in LEDGER_ACTIONS:
+            column = f'table{table_no}_{action}'
+            statement = text(
+                "INSERT INTO ledger_entries (job_id, customer_id, transaction_date, transaction_time, company_name, table_no, action, amount) "
+                f"SELECT j.id, j.customer_id, j.transaction_date, j.transaction_time, j.company_name, {table_no}, '{action}', j.{column} "
+                f"FROM all_pid_jobs j WHERE j.{column} IS NOT NULL AND j.{column} <> 0 {scope}AND NOT EXISTS ("
+                f"SELECT 1 FROM ledger_entries e WHERE e.job_id = j.id AND e.table_no = {table_no} AND e.action = '{action}')"
+            )
+            if customer_ids is not None:
+                statement = statement.bindparams(bindparam('customer_ids', value=list(customer_ids), expanding=True))
+            inserted += db.session.execute(statement).rowcount
+    return inserted
+
+def lock_loan_summary(customer_id):
+    """
+    Returns the customer's summary row locked FOR UPDATE, creating it from the ledger on first use.
+    Call before adding the new AllPidJob rows, so autoflush cannot count them twice.
+    """
+    summary = CustomerLoanSummary.query.filter_by(customer_id=customer_id).with_for_update().first()
+    if summary is not None:
+        return summary
+    values = compute_ledger_figures([customer_id]).get(customer_id) or _empty_loan_summary_values()
+    try:
+        with db.session.begin_nested():
+            summary = CustomerLoanSummary(customer_id=customer_id, **values)
+            db.session.add(summary)
+    except IntegrityError:
+        # Another worker created it first
+        summary = CustomerLoanSummary.query.filter_by(customer_id=customer_id).with_for_update().first()
+    return summary
+
+def _ledger_sort_key(transaction_date, transaction_time):
+    # Same order as the ledger queries: newest first, missing dates/times count as oldest.
+    return (transaction_date or date.min, transaction_time or dt_time.min)
+
+def apply_ledger_entry(summary, job):
+    """Folds one new AllPidJob row into its (locked) customer summary."""
+    for table_no in LEDGER_TABLE_NUMBERS:
+        for action, total_name in LEDGER_ACTION_TOTALS.items():
+            amount = getattr(job, f'table{table_no}_{action}')
+            if amount is not None:
+                setattr(summary, total_name, _as_decimal(getattr(summary, total_name)) + _as_decimal(amount))
+
+    job_key = _ledger_sort_key(job.transaction_date, job.transaction_time)
+    # A job dated on or after the current latest becomes the latest (later ids win ties).
+    if job_key >= _ledger_sort_key(summary.last_transaction_date, summary.last_transaction_time):
+        summary.last_transaction_date, summary.last_transaction_time = job.transaction_date, job.transaction_time
+    if job.interest is not None and (summary.last_interest is None or
+                                     job_key >= _ledger_sort_key(summary.last_interest_date, summary.last_interest_time)):
+        summary.last_interest = _as_decimal(job.interest)
+        summary.last_interest_date, summary.last_interest_time = job.transaction_date, job.transaction_time
+
+def get_customer_loan_figures(customer_ids):
+    """Returns {customer_id: {'total_given_out', 'total_returned', 'outstanding_balance', 'interest'}}."""
+    customer_ids = sorted(set(customer_ids))
+    if not customer_ids:
+        return {}
+    # REVISED: Primary-key lookups on the summary; customers it does not cover yet are computed from the ledger.
+    values_by_customer = {
+        summary.customer_id: {name: getattr(summary, name) for name in LOAN_SUMMARY_FIELDS}
+        for summary in CustomerLoanSummary.query.filter(CustomerLoanSummary.customer_id.in_(customer_ids))
+    }
+    missing = [cid for cid in customer_ids if cid not in values_by_customer]
+    if missing:
+        values_by_customer.update(compute_ledger_figures(missing))
+
+    figures = {}
+    for cid in customer_ids:
+        values = values_by_customer.get(cid) or _empty_loan_summary_values()
+        given_out, returned = float(values['total_given_out'] or 0), float(values['total_returned'] or 0)
+        figures[cid] = {
+            'total_given_out': given_out,
+            'total_returned': returned,
+            'outstanding_balance': given_out - returned,
+            'interest': float(values['last_interest']) if values['last_interest'] is not None else None,
+        }
+    return figures
+
 @app.route('/api/customer-balance/<customer_id>', methods=['GET'])
 @login_required
 def get_customer_balance(customer_id):
@@ -875,30 +1846,8 @@ def get_customer_balance(customer_id):
     This is the sum of money given out minus the sum of money returned.
     """
     try:
-        # Sum up all the amounts that represent money given out
-        total_given_out = db.session.query(
-            func.sum(
-                func.coalesce(AllPidJob.table1_opening_balance, 0) +
-                func.coalesce(AllPidJob.table1_net_opening, 0) +
-                func.coalesce(AllPidJob.table2_opening_balance, 0) +
-                func.coalesce(AllPidJob.table2_net_opening, 0) +
-                func.coalesce(AllPidJob.table3_opening_balance, 0) +
-                func.coalesce(AllPidJob.table3_net_opening, 0)
-            )
-        ).filter(AllPidJob.customer_id == customer_id).scalar() or 0
-
-        # Sum up all the amounts that represent money returned
-        total_returned = db.session.query(
-            func.sum(
-                func.coalesce(AllPidJob.table1_principal_returned, 0) +
-                func.coalesce(AllPidJob.table2_principal_returned, 0) +
-                func.coalesce(AllPidJob.table3_principal_returned, 0)
-            )
-        ).filter(AllPidJob.customer_id == customer_id).scalar() or 0
-        
-        outstanding_balance = total_given_out - total_returned
-
-        return jsonify({'total_transactions_value': float(outstanding_balance)})
+        outstanding_balance = get_customer_loan_figures([customer_id])[customer_id]['outstanding_balance']
+        return jsonify({'total_transactions_value': outstanding_balance})
 
     except Exception as e:
         current_app.logger.error(f"Error calculating balance for customer_id {customer_id}: {e}")
@@ -911,24 +1860,48 @@ def get_latest_interest(customer_id):
     Fetches the most recent interest rate for a given customer from the all_pid_jobs table.
     """
     try:
-        # Find the most recent transaction for this customer that has an interest rate
-        latest_job = AllPidJob.query.filter(
-            AllPidJob.customer_id == customer_id,
-            AllPidJob.interest.isnot(None)
-        ).order_by(AllPidJob.transaction_date.desc(), AllPidJob.transaction_time.desc()).first()
-
-        if latest_job and latest_job.interest is not None:
-            return jsonify({'interest': float(latest_job.interest)})
-        else:
-            # No previous interest rate found
-            return jsonify({'interest': None})
+        # None when no previous interest rate is found
+        return jsonify({'interest': get_customer_loan_figures([customer_id])[customer_id]['interest']})
 
     except Exception as e:
         current_app.logger.error(f"Error fetching latest interest for customer_id {customer_id}: {e}")
         return jsonify({'error': 'Could not fetch interest rate'}), 500
 
+@app.route('/api/customer-balances', methods=['POST'])
+@login_required
+def get_customer_balances():
+    """
+    Batch version of customer-balance + latest-interest.
+    Body: {"customer_ids": ["PID-1001", ...]}; returns {"customers": {customer_id: {..., "total_transactions_value", "interest"}}}.
+    """
+    data = request.get_json(silent=True) or {}
+    customer_ids = data.get('customer_ids')
+    if not isinstance(customer_ids, list) or not all(isinstance(cid, str) for cid in customer_ids):
+        return jsonify({'error': 'customer_ids must be a list of customer IDs'}), 400
+    if len(customer_ids) > MAX_BATCH_CUSTOMER_IDS:
+        return jsonify({'error': f'At most {MAX_BATCH_CUSTOMER_IDS} customer IDs per request'}), 400
+
+    try:
+        figures = get_customer_loan_figures(customer_ids)
+        for values in figures.values():
+            # Same field name the single-customer endpoint uses
+            values['total_transactions_value'] = values['outstanding_balance']
+        return jsonify({'customers': figures})
+    except Exception as e:
+        current_app.logger.error(f"Error calculating balances for {len(customer_ids)} customers: {e}")
+        return jsonify({'error': 'Could not calculate balances'}), 500
+
+# REFACTORED: Use a mapping for safer and clearer attribute setting.
+# This prevents arbitrary attribute setting and makes the logic easier to follow.
+CLOSE_JOB_ACTION_COLUMNS = {
+    'เปิดยอด': 'opening_balance',
+    'เปิดสุทธิ': 'net_opening',
+    'คืนต้น': 'principal_returned'
+}
+
 @app.route('/save-approved-data', methods=['POST'])
 @login_required
+@idempotent
 def save_approved_data():
     """
     Saves the 'close job' transaction data to the all_pid_jobs table
@@ -947,58 +1920,71 @@ def save_approved_data():
     # Get transaction date from payload, with a fallback to the current date.
     transaction_date_str = data.get('transaction_date')
     try:
-        # Use strptime if a string is provided, otherwise default to now.
-        transaction_date = datetime.strptime(transaction_date_str, '%Y-%m-%d').date() if transaction_date_str else datetime.now().date()
+        # Parse the date if one is provided, otherwise default to now.
+        transaction_date = parse_date(transaction_date_str) or datetime.now().date()
     except (ValueError, TypeError):
         # Fallback in case of invalid date format or other type errors
         transaction_date = datetime.now().date()
 
+    # NEW: Coerce every amount before anything is written; a malformed one is the client's error (400), not a 500
     try:
+        interest = _close_job_decimal(data.get('interest'))
+    except FieldError as e:
+        return jsonify({'error': f"Invalid interest '{data.get('interest')}': {e}"}), 400
+    try:
+        new_approved_amount = _close_job_decimal(data.get('approved_amount'))
+    except FieldError as e:
+        return jsonify({'error': f"Invalid approved_amount '{data.get('approved_amount')}': {e}"}), 400
+    amounts = []
+    for position, trans in enumerate(transactions, start=1):
+        if not isinstance(trans, dict):
+            return jsonify({'error': f'Transaction {position}: must be an object'}), 400
+        try:
+            amounts.append(_close_job_decimal(trans.get('amount')))
+        except FieldError as e:
+            return jsonify({'error': f"Transaction {position}: invalid amount '{trans.get('amount')}': {e}"}), 400
+
+    try:
+        # NEW: Lock the customer's loan summary before any ledger rows are added
+        loan_summary = lock_loan_summary(customer_id)
+
         # 1. Update the approval status to 'ปิดจ๊อบแล้ว' ONLY IF the current status is 'รอปิดจ๊อบ'
         approval_record = Approval.query.filter_by(customer_id=customer_id).first()
         if approval_record:
             # Only change status if it's the initial job closing.
             if approval_record.status == 'รอปิดจ๊อบ':
                 approval_record.status = 'ปิดจ๊อบแล้ว'
+            loan_summary.status = approval_record.status
             
             # NEW: Update the approved amount if it was changed in the modal
-            new_approved_amount = data.get('approved_amount')
             if new_approved_amount is not None:
                 approval_record.approved_amount = new_approved_amount
         
-        # REFACTORED: Use a mapping for safer and clearer attribute setting.
-        # This prevents arbitrary attribute setting and makes the logic easier to follow.
-        action_to_column_map = {
-            'เปิดยอด': 'opening_balance',
-            'เปิดสุทธิ': 'net_opening',
-            'คืนต้น': 'principal_returned'
-        }
-
         # 2. Add new records to AllPidJob for each transaction
-        for trans in transactions:
+        for trans, amount in zip(transactions, amounts):
             new_job = AllPidJob(
                 transaction_date=transaction_date, 
                 transaction_time=datetime.now().time(), 
                 company_name=trans.get('company'), 
                 customer_id=customer_id, 
                 customer_name=data.get('fullname'), 
-                interest=data.get('interest'), 
+                interest=interest, 
                 main_assigned_company=data.get('assigned_company')
             )
             
             action_type = trans.get('action_type')
-            amount = trans.get('amount')
             table_number_str = trans.get('table_select', '').replace('โต๊ะ', '')
 
             # Validate the inputs before proceeding
-            if table_number_str.isdigit() and action_type in action_to_column_map and amount is not None:
+            if table_number_str.isdigit() and action_type in CLOSE_JOB_ACTION_COLUMNS and amount is not None:
                 table_number = int(table_number_str)
-                column_suffix = action_to_column_map[action_type]
+                column_suffix = CLOSE_JOB_ACTION_COLUMNS[action_type]
                 # Construct the full attribute name, e.g., 'table1_opening_balance'
                 attribute_name = f'table{table_number}_{column_suffix}'
                 setattr(new_job, attribute_name, amount)
 
             db.session.add(new_job)
+            apply_ledger_entry(loan_summary, new_job)
         db.session.commit()
         return jsonify({'success': True, 'message': 'บันทึกข้อมูลการปิดจ๊อบเรียบร้อยแล้ว'})
     except Exception as e:
@@ -1006,6 +1992,128 @@ def save_approved_data():
         current_app.logger.error(f"Error saving approved data for customer {customer_id}: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในเซิร์ฟเวอร์ขณะบันทึกข้อมูล'}), 500
 
+# NEW: Close many customers' jobs in one request and one database transaction.
+MAX_BULK_CLOSE_JOBS = 200
+AMOUNT_COLUMNS = [f'table{table_no}_{action}' for table_no in LEDGER_TABLE_NUMBERS for action in LEDGER_ACTIONS]
+
+# Amounts, interest and approved_amount are all DECIMAL(15, 2): coerced like the PATCH API does
+# (finite, within the column's range, rounded to 2 places).
+_close_job_decimal_column = coercer_for(AllPidJob.__table__.c.interest)
+
+def _close_job_decimal(value):
+    """Decimal for a close-job amount, None when blank; FieldError when the columns cannot hold it."""
+    return None if is_blank(value) else _close_job_decimal_column(value)
+
+def _parse_close_job_item(item, now):
+    """Validates one bulk close-job item; returns (all_pid_jobs rows, approved amount or None, error message or None)."""
+    if not isinstance(item, dict):
+        return None, None, 'Item must be an object'
+    customer_id = item.get('customer_id')
+    transactions = item.get('transactions')
+    if not customer_id or not isinstance(transactions, list) or not transactions:
+        return None, None, 'Missing customer ID or transactions'
+    transaction_date = now.date()
+    if item.get('transaction_date'):
+        try:
+            transaction_date = parse_date(item['transaction_date'])
+        except (ValueError, TypeError):
+            return None, None, f"Invalid transaction_date '{item['transaction_date']}'"
+    try:
+        interest = _close_job_decimal(item.get('interest'))
+    except FieldError as e:
+        return None, None, f"Invalid interest '{item.get('interest')}': {e}"
+    try:
+        approved_amount = _close_job_decimal(item.get('approved_amount'))
+    except FieldError as e:
+        return None, None, f"Invalid approved_amount '{item.get('approved_amount')}': {e}"
+
+    rows = []
+    for position, trans in enumerate(transactions, start=1):
+        if not isinstance(trans, dict):
+            return None, None, f"Transaction {position}: must be an object"
+        table_number_str = str(trans.get('table_select', '')).replace('โต๊ะ', '')
+        action_type = trans.get('action_type')
+        if not table_number_str.isdigit() or int(table_number_str) not in LEDGER_TABLE_NUMBERS:
+            return None, None, f"Transaction {position}: unknown table '{trans.get('table_select')}'"
+        if action_type not in CLOSE_JOB_ACTION_COLUMNS:
+            return None, None, f"Transaction {position}: unknown action '{action_type}'"
+        try:
+            amount = _close_job_decimal(trans.get('amount'))
+        except FieldError:
+            amount = None
+        if amount is None:
+            return None, None, f"Transaction {position}: invalid amount '{trans.get('amount')}'"
+        row = {
+            'transaction_date': transaction_date, 'transaction_time': now.time(), 'company_name': trans.get('company'),
+            'customer_id': customer_id, 'customer_name': item.get('fullname'), 'interest': interest,
+            'main_assigned_company': item.get('assigned_company'),
+        }
+        # Every row carries every amount column so the whole batch is one executemany
+        row.update({name: Decimal('0') for name in AMOUNT_COLUMNS})
+        row[f'table{table_number_str}_{CLOSE_JOB_ACTION_COLUMNS[action_type]}'] = amount
+        rows.append(row)
+    return rows, approved_amount, None
+
+@app.route('/api/close-jobs/bulk', methods=['POST'])
+@login_required
+@idempotent
+def bulk_close_jobs():
+    """
+    Body: {"jobs": [<save-approved-data payload>, ...]}. Every item is validated first; the valid ones are
+    booked together (one multi-row INSERT, one approvals UPDATE, one commit) and each invalid one is reported.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('jobs')
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'jobs must be a non-empty list'}), 400
+    if len(items) > MAX_BULK_CLOSE_JOBS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BULK_CLOSE_JOBS} jobs per request'}), 400
+
+    now = datetime.now()
+    job_rows, booked, errors, approved_amounts = [], [], [], {}
+    for index, item in enumerate(items):
+        rows, approved_amount, error = _parse_close_job_item(item, now)
+        if error:
+            errors.append({'index': index, 'customer_id': item.get('customer_id') if isinstance(item, dict) else None, 'error': error})
+        else:
+            job_rows.extend(rows)
+            booked.append(item)
+            if approved_amount is not None:
+                approved_amounts[item['customer_id']] = approved_amount
+    if not booked:
+        return jsonify({'success': False, 'booked': [], 'errors': errors}), 400
+
+    customer_ids = sorted({item['customer_id'] for item in booked})
+    try:
+        # Lock summaries in a fixed order (no deadlocks between concurrent batches), before the rows exist
+        summaries = {customer_id: lock_loan_summary(customer_id) for customer_id in customer_ids}
+
+        # Mirror only the rows inserted here: older unmirrored jobs of these customers are not in their
+        # summaries either; 'flask backfill-ledger' then 'flask reconcile-loan-summary' bring both in.
+        last_job_id = db.session.query(func.max(AllPidJob.id)).scalar() or 0
+        db.session.execute(AllPidJob.__table__.insert(), job_rows)
+        backfill_ledger_entries(customer_ids, after_job_id=last_job_id)
+        for row in job_rows:
+            apply_ledger_entry(summaries[row['customer_id']], AllPidJob(**row))
+
+        # Same rules as save_approved_data: close 'รอปิดจ๊อบ' approvals, and take any new approved amount
+        db.session.execute(
+            update(Approval).where(Approval.customer_id.in_(customer_ids)).values(
+                status=case((Approval.status == 'รอปิดจ๊อบ', 'ปิดจ๊อบแล้ว'), else_=Approval.status),
+                approved_amount=case(approved_amounts, value=Approval.customer_id, else_=Approval.approved_amount)
+                if approved_amounts else Approval.approved_amount,
+            ).execution_options(synchronize_session=False)
+        )
+        for customer_id, status in db.session.query(Approval.customer_id, Approval.status).filter(Approval.customer_id.in_(customer_ids)):
+            summaries[customer_id].status = status
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error bulk closing jobs for {len(customer_ids)} customers: {e}")
+        return jsonify({'success': False, 'error': 'เกิดข้อผิดพลาดในเซิร์ฟเวอร์ขณะบันทึกข้อมูล', 'errors': errors}), 500
+
+    return jsonify({'success': True, 'booked': [item['customer_id'] for item in booked], 'transactions': len(job_rows), 'errors': errors})
+
 @app.route('/api/daily-jobs', methods=['GET'])
 @login_required
 def get_daily_jobs():
@@ -1015,11 +2123,15 @@ def get_daily_jobs():
     search_date_str = request.args.get('date')
     search_company = request.args.get('company')
 
+    # NEW: 'from' + 'to' switch to the streamed date-range mode with SQL subtotals
+    if request.args.get('from') or request.args.get('to'):
+        return get_daily_jobs_range(search_company)
+
     if not search_date_str:
         return jsonify({'error': 'Date parameter is required'}), 400
 
     try:
-        search_date = datetime.strptime(search_date_str, '%Y-%m-%d').date()
+        search_date = parse_date(search_date_str, required=True)
     except ValueError:
         return jsonify({'error': 'Invalid date format. Please use YYYY-MM-DD.'}), 400
 
@@ -1039,6 +2151,61 @@ def get_daily_jobs():
         current_app.logger.error(f"Error fetching daily jobs: {e}")
         return jsonify({'error': 'An internal server error occurred'}), 500
 
+# NEW: Date-range mode of /api/daily-jobs for monthly settlement views.
+DAILY_JOBS_MAX_RANGE_DAYS = 366
+DAILY_JOBS_STREAM_BATCH_SIZE = 1000
+
+def build_daily_job_subtotals(date_from, date_to, company=None):
+    """Sums ledger amounts per company and per table (1-3) for the range, in one GROUP BY over ledger_entries."""
+    query = db.session.query(LedgerEntry.company_name, LedgerEntry.table_no, LedgerEntry.action, func.sum(LedgerEntry.amount)) \
+        .filter(LedgerEntry.transaction_date.between(date_from, date_to))
+    if company:
+        query = query.filter(LedgerEntry.company_name == company)
+
+    by_company, by_table, totals = {}, {}, {action: 0.0 for action in LEDGER_ACTIONS}
+    for company_name, table_no, action, amount in query.group_by(LedgerEntry.company_name, LedgerEntry.table_no, LedgerEntry.action):
+        amount = float(amount or 0)
+        company_totals = by_company.setdefault(company_name or UNSPECIFIED_LABEL, {a: 0.0 for a in LEDGER_ACTIONS})
+        table_totals = by_table.setdefault(f'Table{table_no}', {a: 0.0 for a in LEDGER_ACTIONS})
+        company_totals[action] += amount
+        table_totals[action] += amount
+        totals[action] += amount
+    return {'by_company': by_company, 'by_table': by_table, 'total': totals}
+
+def get_daily_jobs_range(search_company):
+    """
+    Streams {"from", "to", "jobs": [...], "count", "subtotals"} as chunked JSON.
+    'totals_only=1' skips the rows for views that only need the sums.
+    """
+    try:
+        date_from = parse_date(request.args.get('from'), required=True)
+        date_to = parse_date(request.args.get('to'), required=True)
+    except ValueError:
+        return jsonify({'error': "Both 'from' and 'to' are required, formatted YYYY-MM-DD."}), 400
+    if date_from > date_to or (date_to - date_from).days >= DAILY_JOBS_MAX_RANGE_DAYS:
+        return jsonify({'error': f"'from' must not be after 'to', and the range is limited to {DAILY_JOBS_MAX_RANGE_DAYS} days."}), 400
+    include_jobs = request.args.get('totals_only') != '1'
+
+    def generate():
+        yield json.dumps({'from': date_from.isoformat(), 'to': date_to.isoformat()})[:-1] + ', "jobs": ['
+        count = 0
+        if include_jobs:
+            # Plain column rows in batches; AllPidJob.to_dict() only reads column attributes, so it formats these rows too.
+            statement = db.select(*AllPidJob.__table__.columns) \
+                .where(AllPidJob.transaction_date.between(date_from, date_to)) \
+                .order_by(AllPidJob.transaction_date, AllPidJob.transaction_time, AllPidJob.id)
+            if search_company:
+                statement = statement.where(AllPidJob.company_name == search_company)
+            rows = db.session.execute(statement.execution_options(yield_per=DAILY_JOBS_STREAM_BATCH_SIZE))
+            for batch in rows.partitions():
+                chunk = ', '.join(json.dumps(AllPidJob.to_dict(row)) for row in batch)
+                yield (', ' if count else '') + chunk
+                count += len(batch)
+        subtotals = build_daily_job_subtotals(date_from, date_to, search_company)
+        yield f'], "count": {count}, "subtotals": {json.dumps(subtotals)}}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @app.route('/delete_contract_doc', methods=['POST'])
 @login_required
 def delete_contract_doc():
@@ -1060,16 +2227,8 @@ def delete_contract_doc():
         if not doc_to_delete:
             return jsonify({'success': False, 'error': 'Document not found in database'}), 404
 
-        # Delete from Cloudinary by extracting the public_id from the URL
-        # Example URL: https://res.cloudinary.com/<cloud_name>/image/upload/v12345/customer_app_images/public_id.jpg
-        # The public_id for Cloudinary is 'customer_app_images/public_id'
-        try:
-            public_id_with_folder = '/'.join(image_url.split('/')[-2:])
-            public_id = os.path.splitext(public_id_with_folder)[0]
-            cloudinary.uploader.destroy(public_id)
-        except Exception as cloudinary_error:
-            # Log the error but continue to delete from DB, as the link is broken anyway
-            current_app.logger.warning(f"Could not delete image from Cloudinary for URL {image_url}: {cloudinary_error}")
+        # REVISED: The Cloudinary file is deleted by the task queue (with retries) after this commits.
+        enqueue_cloudinary_deletions([image_url])
 
         # Delete from our database
         db.session.delete(doc_to_delete)
@@ -1090,6 +2249,8 @@ def _mark_status_and_log(customer_id, status_text, log_model, payload):
         raise ValueError(f'Approval record not found for customer {customer_id}')
     
     approval.status = status_text
+    # NEW: Keep the loan summary's status in step, in the same transaction
+    lock_loan_summary(customer_id).status = status_text
 
     log_data = {
         'customer_id': customer_id,
@@ -1128,16 +2289,19 @@ def _handle_status_marking_request(status_text, log_model, success_message):
 
 @app.route('/mark_as_bad_debt', methods=['POST'])
 @login_required
+@idempotent
 def mark_as_bad_debt():
     return _handle_status_marking_request('หนี้เสีย', BadDebtRecord, 'บันทึกหนี้เสียเรียบร้อยแล้ว')
 
 @app.route('/mark_as_pull_plug', methods=['POST'])
 @login_required
+@idempotent
 def mark_as_pull_plug():
     return _handle_status_marking_request('ชั๊กปลั๊ก', PullPlugRecord, 'บันทึกการชั๊กปลั๊กเรียบร้อยแล้ว')
 
 @app.route('/mark_as_return_principal', methods=['POST'])
 @login_required
+@idempotent
 def mark_as_return_principal():
     return _handle_status_marking_request('คืนต้น', ReturnPrincipalRecord, 'บันทึกการคืนต้นเรียบร้อยแล้ว')
 
@@ -1222,132 +2386,296 @@ def get_records_api(record_type):
         current_app.logger.error(f"Error fetching {record_type} records: {e}")
         return jsonify({'error': 'Could not fetch records'}), 500
 
+@tagged_cache.cached(key_prefix='customer_chart_data', tags=['charts:monthly'])
+def build_customer_chart_data():
+    """Aggregates customers per year/month/group for the main dashboard chart."""
+    # REVISED: Read the pre-aggregated rollup instead of grouping the whole customer table.
+    results = db.session.query(
+        CustomerMonthlyRollup.year,
+        CustomerMonthlyRollup.month,
+        CustomerMonthlyRollup.main_customer_group,
+        CustomerMonthlyRollup.customer_count.label('count')
+    ).filter(CustomerMonthlyRollup.customer_count > 0).all()
+
+    chart_data = {}
+    unique_customer_groups = set()
+    unique_years = set()
+
+    for row in results:
+        year = str(row.year)
+        month = f"{row.month:02d}"
+        group = row.main_customer_group or "ไม่ระบุ"
+        count = row.count
+
+        unique_years.add(year)
+        unique_customer_groups.add(group)
+
+        chart_data.setdefault(year, {}).setdefault(month, {})
+        chart_data[year][month][group] = count
+
+    all_months = [f"{i:02d}" for i in range(1, 13)]
+
+    return {
+        'chart_data': chart_data,
+        'unique_customer_groups': sorted(list(unique_customer_groups)),
+        'unique_years': sorted(list(unique_years), reverse=True),
+        'all_months': all_months
+    }
+
 @app.route('/get_customer_chart_data')
 @login_required
 def get_customer_chart_data():
     """Provides data for the main dashboard chart, structured for the frontend filters."""
     try:
-        # REFACTORED: Let the database do the grouping and counting for performance.
-        results = db.session.query(
-            func.extract('year', CustomerRecord.application_date).label('year'),
-            func.extract('month', CustomerRecord.application_date).label('month'),
-            CustomerRecord.main_customer_group,
-            func.count(CustomerRecord.id).label('count')
-        ).filter(CustomerRecord.application_date.isnot(None)).group_by('year', 'month', 'main_customer_group').all()
-
-        chart_data = {}
-        unique_customer_groups = set()
-        unique_years = set()
-
-        for row in results:
-            year = str(row.year)
-            month = f"{row.month:02d}"
-            group = row.main_customer_group or "ไม่ระบุ"
-            count = row.count
-
-            unique_years.add(year)
-            unique_customer_groups.add(group)
-
-            chart_data.setdefault(year, {}).setdefault(month, {})
-            chart_data[year][month][group] = count
-
-        all_months = [f"{i:02d}" for i in range(1, 13)]
-
-        return jsonify({
-            'chart_data': chart_data,
-            'unique_customer_groups': sorted(list(unique_customer_groups)),
-            'unique_years': sorted(list(unique_years), reverse=True),
-            'all_months': all_months
-        })
-
+        return jsonify(build_customer_chart_data())
     except Exception as e:
         current_app.logger.error(f"Error generating customer chart data: {e}")
         return jsonify({'error': str(e)}), 500
 
+# NEW: Define a fixed list of all possible channels to ensure they always appear in the filter
+ALL_APPLICATION_CHANNELS = [
+    "FACEBOOK สตาร์โลน",
+    "FACEBOOK กลอรี่แคช",
+    "FACEBOOK แคชเครดิต",
+    "ไลน์@สตาร์โลน",
+    "ไลน์@กลอรี่แคช",
+    "ไลน์@แคชเครดิต",
+    "โทรเข้ามา สตาร์โลน",
+    "โทรเข้ามา กลอรี่แคช",
+    "โทรเข้ามา แคชเครดิต",
+    "อีเมล"
+]
+
+@tagged_cache.cached(key_prefix='channel_province_chart_data', tags=['charts:channel_province'])
+def build_channel_province_chart_data():
+    """Aggregates customers per year/month/province/channel/group for the channel/province chart."""
+    # REVISED: Read the pre-aggregated rollup instead of grouping the whole customer table.
+    results = db.session.query(
+        CustomerChannelProvinceRollup.year,
+        CustomerChannelProvinceRollup.month,
+        CustomerChannelProvinceRollup.province,
+        CustomerChannelProvinceRollup.application_channel,
+        CustomerChannelProvinceRollup.main_customer_group,
+        CustomerChannelProvinceRollup.customer_count.label('count')
+    ).filter(CustomerChannelProvinceRollup.customer_count > 0).all()
+
+    chart_data = {}
+    unique_years = set()
+    unique_channels = set()
+    unique_provinces = set()
+    unique_groups = set()
+
+    for row in results:
+        year = str(row.year)
+        month = f"{row.month:02d}"
+        province = row.province or "ไม่ระบุ"
+        channel = row.application_channel or "ไม่ระบุ"
+        group = row.main_customer_group or "ไม่ระบุ"
+        count = row.count
+
+        unique_years.add(year)
+        unique_provinces.add(province)
+        unique_channels.add(channel)
+        unique_groups.add(group)
+
+        path = chart_data.setdefault(year, {}).setdefault(month, {}).setdefault(province, {}).setdefault(channel, {})
+        path[group] = count
+
+    all_months = [f"{i:02d}" for i in range(1, 13)]
+
+    return {
+        'chart_data': chart_data,
+        'unique_years': sorted(list(unique_years), reverse=True),
+        'all_months': all_months,
+        'unique_channels': ALL_APPLICATION_CHANNELS,
+        'unique_provinces': sorted(list(unique_provinces)),
+        'unique_groups': sorted(list(unique_groups))
+    }
+
 @app.route('/get_channel_province_chart_data')
 @login_required
 def get_channel_province_chart_data():
     """Provides data for the channel/province dashboard chart."""
     try:
-        # REFACTORED: Use database grouping for much better performance.
-        results = db.session.query(
-            func.extract('year', CustomerRecord.application_date).label('year'),
-            func.extract('month', CustomerRecord.application_date).label('month'),
-            CustomerRecord.province,
-            CustomerRecord.application_channel,
-            CustomerRecord.main_customer_group,
-            func.count(CustomerRecord.id).label('count')
-        ).filter(CustomerRecord.application_date.isnot(None)).group_by('year', 'month', 'province', 'application_channel', 'main_customer_group').all()
-
-        chart_data = {}
-        unique_years = set()
-        unique_channels = set()
-        unique_provinces = set()
-        unique_groups = set()
-
-        for row in results:
-            year = str(row.year)
-            month = f"{row.month:02d}"
-            province = row.province or "ไม่ระบุ"
-            channel = row.application_channel or "ไม่ระบุ"
-            group = row.main_customer_group or "ไม่ระบุ"
-            count = row.count
-
-            unique_years.add(year)
-            unique_provinces.add(province)
-            unique_channels.add(channel)
-            unique_groups.add(group)
-
-            path = chart_data.setdefault(year, {}).setdefault(month, {}).setdefault(province, {}).setdefault(channel, {})
-            path[group] = count
-
-        all_months = [f"{i:02d}" for i in range(1, 13)]
-
-        # NEW: Define a fixed list of all possible channels to ensure they always appear in the filter
-        all_possible_channels = [
-            "FACEBOOK สตาร์โลน",
-            "FACEBOOK กลอรี่แคช",
-            "FACEBOOK แคชเครดิต",
-            "ไลน์@สตาร์โลน",
-            "ไลน์@กลอรี่แคช",
-            "ไลน์@แคชเครดิต",
-            "โทรเข้ามา สตาร์โลน",
-            "โทรเข้ามา กลอรี่แคช",
-            "โทรเข้ามา แคชเครดิต",
-            "อีเมล"
-        ]
-
-        return jsonify({
-            'chart_data': chart_data,
-            'unique_years': sorted(list(unique_years), reverse=True),
-            'all_months': all_months,
-            'unique_channels': all_possible_channels,
-            'unique_provinces': sorted(list(unique_provinces)),
-            'unique_groups': sorted(list(unique_groups))
-        })
+        return jsonify(build_channel_province_chart_data())
     except Exception as e:
         current_app.logger.error(f"Error generating channel/province chart data: {e}")
         return jsonify({'error': str(e)}), 500
 
+# NEW: Filtered, columnar slices of the channel/province rollup, so the dashboard can request only the
+# year/month/province/channel/group combination on screen instead of the whole tree.
+CHANNEL_SLICE_DIMENSIONS = {
+    'year': CustomerChannelProvinceRollup.year,
+    'month': CustomerChannelProvinceRollup.month,
+    'province': CustomerChannelProvinceRollup.province,
+    'channel': CustomerChannelProvinceRollup.application_channel,
+    'group': CustomerChannelProvinceRollup.main_customer_group,
+}
+UNSPECIFIED_LABEL = "ไม่ระบุ"
+
+def _label_filter_values(values):
+    """Maps the 'ไม่ระบุ' label the charts display back to the empty key stored in the rollup."""
+    return sorted({'' if value == UNSPECIFIED_LABEL else value for value in values})
+
+def build_channel_province_slice(years=(), month_from=1, month_to=12, provinces=(), channels=(), groups=(), group_by=None):
+    """Sums rollup counts matching the filters, grouped by `group_by` dimensions, as parallel column arrays."""
+    group_by = list(group_by or CHANNEL_SLICE_DIMENSIONS)
+    dimensions = [CHANNEL_SLICE_DIMENSIONS[name] for name in group_by]
+    query = db.session.query(*dimensions, func.sum(CustomerChannelProvinceRollup.customer_count)) \
+        .filter(CustomerChannelProvinceRollup.customer_count > 0,
+                CustomerChannelProvinceRollup.month.between(month_from, month_to))
+    if years:
+        query = query.filter(CustomerChannelProvinceRollup.year.in_(years))
+    for column, values in ((CustomerChannelProvinceRollup.province, provinces),
+                           (CustomerChannelProvinceRollup.application_channel, channels),
+                           (CustomerChannelProvinceRollup.main_customer_group, groups)):
+        if values:
+            query = query.filter(column.in_(_label_filter_values(values)))
+    rows = query.group_by(*dimensions).order_by(*dimensions).all()
+
+    data = {name: [] for name in group_by}
+    data['count'] = []
+    for row in rows:
+        for name, value in zip(group_by, row):
+            data[name].append(value if name in ('year', 'month') else (value or UNSPECIFIED_LABEL))
+        data['count'].append(int(row[-1]))
+    return {'columns': group_by + ['count'], 'rows': len(rows), 'data': data}
+
+@tagged_cache.cached(key_prefix='channel_province_facets', tags=['charts:channel_province'])
+def build_channel_province_facets():
+    """Distinct filter values for the channel/province chart, cached apart from the slices."""
+    def distinct(column):
+        values = db.session.query(column).filter(CustomerChannelProvinceRollup.customer_count > 0).distinct().all()
+        return {value or UNSPECIFIED_LABEL for value, in values}
+
+    return {
+        'unique_years': sorted((str(year) for year in distinct(CustomerChannelProvinceRollup.year)), reverse=True),
+        'all_months': [f"{i:02d}" for i in range(1, 13)],
+        'unique_channels': ALL_APPLICATION_CHANNELS,
+        'unique_provinces': sorted(distinct(CustomerChannelProvinceRollup.province)),
+        'unique_groups': sorted(distinct(CustomerChannelProvinceRollup.main_customer_group)),
+    }
+
+@app.route('/api/charts/channel-province')
+@login_required
+def get_channel_province_slice():
+    """Query params: year (repeatable), month_from, month_to, province / channel / group (repeatable), group_by (comma-separated)."""
+    try:
+        years = [int(year) for year in request.args.getlist('year')]
+        month_from = request.args.get('month_from', 1, type=int)
+        month_to = request.args.get('month_to', 12, type=int)
+        group_by = [name for name in request.args.get('group_by', '').split(',') if name] or None
+    except ValueError:
+        return jsonify({'error': 'year must be an integer'}), 400
+    if not (1 <= month_from <= month_to <= 12):
+        return jsonify({'error': 'month_from and month_to must satisfy 1 <= month_from <= month_to <= 12'}), 400
+    if group_by and not set(group_by) <= set(CHANNEL_SLICE_DIMENSIONS):
+        return jsonify({'error': f"group_by must be a subset of {', '.join(CHANNEL_SLICE_DIMENSIONS)}"}), 400
+    try:
+        return jsonify(build_channel_province_slice(
+            years=years, month_from=month_from, month_to=month_to,
+            provinces=request.args.getlist('province'), channels=request.args.getlist('channel'),
+            groups=request.args.getlist('group'), group_by=group_by))
+    except Exception as e:
+        current_app.logger.error(f"Error generating channel/province slice: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/charts/channel-province/facets')
+@login_required
+def get_channel_province_facets():
+    """Filter options (years, months, channels, provinces, groups) for the channel/province chart."""
+    try:
+        return jsonify(build_channel_province_facets())
+    except Exception as e:
+        current_app.logger.error(f"Error generating channel/province facets: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Uploads are signed for this folder and incoming transformation only.
+CLOUDINARY_UPLOAD_TRANSFORMATION = "w_1000,h_1000,c_limit"
+# Cloudinary accepts a signed timestamp for one hour; stay well inside that.
+CLOUDINARY_SIGNATURE_TTL = 600
+# Per /api/cloudinary-signatures request; the upload pages ask in chunks of this size.
+MAX_SIGNATURE_BATCH = 30
+
+def _sign_upload_params(params):
+    return cloudinary_sdk().utils.api_sign_request(params, os.environ.get('CLOUDINARY_API_SECRET'))
+
 @app.route('/api/cloudinary-signature', methods=['GET'])
 @login_required
 def get_cloudinary_signature():
     """Generate a signature for direct Cloudinary uploads."""
     try:
-        timestamp = int(datetime.now().timestamp())
-        transformation = "w_1000,h_1000,c_limit"
-        params_to_sign = {'timestamp': timestamp, 'folder': 'customer_app_images', 'transformation': transformation}
-        signature = cloudinary.utils.api_sign_request(params_to_sign, os.environ.get('CLOUDINARY_API_SECRET'))
-        
+        # REVISED: One signature per user is reused for CLOUDINARY_SIGNATURE_TTL seconds.
+        cache_key = f"cloudinary_signature:{session.get('username')}"
+        payload = cache.get(cache_key)
+        if payload is None:
+            timestamp = int(datetime.now().timestamp())
+            transformation = CLOUDINARY_UPLOAD_TRANSFORMATION
+            params_to_sign = {'timestamp': timestamp, 'folder': CLOUDINARY_UPLOAD_FOLDER, 'transformation': transformation}
+            payload = {
+                'signature': _sign_upload_params(params_to_sign), 'timestamp': timestamp,
+                'api_key': os.environ.get('CLOUDINARY_API_KEY'),
+                'cloud_name': os.environ.get('CLOUDINARY_CLOUD_NAME'),
+                'transformation': transformation
+            }
+            cache.set(cache_key, payload, timeout=CLOUDINARY_SIGNATURE_TTL)
+        return jsonify(payload)
+    except Exception as e:
+        current_app.logger.error(f"Error generating Cloudinary signature: {e}")
+        return jsonify({'error': 'Could not generate signature'}), 500
+
+# NEW: Signed upload parameters for a whole batch of files in one round trip
+def _sign_upload_pool():
+    """MAX_SIGNATURE_BATCH signed parameter sets sharing one timestamp, each with its own public_id."""
+    timestamp = int(datetime.now().timestamp())
+    shared = {'timestamp': timestamp, 'folder': CLOUDINARY_UPLOAD_FOLDER, 'transformation': CLOUDINARY_UPLOAD_TRANSFORMATION}
+    uploads = []
+    for _ in range(MAX_SIGNATURE_BATCH):
+        public_id = uuid.uuid4().hex
+        uploads.append({'public_id': public_id, 'signature': _sign_upload_params({**shared, 'public_id': public_id})})
+    return {'pool_id': uuid.uuid4().hex, 'shared': shared, 'uploads': uploads}
+
+def _take_upload_signatures(count):
+    """
+    Takes `count` unused sets from this user's cached pool, signing a new pool when it runs out
+    or expires. Slots are claimed with the cache's atomic inc, so even concurrent requests
+    (other tabs, other workers) never get the same public_id (inc is atomic in TwoTierCache).
+    """
+    cache_key = f"cloudinary_signatures:{session.get('username')}"
+    pool = cache.get(cache_key)
+    if pool is not None:
+        taken = cache.cache.inc(f"{cache_key}:{pool['pool_id']}:taken", count)
+        if taken <= len(pool['uploads']):
+            return pool['shared'], pool['uploads'][taken - count:taken]
+    pool = _sign_upload_pool()
+    # The counter outlives the pool, so a pool that is still cached always has its counter.
+    cache.set(f"{cache_key}:{pool['pool_id']}:taken", count, timeout=CLOUDINARY_SIGNATURE_TTL + 60)
+    cache.set(cache_key, pool, timeout=CLOUDINARY_SIGNATURE_TTL)
+    return pool['shared'], pool['uploads'][:count]
+
+@app.route('/api/cloudinary-signatures', methods=['GET'])
+@login_required
+def get_cloudinary_signatures():
+    """
+    ?count=N (at most MAX_SIGNATURE_BATCH) returns N signed parameter sets sharing one timestamp, folder
+    and transformation, each with its own public_id, so a retried upload overwrites its asset instead
+    of adding a copy. Like the single-signature endpoint, the sets come from a per-user cached pool.
+    """
+    count = request.args.get('count', type=int)
+    if count is None or not 1 <= count <= MAX_SIGNATURE_BATCH:
+        return jsonify({'error': f'count must be between 1 and {MAX_SIGNATURE_BATCH}'}), 400
+    try:
+        shared, uploads = _take_upload_signatures(count)
         return jsonify({
-            'signature': signature, 'timestamp': timestamp,
+            **shared,
             'api_key': os.environ.get('CLOUDINARY_API_KEY'),
             'cloud_name': os.environ.get('CLOUDINARY_CLOUD_NAME'),
-            'transformation': transformation
+            'expires_at': shared['timestamp'] + CLOUDINARY_SIGNATURE_TTL,
+            'uploads': uploads
         })
     except Exception as e:
-        current_app.logger.error(f"Error generating Cloudinary signature: {e}")
-        return jsonify({'error': 'Could not generate signature'}), 500
+        current_app.logger.error(f"Error generating Cloudinary signatures: {e}")
+        return jsonify({'error': 'Could not generate signatures'}), 500
 
 @app.route('/update_customer_status', methods=['POST'])
 @login_required
@@ -1361,23 +2689,69 @@ def update_customer_status():
         return jsonify({'success': False, 'message': 'ไม่พบข้อมูลลูกค้า'}), 404
 
     try:
-        customer.status = new_status
+        # REVISED: The change (and its note) goes to customer_status_events instead of being appended to remarks
+        record_status_change(customer, new_status, data.get('note'))
         if new_status in ['รอตรวจ', 'เลื่อนนัด']:
-            customer.inspection_date = datetime.strptime(data.get('inspection_date'), '%Y-%m-%d').date() if data.get('inspection_date') else None
-            customer.inspection_time = datetime.strptime(data.get('inspection_time'), '%H:%M').time() if data.get('inspection_time') else None
+            customer.inspection_date = parse_date(data.get('inspection_date'))
+            customer.inspection_time = parse_time(data.get('inspection_time'))
             customer.inspector = data.get('inspector')
-        if new_status in ['ยกเลิก', 'ไม่อนุมัติ', 'ไม่ส่งเอกสาร']:
-            note = data.get('note')
-            customer.remarks = (customer.remarks or '') + f"\n[สถานะ: {new_status}] {note}"
 
+        changed_fields = changed_customer_fields(customer)
         db.session.commit()
-        cache.clear()
+        index_customer_record(customer)
+        invalidate_customer_caches(customer, changed_fields)
         return jsonify({'success': True, 'message': 'อัปเดตสถานะสำเร็จ'})
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error updating status for {record_id}: {e}")
         return jsonify({'success': False, 'message': f'เกิดข้อผิดพลาด: {e}'}), 500
 
+# NEW: Recent status changes of one customer, newest first (indexed by customer and time)
+@app.route('/api/customers/<int:record_id>/status-events', methods=['GET'])
+@login_required
+def get_customer_status_events(record_id):
+    limit = min(max(request.args.get('limit', STATUS_EVENTS_DEFAULT_LIMIT, type=int), 1), 200)
+    customer = get_customer_by_db_id(record_id)
+    if not customer:
+        return jsonify({'error': 'ไม่พบข้อมูลลูกค้า'}), 404
+    events = customer.status_events.limit(limit).all()
+    return jsonify({'events': [event.to_dict() for event in events]})
+
+# NEW: Partial update. Only the submitted fields are validated, only the ones whose value differs are
+# written (SQLAlchemy's UPDATE then sets just those columns), and only the caches they feed are invalidated.
+@app.route('/api/customers/<int:record_id>', methods=['PATCH'])
+@login_required
+def patch_customer(record_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({'success': False, 'message': 'ต้องส่งข้อมูลเป็น JSON object ของฟิลด์ที่แก้ไข'}), 400
+
+    values, errors = CUSTOMER_PATCH_SCHEMA.validate(data)
+    if errors:
+        return jsonify({'success': False, 'message': 'ข้อมูลไม่ถูกต้อง', 'errors': errors}), 400
+
+    customer = get_customer_by_db_id(record_id)
+    if not customer:
+        return jsonify({'success': False, 'message': 'ไม่พบข้อมูลลูกค้า'}), 404
+
+    changes = {field: value for field, value in values.items() if getattr(customer, field) != value}
+    if not changes:
+        # Nothing differs: no UPDATE, no commit, no cache invalidation
+        return jsonify({'success': True, 'changed': []})
+
+    try:
+        for field, value in changes.items():
+            setattr(customer, field, value)
+        changed_fields = changed_customer_fields(customer)
+        db.session.commit()
+        index_customer_record(customer)
+        invalidate_customer_caches(customer, changed_fields)
+        return jsonify({'success': True, 'changed': sorted(changes)})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error patching customer {record_id}: {e}")
+        return jsonify({'success': False, 'message': f'เกิดข้อผิดพลาด: {e}'}), 500
+
 # =================================================================================
 # NEW API: LOGIN HISTORY
 # =================================================================================
@@ -1398,10 +2772,200 @@ def get_login_history():
         current_app.logger.error(f"Error fetching login history: {e}")
         return jsonify({'error': 'Internal Server Error'}), 500
 
+@app.route('/api/cache-stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    """Hit-rate and invalidation counters of this worker's tagged cache."""
+    if session.get('username') != 'khanhommha':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(tagged_cache.stats())
+
+# NEW: Dead-letter list of the background task queue (tasks that failed every retry)
+@app.route('/api/background-tasks/dead', methods=['GET'])
+@login_required
+def get_dead_background_tasks():
+    if session.get('username') != 'khanhommha':
+        return jsonify({'error': 'Unauthorized'}), 403
+    tasks = [{
+        'id': task['id'],
+        'task_type': task['task_type'],
+        'payload': json.loads(task['payload']),
+        'attempts': task['attempts'],
+        'last_error': task['last_error'],
+        'created_at': task['created_at'].isoformat() if task['created_at'] else None,
+    } for task in task_queue.dead_tasks(db.engine)]
+    return jsonify({'tasks': tasks, 'count': len(tasks)})
+
+@app.route('/api/background-tasks/<int:task_id>/retry', methods=['POST'])
+@login_required
+def retry_background_task(task_id):
+    if session.get('username') != 'khanhommha':
+        return jsonify({'error': 'Unauthorized'}), 403
+    if not task_queue.retry(db.engine, task_id):
+        return jsonify({'success': False, 'error': 'Task not found in the dead-letter list'}), 404
+    return jsonify({'success': True})
+
+# =================================================================================
+# CLI COMMANDS
+# =================================================================================
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Builds the n-gram search index from the database and reports its size.
+
+    Running workers keep their own copy and rebuild it every SEARCH_INDEX_MAX_AGE
+    seconds; this command is for checking build time and size against real data.
+    """
+    started = time.perf_counter()
+    rebuild_customer_search_index()
+    elapsed = time.perf_counter() - started
+    print(f"Indexed customers up to id {customer_search_index.max_id}: "
+          f"{len(customer_search_index):,} distinct n-grams in {elapsed:.2f}s")
+
+@app.cli.command('setup-fulltext')
+def setup_fulltext_command():
+    """Creates (or rebuilds) the full-text index used by the search backend for this database."""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        backend = fulltext_search_backends['sqlite']
+        for statement in backend.ddl_statements(CustomerRecord.__tablename__):
+            db.session.execute(text(statement))
+        db.session.execute(text(backend.rebuild_statement()))
+    elif dialect == 'mysql':
+        # Recreate the index so existing databases pick up the ngram parser.
+        index_exists = db.session.execute(text(
+            "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+            "AND table_name = 'customer_records' AND index_name = 'ix_customer_records_fulltext' LIMIT 1"
+        )).first()
+        if index_exists:
+            db.session.execute(text("ALTER TABLE customer_records DROP INDEX ix_customer_records_fulltext"))
+        db.session.execute(text(
+            "ALTER TABLE customer_records ADD FULLTEXT INDEX ix_customer_records_fulltext "
+            f"({', '.join(FULLTEXT_COLUMNS)}) WITH PARSER ngram"
+        ))
+    else:
+        print(f"No full-text engine for dialect '{dialect}'; search will use LIKE.")
+        return
+    db.session.commit()
+    print(f"Full-text index ready for {dialect}.")
+
+@app.cli.command('backfill-customer-digits')
+def backfill_customer_digits_command():
+    """Adds the digits-only phone / ID card columns if missing and fills them for existing rows."""
+    inspector = db.inspect(db.engine)
+    existing_columns = {col['name'] for col in inspector.get_columns('customer_records')}
+    existing_indexes = {ix['name'] for ix in inspector.get_indexes('customer_records')}
+    for column_name in ('mobile_phone_digits', 'id_card_digits'):
+        if column_name not in existing_columns:
+            db.session.execute(text(f"ALTER TABLE customer_records ADD COLUMN {column_name} VARCHAR(100)"))
+        index_name = f"ix_customer_records_{column_name}"
+        if index_name not in existing_indexes:
+            db.session.execute(text(f"CREATE INDEX {index_name} ON customer_records ({column_name})"))
+    db.session.commit()
+
+    # Walk the table in id order, one committed batch at a time.
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(CustomerRecord.id, CustomerRecord.mobile_phone, CustomerRecord.id_card_number) \
+            .filter(CustomerRecord.id > last_id).order_by(CustomerRecord.id).limit(5000).all()
+        if not rows:
+            break
+        db.session.execute(db.update(CustomerRecord), [
+            {'id': record_id, 'mobile_phone_digits': digits_only(mobile_phone), 'id_card_digits': digits_only(id_card_number)}
+            for record_id, mobile_phone, id_card_number in rows
+        ])
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+    print(f"Backfilled digits-only columns for {updated:,} customers.")
+
+@app.cli.command('backfill-ledger')
+def backfill_ledger_command():
+    """Fills ledger_entries from all_pid_jobs rows written outside the ORM (imports, manual SQL)."""
+    inserted = backfill_ledger_entries()
+    db.session.commit()
+    print(f"Backfilled {inserted:,} ledger entries.")
+
+@app.cli.command('backfill-customer-images')
+def backfill_customer_images_command():
+    """Moves photo URLs from the legacy image_urls / contract_image_urls columns into customer_images and clears them."""
+    added = backfill_customer_images()
+    db.session.commit()
+    print(f"Backfilled {added} customer images.")
+
+@app.cli.command('reconcile-loan-summary')
+def reconcile_loan_summary_command():
+    """Rebuilds customer_loan_summary from all_pid_jobs and reports how many rows had drifted."""
+    ledger = compute_ledger_figures()
+    summaries = {summary.customer_id: summary for summary in CustomerLoanSummary.query}
+    created = corrected = 0
+    for customer_id in set(ledger) | set(summaries):
+        values = ledger.get(customer_id) or _empty_loan_summary_values()
+        summary = summaries.get(customer_id)
+        if summary is None:
+            db.session.add(CustomerLoanSummary(customer_id=customer_id, **values))
+            created += 1
+            continue
+        drifted = False
+        for name, value in values.items():
+            current = getattr(summary, name)
+            if name.startswith('total_') or name == 'last_interest':
+                differs = (current is None) != (value is None) or (value is not None and _as_decimal(current) != value)
+            else:
+                differs = current != value
+            if differs:
+                setattr(summary, name, value)
+                drifted = True
+        corrected += drifted
+    db.session.commit()
+    print(f"Loan summary reconciled: {len(ledger):,} customers in the ledger, {created:,} rows created, {corrected:,} rows corrected.")
+
+@app.cli.command('run-task-worker')
+@click.option('--once', is_flag=True, help='Run the tasks that are due now and exit.')
+def run_task_worker_command(once):
+    """Runs the background task queue in this process (use with TASK_WORKER_ENABLED=0 on the web workers)."""
+    if once:
+        succeeded, failed = task_queue.run_pending(db.engine, limit=1000)
+        print(f"Ran {succeeded + failed} tasks: {succeeded} succeeded, {failed} failed.")
+        return
+    print("Task worker started.")
+    task_queue.run_forever(db.engine, poll_interval=app.config['TASK_WORKER_POLL_INTERVAL'])
+
+@app.cli.command('sweep-cloudinary-orphans')
+@click.option('--min-age-hours', default=24, show_default=True, help='Skip assets uploaded more recently than this.')
+@click.option('--dry-run', is_flag=True, help='Only report the orphans.')
+def sweep_cloudinary_orphans_command(min_age_hours, dry_run):
+    """Queues deletion of uploaded images that no customer, loan or contract document references any more."""
+    referenced = referenced_cloudinary_public_ids()
+    orphans = list(iter_orphans(cloudinary_sdk().api, f'{CLOUDINARY_UPLOAD_FOLDER}/', referenced, timedelta(hours=min_age_hours)))
+    if not dry_run and orphans:
+        enqueue_public_id_deletions(orphans)
+        db.session.commit()
+    action = 'Found' if dry_run else 'Queued deletion of'
+    print(f"{action} {len(orphans)} orphaned images ({len(referenced)} referenced).")
+
+@app.cli.command('rebuild-chart-rollups')
+def rebuild_chart_rollups_command():
+    """Recomputes the dashboard chart rollup tables from customer_records."""
+    started = time.perf_counter()
+    rebuild_chart_rollups()
+    elapsed = time.perf_counter() - started
+    monthly_rows = db.session.query(func.count()).select_from(CustomerMonthlyRollup).scalar()
+    channel_rows = db.session.query(func.count()).select_from(CustomerChannelProvinceRollup).scalar()
+    print(f"Rebuilt chart rollups: {monthly_rows:,} monthly rows, {channel_rows:,} channel/province rows in {elapsed:.2f}s")
+
 # =================================================================================
 # MAIN EXECUTION
 # =================================================================================
 
+# `gunicorn app:app` (Procfile), wsgi.py and `flask --app app` get the app configured from the environment
+# at import, so they still pay the full cost (SECRET_KEY / DB settings required, engine and cache built);
+# the factory only moved the optional pieces (Alembic, Cloudinary, pandas) off that path.
+# Tests and tools that bring their own settings set CREATE_APP_ON_IMPORT=0 and call create_app(config).
+if os.environ.get('CREATE_APP_ON_IMPORT', '1') == '1':
+    create_app()
+
 if __name__ == '__main__':
     # Use app.run() only for local development.
     # For production, use a proper WSGI server like Gunicorn or uWSGI.
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: per-field form coercion, pandas/strptime vs. coercion.py.
+
+Times the old inline helpers (pd.to_numeric on one string, datetime.strptime)
+against the precompiled parsers the write paths now use, on values shaped
+like real form input. pandas is only needed for the 'legacy' column; without
+it that column is skipped.
+
+    python bench_coercion.py --number 100000
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+from coercion import parse_date, parse_decimal, parse_time
+
+AMOUNTS = ['50,000', '1,234.50', '100000', '', '฿ 25,000']
+DATES = ['2025-10-01', '2024-02-29', '']
+TIMES = ['14:30', '09:05:30', '']
+
+
+def legacy_decimal(value):
+    import pandas as pd
+    if value is None or value.strip() == '':
+        return None
+    return pd.to_numeric(str(value).replace(',', ''), errors='coerce')
+
+
+def legacy_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def legacy_time(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%H:%M:%S' if len(value) > 5 else '%H:%M').time()
+
+
+# (label, values, legacy parser, new parser)
+CASES = [
+    ('decimal', AMOUNTS, legacy_decimal, parse_decimal),
+    ('date', DATES, legacy_date, parse_date),
+    ('time', TIMES, legacy_time, parse_time),
+]
+
+
+def per_call_us(parser, values, number):
+    """Best-of-3 microseconds per parsed value."""
+    def run():
+        for value in values:
+            parser(value)
+    return min(timeit.repeat(run, number=number, repeat=3)) / (number * len(values)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    try:
+        import pandas  # noqa: F401
+        has_pandas = True
+    except ImportError:
+        has_pandas = False
+
+    print(f"{'field':<10} {'legacy us':>10} {'new us':>10} {'speedup':>8}")
+    for label, values, legacy, new in CASES:
+        new_us = per_call_us(new, values, args.number)
+        if label == 'decimal' and not has_pandas:
+            print(f"{label:<10} {'-':>10} {new_us:>10.2f} {'-':>8}")
+            continue
+        legacy_us = per_call_us(legacy, values, args.number)
+        print(f"{label:<10} {legacy_us:>10.2f} {new_us:>10.2f} {legacy_us / new_us:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
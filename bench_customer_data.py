@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: full-table render vs. keyset streaming for /customer_data.
+
+Seeds a scratch SQLite database with synthetic customers, then runs each mode
+in its own process so peak RSS is measured independently.
+
+    python bench_customer_data.py --rows 200000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+MODES = ('legacy', 'stream')
+
+
+def _import_app(db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+    import app as app_module
+    return app_module
+
+
+def seed(db_path, rows):
+    """Creates the schema and inserts `rows` synthetic customers in bulk."""
+    app_module = _import_app(db_path)
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        start = datetime(2020, 1, 1)
+        batch = []
+        for i in range(rows):
+            batch.append({
+                'customer_id': str(1001 + i),
+                'timestamp': start + timedelta(minutes=i),
+                'first_name': f'ลูกค้า{i}',
+                'last_name': 'ทดสอบ',
+                'mobile_phone': f'08{i:08d}',
+                'business_name': f'ร้านค้า {i}',
+                'province': 'กรุงเทพมหานคร',
+                'status': 'รอติดต่อ',
+                'desired_credit_limit': 50000,
+            })
+            if len(batch) == 5000:
+                app_module.db.session.execute(app_module.CustomerRecord.__table__.insert(), batch)
+                batch = []
+        if batch:
+            app_module.db.session.execute(app_module.CustomerRecord.__table__.insert(), batch)
+        app_module.db.session.commit()
+
+
+def run_mode(db_path, mode):
+    """Renders the page in one mode and prints 'ttfb_ms total_ms peak_rss_mb bytes'."""
+    app_module = _import_app(db_path)
+    flask_app = app_module.app
+    started = time.perf_counter()
+    with flask_app.test_request_context('/customer_data'):
+        if mode == 'legacy':
+            # The previous implementation: load every row, then render the whole page at once.
+            body = app_module.render_template('customer_data.html',
+                                              customer_records=app_module.get_all_customer_records(),
+                                              next_cursor=None, limit=None)
+            chunks = iter([body])
+        else:
+            records = (record.to_dict() for record in app_module.iter_customer_records())
+            chunks = app_module.stream_template('customer_data.html', customer_records=records,
+                                                next_cursor=None, limit=None)
+        first = next(chunks)
+        ttfb = time.perf_counter() - started
+        size = len(first.encode('utf-8'))
+        for chunk in chunks:
+            size += len(chunk.encode('utf-8'))
+    total = time.perf_counter() - started
+    # ru_maxrss is reported in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{ttfb * 1000:.1f} {total * 1000:.1f} {peak_rss_mb:.1f} {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.db, args.mode)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.sqlite')
+        print(f"Seeding {args.rows:,} customer records...")
+        seed(db_path, args.rows)
+        print(f"{'mode':<8} {'TTFB ms':>10} {'total ms':>10} {'peak RSS MB':>12} {'bytes':>14}")
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--db', db_path],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            ttfb, total, rss, size = output[-4:]
+            print(f"{mode:<8} {ttfb:>10} {total:>10} {rss:>12} {int(size):>14,}")
+
+
+if __name__ == '__main__':
+    main()
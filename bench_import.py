@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: import-time budget of app.py (what every gunicorn worker boot,
+wsgi.py import and test collection pays before serving anything).
+
+Runs `python -X importtime -c "import app"` in fresh processes, reports the
+median total and the heaviest top-level imports, and fails if the total is over
+budget or if a module that should load lazily (pandas, numpy, the Cloudinary
+SDK, Alembic) was imported at startup.
+
+    python bench_import.py --runs 5 --budget-ms 600
+    python bench_import.py --no-create-app   # module import only, as the tests do
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Modules app.py must not import at startup; they are loaded on first use.
+LAZY_MODULES = ('pandas', 'numpy', 'cloudinary', 'alembic', 'flask_migrate')
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def profile_import(create_app=True):
+    """One fresh-process import of app.py; returns {top-level module: cumulative us} and the set of all modules."""
+    env = dict(os.environ)
+    env.update(SECRET_KEY='benchmark-secret', DATABASE_URL='sqlite://', CACHE_DIR=tempfile.mkdtemp(prefix='bench_import_'),
+               CREATE_APP_ON_IMPORT='1' if create_app else '0', TASK_WORKER_ENABLED='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(f"import app failed:\n{result.stderr[-2000:]}")
+    rows = [match.groups() for match in map(IMPORTTIME_LINE.match, result.stderr.splitlines()) if match]
+    # Children are listed before their parent, so app's subtree is everything after the previous
+    # unindented line (interpreter startup, e.g. site) up to the 'app' line itself.
+    end = next(i for i, (_, _, indent, name) in enumerate(rows) if name == 'app' and not indent)
+    start = max((i for i in range(end) if not rows[i][2]), default=-1) + 1
+    top_level, modules = {'app': int(rows[end][1])}, set()
+    for _, cumulative, indent, name in rows[start:end]:
+        modules.add(name)
+        if len(indent) == 2:  # imported directly by app.py
+            top_level[name] = int(cumulative)
+    return top_level, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=600)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--no-create-app', action='store_true', help='set CREATE_APP_ON_IMPORT=0')
+    args = parser.parse_args()
+
+    profile_import(not args.no_create_app)  # warm-up: writes .pyc files
+    runs = [profile_import(not args.no_create_app) for _ in range(args.runs)]
+    totals = [top_level['app'] / 1000 for top_level, _ in runs]
+    total_ms = statistics.median(totals)
+
+    last_top_level, modules = runs[-1]
+    heaviest = sorted((item for item in last_top_level.items() if item[0] != 'app'), key=lambda item: -item[1])
+    print(f"{'module':<28} {'cumulative ms':>14}")
+    for name, cumulative in heaviest[:args.top]:
+        print(f"{name:<28} {cumulative / 1000:>14.1f}")
+    print(f"{'import app (median)':<28} {total_ms:>14.1f}   budget {args.budget_ms:.0f} ms, "
+          f"runs {min(totals):.0f}-{max(totals):.0f} ms")
+
+    failures = []
+    eager = sorted(name for name in LAZY_MODULES if name in modules)
+    if eager:
+        failures.append(f"imported at startup but should be lazy: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: LIKE scan vs. n-gram index vs. the dialect's engine for /search_customer_data.
+
+Seeds a scratch SQLite database with synthetic Thai customers, builds the
+in-process n-gram index and the FTS5 table, then times one search page
+(COUNT + first 15 rows) through each path. The 'engine' column is what the
+app uses by default: FTS5 for text and the digits-only columns for numbers.
+
+    python bench_search.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SYLLABLES = ['สม', 'ศรี', 'ชาย', 'หญิง', 'มานี', 'ปิติ', 'วิชัย', 'สุดา', 'ประ', 'เสริฐ', 'กิตติ', 'พงษ์',
+             'รัตน', 'นภา', 'ธนา', 'กร', 'อรุณ', 'วงศ์', 'ทอง', 'ดี', 'ใจ', 'สุข', 'เจริญ', 'ชัย']
+BUSINESSES = ['ร้านข้าวมันไก่', 'ร้านกาแฟ', 'อู่ซ่อมรถ', 'ร้านเสริมสวย', 'ร้านขายของชำ', 'ร้านก๋วยเตี๋ยว']
+
+
+def _name(rng, parts):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(parts))
+
+
+def seed(app_module, rows):
+    """Creates the schema and inserts `rows` synthetic customers in bulk."""
+    rng = random.Random(42)
+    start = datetime(2020, 1, 1)
+    app_module.db.create_all()
+    insert = app_module.CustomerRecord.__table__.insert()
+    batch = []
+    for i in range(rows):
+        row = {
+            'customer_id': str(1001 + i),
+            'timestamp': start + timedelta(minutes=i),
+            'first_name': _name(rng, 2),
+            'last_name': _name(rng, 3),
+            'mobile_phone': f'0{rng.randint(80000000, 99999999)}-{rng.randint(0, 9)}',
+            'id_card_number': f'{rng.randint(10 ** 12, 10 ** 13 - 1)}',
+            'business_name': f'{rng.choice(BUSINESSES)}{_name(rng, 1)}',
+            'remarks': None,
+            'status': 'รอติดต่อ',
+        }
+        # Core inserts bypass the ORM validators that fill the digits-only columns.
+        row['mobile_phone_digits'] = app_module.digits_only(row['mobile_phone'])
+        row['id_card_digits'] = app_module.digits_only(row['id_card_number'])
+        batch.append(row)
+        if len(batch) == 10000:
+            app_module.db.session.execute(insert, batch)
+            batch = []
+    if batch:
+        app_module.db.session.execute(insert, batch)
+    app_module.db.session.commit()
+
+
+# (label, SEARCH_BACKEND, SEARCH_INDEX_ENABLED)
+PATHS = [('LIKE ms', 'like', False), ('ngram ms', 'like', True), ('engine ms', 'auto', False)]
+
+
+def time_search(app_module, keyword, backend, use_index, repeat):
+    """Returns (best seconds, total matches) for one search page over `repeat` runs."""
+    app_module.app.config.update(SEARCH_BACKEND=backend, SEARCH_INDEX_ENABLED=use_index)
+    best = None
+    total = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query, order_by = app_module.build_customer_search_query(keyword)
+        pagination = query.order_by(*order_by).paginate(page=1, per_page=15, error_out=False)
+        elapsed = time.perf_counter() - started
+        total = pagination.total
+        best = elapsed if best is None else min(best, elapsed)
+    return best, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+        os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+        import app as app_module
+
+        with app_module.app.test_request_context('/search_customer_data'):
+            print(f"Seeding {args.rows:,} customer records...")
+            seed(app_module, args.rows)
+
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.perf_counter()
+            app_module.rebuild_customer_search_index()
+            build_seconds = time.perf_counter() - started
+            rss_growth_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+            print(f"Index build: {build_seconds:.1f}s, {len(app_module.customer_search_index):,} n-grams, "
+                  f"peak RSS +{rss_growth_mb:.0f} MB")
+
+            rng = random.Random(7)
+            sample = app_module.CustomerRecord.query.filter_by(customer_id=str(1001 + rng.randrange(args.rows))).first()
+            keywords = [sample.first_name, sample.last_name, sample.mobile_phone[:7], sample.id_card_number, 'ไม่มีอยู่จริง']
+
+            print(f"{'keyword':<24} {'matches':>8}" + ''.join(f" {label:>10}" for label, _, _ in PATHS))
+            for keyword in keywords:
+                timings = []
+                totals = set()
+                for _, backend, use_index in PATHS:
+                    seconds, total = time_search(app_module, keyword, backend, use_index, args.repeat)
+                    timings.append(seconds)
+                    totals.add(total)
+                assert len(totals) == 1, f"result mismatch for {keyword!r}: {totals}"
+                print(f"{keyword:<24} {totals.pop():>8}" + ''.join(f" {seconds * 1000:>10.1f}" for seconds in timings))
+
+if __name__ == '__main__':
+    main()
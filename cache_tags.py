@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tag-based invalidation on top of a flask_caching Cache.
+
+Every cached entry declares the tags it depends on (e.g. 'charts:monthly',
+'charts:channel_province'). Each tag has a generation number stored in the cache, and the
+current generations are folded into the entry's key. Invalidating a tag only
+bumps its generation: entries built on the old generation can no longer be
+addressed and simply expire, so no key enumeration or cache.clear() is needed.
+"""
+from functools import wraps
+import time
+
+
+class TaggedCache:
+    """Wraps a flask_caching Cache with tag generations and hit/miss counters."""
+
+    GENERATION_PREFIX = 'tag-generation:'
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _generations(self, tags):
+        keys = [self.GENERATION_PREFIX + tag for tag in tags]
+        values = list(self.cache.get_many(*keys)) if keys else []
+        for i, value in enumerate(values):
+            if value is None:
+                # A missing generation (never set, or evicted) restarts at a fresh unique value,
+                # so entries stored under an earlier generation can never match again.
+                self.cache.add(keys[i], time.time_ns(), timeout=0)
+                values[i] = self.cache.get(keys[i])
+        return values
+
+    def make_key(self, key, tags):
+        """Returns the storage key for `key` under the current generation of each tag."""
+        generations = self._generations(tags)
+        return key + ''.join(f'|{tag}@{generation}' for tag, generation in zip(tags, generations))
+
+    def get(self, key, tags):
+        value = self.cache.get(self.make_key(key, tags))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, tags, timeout=None):
+        self.cache.set(self.make_key(key, tags), value, timeout=timeout)
+
+    def invalidate(self, *tags):
+        """Makes every entry depending on any of `tags` unreachable."""
+        for tag in tags:
+            self.cache.set(self.GENERATION_PREFIX + tag, time.time_ns(), timeout=0)
+        self.invalidations += len(tags)
+
+    def cached(self, key_prefix, tags, timeout=None):
+        """Decorator caching a function's (non-None) return value under `key_prefix`, tagged with `tags`."""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                value = self.get(key_prefix, tags)
+                if value is None:
+                    value = f(*args, **kwargs)
+                    if value is not None:
+                        self.set(key_prefix, value, tags, timeout=timeout)
+                return value
+            return decorated_function
+        return decorator
+
+    def stats(self):
+        """Per-process counters since startup."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Batched deletion of Cloudinary assets and the orphan sweep.
+
+Assets are identified by their public_id, parsed once from the delivery URL
+stored in the database. Deletions go through the Admin API's delete_resources,
+which takes up to DELETE_BATCH_SIZE public_ids per call, instead of one
+uploader.destroy round trip (and one rate-limit unit) per image.
+
+The sweeper pages through an upload folder and yields the assets that no stored
+URL references any more. Assets younger than a grace period are skipped, since
+the browser uploads to Cloudinary before the app saves the URL.
+
+The `api` argument is the cloudinary.api module, or any object with the same
+delete_resources / resources methods (tests pass a fake).
+"""
+import os
+from datetime import UTC, datetime, timedelta
+
+DELETE_BATCH_SIZE = 100  # delete_resources limit per call
+LIST_PAGE_SIZE = 500  # resources() limit per page
+# Per-id results of delete_resources that mean the asset is gone
+DELETED_RESULTS = ('deleted', 'not_found')
+
+
+def public_id_from_url(url):
+    """
+    public_id of an uploaded asset, or None if `url` is not a Cloudinary upload URL.
+    e.g. https://res.cloudinary.com/<cloud_name>/image/upload/v12345/customer_app_images/abc.jpg -> 'customer_app_images/abc'
+    """
+    url = (url or '').strip()
+    if '/upload/' not in url:
+        return None
+    public_id_with_folder = '/'.join(url.split('/')[-2:])
+    return os.path.splitext(public_id_with_folder)[0]
+
+
+def split_urls(value):
+    """URLs from a comma-separated column such as CustomerRecord.image_urls."""
+    return [url.strip() for url in (value or '').split(',') if url.strip()]
+
+
+def public_ids_from_urls(urls):
+    """Distinct public_ids of `urls`, in first-seen order; non-Cloudinary URLs are dropped."""
+    public_ids = {}
+    for url in urls:
+        public_id = public_id_from_url(url)
+        if public_id:
+            public_ids[public_id] = None
+    return list(public_ids)
+
+
+def chunked(items, size=DELETE_BATCH_SIZE):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def delete_batch(api, public_ids):
+    """
+    Deletes up to DELETE_BATCH_SIZE assets in one call.
+    Returns the public_ids Cloudinary could not delete (an empty list means every asset is gone).
+    """
+    if len(public_ids) > DELETE_BATCH_SIZE:
+        raise ValueError(f'delete_resources takes at most {DELETE_BATCH_SIZE} public_ids per call')
+    result = api.delete_resources(list(public_ids))
+    deleted = result.get('deleted', {})
+    return [public_id for public_id in public_ids if deleted.get(public_id) not in DELETED_RESULTS]
+
+
+def iter_folder_resources(api, prefix, page_size=LIST_PAGE_SIZE):
+    """Yields every uploaded resource whose public_id starts with `prefix`, one listing page at a time."""
+    next_cursor = None
+    while True:
+        options = {'type': 'upload', 'prefix': prefix, 'max_results': page_size}
+        if next_cursor:
+            options['next_cursor'] = next_cursor
+        page = api.resources(**options)
+        yield from page.get('resources', [])
+        next_cursor = page.get('next_cursor')
+        if not next_cursor:
+            return
+
+
+def iter_orphans(api, prefix, referenced_public_ids, min_age=timedelta(hours=24), now=None):
+    """Yields public_ids in the `prefix` folder that are older than `min_age` and not in `referenced_public_ids`."""
+    cutoff = (now or datetime.now(UTC)) - min_age
+    for resource in iter_folder_resources(api, prefix):
+        public_id = resource['public_id']
+        if public_id in referenced_public_ids:
+            continue
+        created_at = resource.get('created_at')
+        # e.g. '2025-10-01T08:15:30Z'; an asset without a timestamp is treated as new and kept
+        if not created_at or datetime.fromisoformat(created_at.replace('Z', '+00:00')) > cutoff:
+            continue
+        yield public_id
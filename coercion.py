@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Form and JSON value coercion for the write paths, without pandas.
+
+Every parser works on one value with a precompiled regex and the stdlib
+constructors (Decimal, date, time), so a form save costs a few microseconds
+per field instead of a pd.to_numeric dispatch, and the result is the exact
+Python type SQLAlchemy binds (no NumPy scalar to convert again).
+
+Blank input ('' / whitespace / None) means "no value" and gives None. The
+parse_* functions raise ValueError on anything else they cannot read; the
+clean_* variants return None instead, for fields where a bad entry is dropped.
+"""
+import re
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+
+# Thai digits ๐-๙, thousands separators, spaces and the currency sign / unit are accepted in amounts.
+THAI_DIGITS = str.maketrans('๐๑๒๓๔๕๖๗๘๙', '0123456789')
+AMOUNT_NOISE = re.compile(r'[,\s฿]|บาท')
+AMOUNT_PATTERN = re.compile(r'[+-]?(?:\d+(?:\.\d*)?|\.\d+)')
+DATE_PATTERN = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+TIME_PATTERN = re.compile(r'(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?')
+
+
+def is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_decimal(value):
+    """
+    Decimal of an amount such as '1,234.50', '฿ 50,000', '๑๒,๕๐๐ บาท' or 1500.
+    None for blank input; ValueError if it is not a finite number (NaN / Infinity included).
+    """
+    if is_blank(value):
+        return None
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            raise ValueError(f'Not a number: {value!r}')
+        return value
+    if isinstance(value, bool):
+        raise ValueError(f'Not a number: {value!r}')
+    if isinstance(value, int):
+        return Decimal(value)
+    text = AMOUNT_NOISE.sub('', str(value).translate(THAI_DIGITS))
+    if not AMOUNT_PATTERN.fullmatch(text):
+        raise ValueError(f'Not a number: {value!r}')
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f'Not a number: {value!r}') from None
+
+
+def parse_date(value, required=False):
+    """date of 'YYYY-MM-DD' (month and day may be one digit); None for blank input unless `required`."""
+    if is_blank(value):
+        if required:
+            raise ValueError('A date is required')
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    match = DATE_PATTERN.fullmatch(str(value).strip())
+    if not match:
+        raise ValueError(f'Not a YYYY-MM-DD date: {value!r}')
+    return date(*map(int, match.groups()))
+
+
+def parse_time(value):
+    """time of 'HH:MM' or 'HH:MM:SS' (both sent by <input type="time">); None for blank input."""
+    if is_blank(value):
+        return None
+    if isinstance(value, time):
+        return value
+    match = TIME_PATTERN.fullmatch(str(value).strip())
+    if not match:
+        raise ValueError(f'Not an HH:MM[:SS] time: {value!r}')
+    hour, minute, second = match.groups()
+    return time(int(hour), int(minute), int(second or 0))
+
+
+def _lenient(parse):
+    def clean(value):
+        try:
+            return parse(value)
+        except ValueError:
+            return None
+    clean.__name__ = parse.__name__.replace('parse_', 'clean_')
+    clean.__doc__ = f'Like {parse.__name__}, but an unreadable value gives None instead of ValueError.'
+    return clean
+
+
+clean_decimal = _lenient(parse_decimal)
+clean_date = _lenient(parse_date)
+clean_time = _lenient(parse_time)
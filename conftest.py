@@ -1,13 +1,21 @@
+import os
+import tempfile
 import pytest
-from app import app as flask_app, db as sqlalchemy_db, User, generate_password_hash
+
+# ใช้ไฟล์แคช (L2) แยกสำหรับแต่ละรอบการทดสอบ ไม่ให้ปนกับแคชของเซิร์ฟเวอร์จริงหรือรอบก่อนหน้า
+os.environ['CACHE_DIR'] = tempfile.mkdtemp(prefix='customer_app_cache_')
+# import app.py โดยไม่สร้างแอปจาก environment (ไม่ต้องมี SECRET_KEY / DB_PASSWORD) แล้วเรียก create_app() เองด้านล่าง
+os.environ['CREATE_APP_ON_IMPORT'] = '0'
+
+from app import create_app, db as sqlalchemy_db, User, generate_password_hash
 
 @pytest.fixture(scope='module')
 def app():
     """
     สร้าง Instance ของ Flask application สำหรับการทดสอบ
     """
-    # ตั้งค่าให้แอปอยู่ในโหมดทดสอบ
-    flask_app.config.update({
+    # ตั้งค่าให้แอปอยู่ในโหมดทดสอบ (create_app ทำงานครั้งเดียว โมดูลถัดไปจะได้แอปเดิมกลับมา)
+    flask_app = create_app({
         "TESTING": True,
         # **สำคัญ:** ใช้ฐานข้อมูล SQLite ในหน่วยความจำเพื่อไม่ให้กระทบฐานข้อมูลจริง
         "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
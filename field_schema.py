@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of partial (PATCH) updates against a table's columns.
+
+A FieldSchema is compiled once from the SQLAlchemy columns it exposes: each
+field gets a coercer picked from its column type (string with max length,
+decimal with scale, date, time) and its nullability, so validating a request
+is one dict lookup and one call per submitted field, with no per-request
+inspection of the model. The parsing itself lives in coercion.py.
+
+Only the submitted fields are checked and returned; callers compare them with
+the current row to find what actually changed.
+"""
+from decimal import Decimal
+
+from sqlalchemy import Date, Numeric, String, Text, Time
+
+from coercion import parse_date, parse_decimal, parse_time
+
+
+class FieldError(ValueError):
+    """A submitted value that cannot be stored in its column; the message is shown to the user."""
+
+
+def _string(max_length):
+    def coerce(value):
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise FieldError('ต้องเป็นข้อความ')
+        value = str(value).strip()
+        if max_length is not None and len(value) > max_length:
+            raise FieldError(f'ยาวเกิน {max_length} ตัวอักษร')
+        return value
+    return coerce
+
+
+def _decimal(precision, scale):
+    # Largest absolute value a DECIMAL(precision, scale) column accepts
+    limit = Decimal(10) ** ((precision or 38) - (scale or 0))
+    quantum = Decimal(1).scaleb(-scale) if scale is not None else None
+
+    def coerce(value):
+        if not isinstance(value, (str, int, float, Decimal)):
+            raise FieldError('ต้องเป็นตัวเลข')
+        try:
+            number = parse_decimal(value)
+        except ValueError:
+            raise FieldError('ต้องเป็นตัวเลข') from None
+        if abs(number) >= limit:
+            raise FieldError('ตัวเลขมากเกินไป')
+        return number.quantize(quantum) if quantum is not None else number
+    return coerce
+
+
+def _date(value):
+    try:
+        return parse_date(value)
+    except ValueError:
+        raise FieldError('รูปแบบวันที่ต้องเป็น YYYY-MM-DD') from None
+
+
+def _time(value):
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise FieldError('รูปแบบเวลาต้องเป็น HH:MM หรือ HH:MM:SS') from None
+
+
+def coercer_for(column):
+    """Picks the coercer for a column from its SQL type."""
+    column_type = column.type
+    if isinstance(column_type, Numeric):
+        return _decimal(column_type.precision, column_type.scale)
+    if isinstance(column_type, Date):
+        return _date
+    if isinstance(column_type, Time):
+        return _time
+    if isinstance(column_type, (String, Text)):
+        return _string(getattr(column_type, 'length', None))
+    raise TypeError(f'No coercer for column {column.name} of type {column_type!r}')
+
+
+class FieldSchema:
+    """The writable fields of one table, compiled to {name: (coercer, nullable)}."""
+
+    def __init__(self, table, field_names):
+        self.fields = {}
+        for name in field_names:
+            column = table.c[name]
+            self.fields[name] = (coercer_for(column), column.nullable)
+
+    def validate(self, payload):
+        """
+        Coerces the submitted fields of `payload` (a dict).
+        Returns (values, errors): values maps field -> Python value; errors maps field -> message.
+        Empty strings and null clear a nullable field.
+        """
+        values, errors = {}, {}
+        for name, raw in payload.items():
+            field = self.fields.get(name)
+            if field is None:
+                errors[name] = 'ไม่สามารถแก้ไขฟิลด์นี้ได้'
+                continue
+            coerce, nullable = field
+            if raw is None or (isinstance(raw, str) and not raw.strip()):
+                if nullable:
+                    values[name] = None
+                else:
+                    errors[name] = 'ต้องระบุค่า'
+                continue
+            try:
+                values[name] = coerce(raw)
+            except FieldError as e:
+                errors[name] = str(e)
+        return values, errors
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Hi/lo id allocation backed by a small sequence table.
+
+Each process reserves a block of consecutive ids with one short UPDATE on the
+sequence row and then hands them out from memory, so inserts never scan the
+target table and concurrent workers can never receive the same number. Ids left
+in a block when a worker stops are simply never used, which leaves small gaps.
+"""
+import threading
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+
+class BlockIdAllocator:
+    """Hands out integer ids for one named sequence (e.g. 'customer_id')."""
+
+    def __init__(self, sequence_table, name, block_size=20, initial_value=None):
+        self.table = sequence_table
+        self.name = name
+        # An int, or a callable returning one, read each time a block is reserved (so it can come from config set later).
+        self.block_size = block_size
+        # Callable(connection) -> first id, used once when the sequence row does not exist yet.
+        self.initial_value = initial_value
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+
+    def next_id(self, engine):
+        """Returns the next id, reserving a new block from the database when the current one runs out."""
+        with self._lock:
+            if self._next >= self._limit:
+                block = self.reserve(engine, self.block_size() if callable(self.block_size) else self.block_size)
+                self._next, self._limit = block.start, block.stop
+            value = self._next
+            self._next += 1
+            return value
+
+    def reserve(self, engine, count):
+        """Atomically reserves `count` consecutive ids in their own transaction and returns them as a range."""
+        t = self.table
+        for _ in range(2):
+            with engine.begin() as conn:
+                # The UPDATE row lock serializes concurrent reservations until this transaction commits.
+                result = conn.execute(update(t).where(t.c.name == self.name).values(next_value=t.c.next_value + count))
+                if result.rowcount:
+                    stop = conn.execute(select(t.c.next_value).where(t.c.name == self.name)).scalar_one()
+                    return range(stop - count, stop)
+            self._create_sequence(engine)
+        raise RuntimeError(f"Could not reserve ids from sequence '{self.name}'")
+
+    def advance_past(self, engine, value):
+        """Makes sure ids handed out from now on are greater than `value` (e.g. after importing explicit ids)."""
+        t = self.table
+        with engine.begin() as conn:
+            result = conn.execute(update(t).where(t.c.name == self.name, t.c.next_value <= value).values(next_value=value + 1))
+            exists = result.rowcount or conn.execute(select(t.c.name).where(t.c.name == self.name)).first() is not None
+        if not exists:
+            self._create_sequence(engine, minimum=value + 1)
+
+    def _create_sequence(self, engine, minimum=1):
+        """Inserts the sequence row on first use; losing the race to another worker is fine."""
+        try:
+            with engine.begin() as conn:
+                start = self.initial_value(conn) if self.initial_value else 1
+                conn.execute(insert(self.table).values(name=self.name, next_value=max(start, minimum)))
+        except IntegrityError:
+            pass
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Derived Cloudinary image URLs for galleries and thumbnails.
+
+Stored URLs point at the uploaded original (up to 1000x1000). Cloudinary serves
+resized / re-encoded variants when a transformation is placed right after the
+'/upload/' segment, so a list view can load a ~200px thumbnail and the lightbox
+an auto-format, auto-quality copy, without storing anything extra.
+
+f_auto picks WebP/AVIF where the browser supports it; q_auto picks the lowest
+quality that still looks the same. URLs that are not Cloudinary uploads are
+returned unchanged, so callers can pass any stored value through.
+"""
+
+# Named transformations; thumbnails are 2x their ~100px CSS size for high-DPI phone screens.
+IMAGE_VARIANTS = {
+    'thumb': 'c_fill,g_auto,w_200,h_200,f_auto,q_auto',
+    'medium': 'c_limit,w_600,h_600,f_auto,q_auto',
+    'full': 'f_auto,q_auto',
+}
+SRCSET_WIDTHS = (200, 400, 800)
+
+UPLOAD_SEGMENT = '/upload/'
+
+
+def transformed_url(url, transformation):
+    """`url` with `transformation` inserted after '/upload/', or `url` itself if it is not a Cloudinary upload URL."""
+    if not url or UPLOAD_SEGMENT not in url:
+        return url
+    base, rest = url.split(UPLOAD_SEGMENT, 1)
+    return f'{base}{UPLOAD_SEGMENT}{transformation}/{rest}'
+
+
+def variant_url(url, variant='thumb'):
+    """URL of one of the named IMAGE_VARIANTS of a stored image."""
+    return transformed_url(url, IMAGE_VARIANTS[variant])
+
+
+def srcset(url, widths=SRCSET_WIDTHS):
+    """An <img srcset> value offering `widths`; empty for non-Cloudinary URLs, which have no variants."""
+    if not url or UPLOAD_SEGMENT not in url:
+        return ''
+    return ', '.join(f'{transformed_url(url, f"c_limit,w_{width},f_auto,q_auto")} {width}w' for width in widths)
+
+
+def image_variants(url):
+    """Every variant of one stored image, as returned by the JSON APIs ('url' is the stored original)."""
+    variants = {name: variant_url(url, name) for name in IMAGE_VARIANTS}
+    variants.update(url=url, srcset=srcset(url))
+    return variants
+
+
+def register_template_filters(app):
+    """{{ url | image_variant('thumb') }} and {{ url | image_srcset }} in templates."""
+    app.add_template_filter(variant_url, 'image_variant')
+    app.add_template_filter(srcset, 'image_srcset')
+    app.jinja_env.globals['IMAGE_VARIANTS'] = IMAGE_VARIANTS
@@ -6,7 +6,8 @@ import sys
 import os
 from dotenv import load_dotenv
 # NEW: Import the Flask app and db object to create tables
-from app import User, app, db, CustomerRecord, generate_password_hash
+from app import User, app, db, generate_password_hash, customer_id_allocator
+from search_backends import digits_only
 
 load_dotenv() # โหลดค่าจากไฟล์ .env
 
@@ -52,25 +53,37 @@ def process_dataframe_and_import(df, table_name, column_map, source_name):
         df = df[valid_columns]
 
         if table_name == 'customer_records' and 'customer_id' in df.columns:
-            # --- REVISED: Generate numeric IDs for missing values, without "PID-" prefix ---
+            # --- REVISED: Take numeric IDs for missing values from the same block allocator as the web app ---
+            def is_missing(value):
+                # Check if the value is missing (NaN, None, or empty string)
+                return pd.isna(value) or str(value).strip() == ''
+
+            missing_count = int(df['customer_id'].apply(is_missing).sum())
             with app.app_context():
-                # This query finds the highest numeric ID by casting the column to an integer.
-                last_id_scalar = db.session.query(db.func.max(db.func.cast(CustomerRecord.customer_id, db.Integer))).scalar()
-                
-                id_counter = (last_id_scalar or 1000) + 1
-
-                def generate_id(value):
-                    nonlocal id_counter
-                    # Check if the value is missing (NaN, None, or empty string)
-                    if pd.isna(value) or str(value).strip() == '':
-                        new_id = f"{id_counter}"
-                        id_counter += 1
-                        return new_id
-                    # If the value exists, keep it as is.
-                    return str(value).strip()
+                # Reserve one block covering every missing ID, so running workers can never hand out the same numbers.
+                new_ids = iter(customer_id_allocator.reserve(db.engine, missing_count) if missing_count else ())
+
+            def generate_id(value):
+                if is_missing(value):
+                    return f"{next(new_ids)}"
+                # If the value exists, keep it as is.
+                return str(value).strip()
 
             df['customer_id'] = df['customer_id'].apply(generate_id)
 
+            # Explicit IDs from the file must never be handed out again by the allocator.
+            numeric_ids = pd.to_numeric(df['customer_id'], errors='coerce').dropna()
+            if not numeric_ids.empty:
+                with app.app_context():
+                    customer_id_allocator.advance_past(db.engine, int(numeric_ids.max()))
+
+        # NEW: df.to_sql bypasses the ORM, so fill the digits-only lookup columns here.
+        if table_name == 'customer_records':
+            if 'mobile_phone' in df.columns:
+                df['mobile_phone_digits'] = df['mobile_phone'].apply(lambda v: digits_only(v) if pd.notna(v) else None)
+            if 'id_card_number' in df.columns:
+                df['id_card_digits'] = df['id_card_number'].apply(lambda v: digits_only(v) if pd.notna(v) else None)
+
         # แปลงชนิดข้อมูลและจัดการค่าว่าง
         for col in df.columns:
             if 'amount' in col or 'balance' in col or 'limit' in col or 'interest' in col or 'fee' in col:
@@ -119,6 +132,7 @@ def process_dataframe_and_import(df, table_name, column_map, source_name):
 # ==============================================================================
 
 # --- 1. สำหรับ customer_records ---
+# 'Image URLs' / 'รูปถ่ายสัญญา' ลงคอลัมน์เดิม (legacy) -> รัน 'flask backfill-customer-images' หลังนำเข้า เพื่อย้ายไปตาราง customer_images
 customer_records_map = {
     'Timestamp': 'timestamp', 'Customer ID': 'customer_id', 'ชื่อ': 'first_name', 'นามสกุล': 'last_name',
     'เลขบัตรประชาชน': 'id_card_number', 'เบอร์มือถือ': 'mobile_phone', 'กลุ่มลูกค้าหลัก': 'main_customer_group',
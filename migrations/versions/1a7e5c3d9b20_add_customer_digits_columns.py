@@ -0,0 +1,64 @@
+"""add the digits-only phone / ID card lookup columns to customer_records and fill them
+
+Revision ID: 1a7e5c3d9b20
+Revises:
+Create Date: 2026-10-17 16:00:00.000000
+
+Databases created from the original models have neither column; ones created
+with db.create_all() later already do, so each step only runs when needed.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a7e5c3d9b20'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+DIGITS_COLUMNS = {'mobile_phone_digits': 'mobile_phone', 'id_card_digits': 'id_card_number'}
+BATCH_SIZE = 5000
+
+
+def _digits_only(value):
+    # Same rule as search_backends.digits_only, copied so the migration does not depend on app code
+    if value is None:
+        return None
+    digits = ''.join(ch for ch in str(value) if ch.isdigit())
+    return digits or None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    existing_columns = {column['name'] for column in inspector.get_columns('customer_records')}
+    existing_indexes = {index['name'] for index in inspector.get_indexes('customer_records')}
+    for column_name in DIGITS_COLUMNS:
+        if column_name not in existing_columns:
+            op.add_column('customer_records', sa.Column(column_name, sa.String(length=100), nullable=True))
+        if f'ix_customer_records_{column_name}' not in existing_indexes:
+            op.create_index(f'ix_customer_records_{column_name}', 'customer_records', [column_name])
+
+    records = sa.table('customer_records', sa.column('id', sa.Integer), sa.column('mobile_phone', sa.String),
+                       sa.column('id_card_number', sa.String), sa.column('mobile_phone_digits', sa.String),
+                       sa.column('id_card_digits', sa.String))
+    update = records.update().where(records.c.id == sa.bindparam('record_id')).values(
+        mobile_phone_digits=sa.bindparam('phone_digits'), id_card_digits=sa.bindparam('card_digits'))
+    # Walk the table in id order, one batch at a time.
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select(records.c.id, records.c.mobile_phone, records.c.id_card_number)
+                            .where(records.c.id > last_id).order_by(records.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        bind.execute(update, [{'record_id': record_id, 'phone_digits': _digits_only(phone), 'card_digits': _digits_only(card)}
+                              for record_id, phone, card in rows])
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    for column_name in DIGITS_COLUMNS:
+        op.drop_index(f'ix_customer_records_{column_name}', table_name='customer_records')
+        op.drop_column('customer_records', column_name)
@@ -0,0 +1,33 @@
+"""add the id_sequences table used by BlockIdAllocator
+
+Revision ID: 2b8f6d4e0c31
+Revises: 1a7e5c3d9b20
+Create Date: 2026-10-17 16:10:00.000000
+
+No backfill: the 'customer_id' row is created on first use, seeded from the
+highest existing numeric customer_id.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8f6d4e0c31'
+down_revision = '1a7e5c3d9b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'id_sequences' not in inspector.get_table_names():
+        op.create_table(
+            'id_sequences',
+            sa.Column('name', sa.String(length=50), nullable=False),
+            sa.Column('next_value', sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint('name'),
+        )
+
+
+def downgrade():
+    op.drop_table('id_sequences')
@@ -0,0 +1,54 @@
+"""add composite indexes for the hot lookup columns
+
+Revision ID: 3f9c2a7d1b64
+Revises: 6d0b8f6a2e53
+Create Date: 2026-10-17 17:40:00.000000
+
+Existing databases were created with db.create_all(), and new ones get these
+indexes from the models, so each index is only created when it is missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d1b64'
+down_revision = '6d0b8f6a2e53'
+branch_labels = None
+depends_on = None
+
+
+# (table, index name, columns), matched to the queries that filter / sort on them
+INDEXES = [
+    ('customer_records', 'ix_customer_records_timestamp_id', ['timestamp', 'id']),
+    ('customer_records', 'ix_customer_records_status_timestamp', ['status', 'timestamp']),
+    ('approvals', 'ix_approvals_customer_id', ['customer_id']),
+    ('approvals', 'ix_approvals_approval_date', ['approval_date']),
+    ('all_pid_jobs', 'ix_all_pid_jobs_customer_date_time', ['customer_id', 'transaction_date', 'transaction_time']),
+    ('all_pid_jobs', 'ix_all_pid_jobs_date_company_time', ['transaction_date', 'company_name', 'transaction_time']),
+    ('contract_documents', 'ix_contract_documents_customer_uploaded', ['customer_id', 'upload_timestamp']),
+    ('bad_debt_records', 'ix_bad_debt_records_timestamp', ['timestamp']),
+    ('pull_plug_records', 'ix_pull_plug_records_timestamp', ['timestamp']),
+    ('return_principal_records', 'ix_return_principal_records_timestamp', ['timestamp']),
+    ('login_history', 'ix_login_history_login_timestamp', ['login_timestamp']),
+]
+
+
+def _existing_indexes(inspector, table):
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    for table, name, columns in INDEXES:
+        if table in tables and name not in _existing_indexes(inspector, table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    for table, name, columns in reversed(INDEXES):
+        if table in tables and name in _existing_indexes(inspector, table):
+            op.drop_index(name, table_name=table)
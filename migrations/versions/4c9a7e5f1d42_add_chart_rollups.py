@@ -0,0 +1,81 @@
+"""add the dashboard chart rollup tables and fill them from customer_records
+
+Revision ID: 4c9a7e5f1d42
+Revises: 2b8f6d4e0c31
+Create Date: 2026-10-17 16:20:00.000000
+
+The fill is the same GROUP BY as rebuild_chart_rollups() in app.py (labels cut
+to the key column lengths, '' for unset values), run as INSERT ... SELECT.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c9a7e5f1d42'
+down_revision = '2b8f6d4e0c31'
+branch_labels = None
+depends_on = None
+
+
+def _label(column, length):
+    return sa.func.substr(sa.func.coalesce(column, ''), 1, length)
+
+
+def upgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    created = []
+    if 'customer_monthly_rollup' not in tables:
+        op.create_table(
+            'customer_monthly_rollup',
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('month', sa.Integer(), nullable=False),
+            sa.Column('main_customer_group', sa.String(length=255), nullable=False),
+            sa.Column('customer_count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('year', 'month', 'main_customer_group'),
+        )
+        created.append('customer_monthly_rollup')
+    if 'customer_channel_province_rollup' not in tables:
+        op.create_table(
+            'customer_channel_province_rollup',
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('month', sa.Integer(), nullable=False),
+            sa.Column('province', sa.String(length=150), nullable=False),
+            sa.Column('application_channel', sa.String(length=150), nullable=False),
+            sa.Column('main_customer_group', sa.String(length=150), nullable=False),
+            sa.Column('customer_count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('year', 'month', 'province', 'application_channel', 'main_customer_group'),
+        )
+        created.append('customer_channel_province_rollup')
+
+    records = sa.table('customer_records', sa.column('id', sa.Integer), sa.column('application_date', sa.Date),
+                       sa.column('main_customer_group', sa.String), sa.column('province', sa.String),
+                       sa.column('application_channel', sa.String))
+    year = sa.extract('year', records.c.application_date)
+    month = sa.extract('month', records.c.application_date)
+    dated = records.c.application_date.isnot(None)
+
+    # Only tables created here are filled; existing ones are already maintained by the app.
+    if 'customer_monthly_rollup' in created:
+        group = _label(records.c.main_customer_group, 255)
+        monthly = sa.table('customer_monthly_rollup', sa.column('year'), sa.column('month'),
+                           sa.column('main_customer_group'), sa.column('customer_count'))
+        op.execute(monthly.insert().from_select(
+            ['year', 'month', 'main_customer_group', 'customer_count'],
+            sa.select(year, month, group, sa.func.count(records.c.id)).where(dated).group_by(year, month, group)))
+    if 'customer_channel_province_rollup' in created:
+        province = _label(records.c.province, 150)
+        channel = _label(records.c.application_channel, 150)
+        group = _label(records.c.main_customer_group, 150)
+        channel_province = sa.table('customer_channel_province_rollup', sa.column('year'), sa.column('month'),
+                                    sa.column('province'), sa.column('application_channel'),
+                                    sa.column('main_customer_group'), sa.column('customer_count'))
+        op.execute(channel_province.insert().from_select(
+            ['year', 'month', 'province', 'application_channel', 'main_customer_group', 'customer_count'],
+            sa.select(year, month, province, channel, group, sa.func.count(records.c.id))
+            .where(dated).group_by(year, month, province, channel, group)))
+
+
+def downgrade():
+    op.drop_table('customer_channel_province_rollup')
+    op.drop_table('customer_monthly_rollup')
@@ -0,0 +1,42 @@
+"""add the background_tasks table used by task_queue.TaskQueue
+
+Revision ID: 5a9f3b8c6e12
+Revises: c4d7e2f91a35
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9f3b8c6e12'
+down_revision = 'c4d7e2f91a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'background_tasks' in inspector.get_table_names():
+        return
+    op.create_table(
+        'background_tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_type', sa.String(length=50), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('run_after', sa.DateTime(), nullable=False),
+        sa.Column('locked_by', sa.String(length=32), nullable=True),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_background_tasks_status_run_after', 'background_tasks', ['status', 'run_after'])
+
+
+def downgrade():
+    op.drop_index('ix_background_tasks_status_run_after', table_name='background_tasks')
+    op.drop_table('background_tasks')
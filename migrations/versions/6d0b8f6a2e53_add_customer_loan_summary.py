@@ -0,0 +1,94 @@
+"""add the customer_loan_summary projection and fill it from all_pid_jobs
+
+Revision ID: 6d0b8f6a2e53
+Revises: 4c9a7e5f1d42
+Create Date: 2026-10-17 16:30:00.000000
+
+Totals are summed from the wide table{1,2,3}_* columns; the latest transaction
+and latest interest are picked with the same ordering as compute_ledger_figures()
+in app.py (date, time, id, newest first); status comes from the approval.
+Customers written later without a row still get one on first use.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d0b8f6a2e53'
+down_revision = '4c9a7e5f1d42'
+branch_labels = None
+depends_on = None
+
+
+TABLE_NUMBERS = (1, 2, 3)
+# Summary total -> the all_pid_jobs actions it adds up (same as LEDGER_ACTION_TOTALS in app.py)
+TOTAL_ACTIONS = {
+    'total_given_out': ('opening_balance', 'net_opening'),
+    'total_returned': ('principal_returned',),
+    'total_lost': ('lost_amount',),
+}
+
+
+def upgrade():
+    if 'customer_loan_summary' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'customer_loan_summary',
+        sa.Column('customer_id', sa.String(length=50), nullable=False),
+        sa.Column('total_given_out', sa.DECIMAL(precision=15, scale=2), nullable=False),
+        sa.Column('total_returned', sa.DECIMAL(precision=15, scale=2), nullable=False),
+        sa.Column('total_lost', sa.DECIMAL(precision=15, scale=2), nullable=False),
+        sa.Column('last_interest', sa.DECIMAL(precision=15, scale=2), nullable=True),
+        sa.Column('last_interest_date', sa.Date(), nullable=True),
+        sa.Column('last_interest_time', sa.Time(), nullable=True),
+        sa.Column('last_transaction_date', sa.Date(), nullable=True),
+        sa.Column('last_transaction_time', sa.Time(), nullable=True),
+        sa.Column('status', sa.String(length=100), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('customer_id'),
+    )
+
+    amount_columns = [f'table{n}_{action}' for n in TABLE_NUMBERS for actions in TOTAL_ACTIONS.values() for action in actions]
+    jobs = sa.table('all_pid_jobs', sa.column('id', sa.Integer), sa.column('customer_id', sa.String),
+                    sa.column('transaction_date', sa.Date), sa.column('transaction_time', sa.Time),
+                    sa.column('interest', sa.Numeric), *(sa.column(name, sa.Numeric) for name in amount_columns))
+    approvals = sa.table('approvals', sa.column('customer_id', sa.String), sa.column('status', sa.String))
+
+    totals = sa.select(jobs.c.customer_id, *(
+        sa.func.coalesce(sa.func.sum(sum(sa.func.coalesce(jobs.c[f'table{n}_{action}'], 0)
+                                         for n in TABLE_NUMBERS for action in actions)), 0).label(total)
+        for total, actions in TOTAL_ACTIONS.items()
+    )).where(jobs.c.customer_id.isnot(None)).group_by(jobs.c.customer_id).subquery()
+
+    def ranked(*filters):
+        # Most recent row first, per customer
+        return sa.select(
+            jobs.c.customer_id, jobs.c.interest, jobs.c.transaction_date, jobs.c.transaction_time,
+            sa.func.row_number().over(
+                partition_by=jobs.c.customer_id,
+                order_by=(jobs.c.transaction_date.desc(), jobs.c.transaction_time.desc(), jobs.c.id.desc())
+            ).label('position')
+        ).where(*filters).subquery()
+
+    latest = ranked()
+    latest_interest = ranked(jobs.c.interest.isnot(None))
+    status = sa.select(sa.func.max(approvals.c.status)).where(approvals.c.customer_id == totals.c.customer_id).scalar_subquery()
+
+    summary = sa.table('customer_loan_summary', *(sa.column(name) for name in (
+        'customer_id', 'total_given_out', 'total_returned', 'total_lost', 'last_interest', 'last_interest_date',
+        'last_interest_time', 'last_transaction_date', 'last_transaction_time', 'status', 'updated_at')))
+    op.execute(summary.insert().from_select(
+        [c.name for c in summary.columns],
+        sa.select(
+            totals.c.customer_id, totals.c.total_given_out, totals.c.total_returned, totals.c.total_lost,
+            latest_interest.c.interest, latest_interest.c.transaction_date, latest_interest.c.transaction_time,
+            latest.c.transaction_date, latest.c.transaction_time, status, sa.func.current_timestamp(),
+        ).select_from(totals)
+        .join(latest, sa.and_(latest.c.customer_id == totals.c.customer_id, latest.c.position == 1))
+        .outerjoin(latest_interest, sa.and_(latest_interest.c.customer_id == totals.c.customer_id,
+                                            latest_interest.c.position == 1))
+    ))
+
+
+def downgrade():
+    op.drop_table('customer_loan_summary')
@@ -0,0 +1,60 @@
+"""add the long-format ledger_entries table and backfill it from all_pid_jobs
+
+Revision ID: 8b1e4c5a2d90
+Revises: 3f9c2a7d1b64
+Create Date: 2026-10-17 18:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e4c5a2d90'
+down_revision = '3f9c2a7d1b64'
+branch_labels = None
+depends_on = None
+
+
+LEDGER_ACTIONS = ('opening_balance', 'net_opening', 'principal_returned', 'lost_amount')
+LEDGER_TABLE_NUMBERS = (1, 2, 3)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'ledger_entries' not in inspector.get_table_names():
+        op.create_table(
+            'ledger_entries',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('job_id', sa.Integer(), nullable=False),
+            sa.Column('customer_id', sa.String(length=50), nullable=True),
+            sa.Column('transaction_date', sa.Date(), nullable=True),
+            sa.Column('transaction_time', sa.Time(), nullable=True),
+            sa.Column('company_name', sa.String(length=255), nullable=True),
+            sa.Column('table_no', sa.SmallInteger(), nullable=False),
+            sa.Column('action', sa.String(length=30), nullable=False),
+            sa.Column('amount', sa.DECIMAL(precision=15, scale=2), nullable=False),
+            sa.ForeignKeyConstraint(['job_id'], ['all_pid_jobs.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('job_id', 'table_no', 'action', name='uq_ledger_entries_job_table_action'),
+        )
+        op.create_index('ix_ledger_entries_customer_action', 'ledger_entries', ['customer_id', 'action'])
+        op.create_index('ix_ledger_entries_date_company_time', 'ledger_entries',
+                        ['transaction_date', 'company_name', 'transaction_time'])
+
+    # One set-based INSERT ... SELECT per wide column; rows already copied are skipped.
+    for table_no in LEDGER_TABLE_NUMBERS:
+        for action in LEDGER_ACTIONS:
+            column = f'table{table_no}_{action}'
+            op.execute(
+                "INSERT INTO ledger_entries (job_id, customer_id, transaction_date, transaction_time, company_name, table_no, action, amount) "
+                f"SELECT j.id, j.customer_id, j.transaction_date, j.transaction_time, j.company_name, {table_no}, '{action}', j.{column} "
+                f"FROM all_pid_jobs j WHERE j.{column} IS NOT NULL AND j.{column} <> 0 AND NOT EXISTS ("
+                f"SELECT 1 FROM ledger_entries e WHERE e.job_id = j.id AND e.table_no = {table_no} AND e.action = '{action}')"
+            )
+
+
+def downgrade():
+    op.drop_index('ix_ledger_entries_date_company_time', table_name='ledger_entries')
+    op.drop_index('ix_ledger_entries_customer_action', table_name='ledger_entries')
+    op.drop_table('ledger_entries')
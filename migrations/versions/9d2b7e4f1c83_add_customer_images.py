@@ -0,0 +1,90 @@
+"""add customer_images (one row per photo) and backfill it from the comma-joined URL columns
+
+Revision ID: 9d2b7e4f1c83
+Revises: 5a9f3b8c6e12
+Create Date: 2026-10-17 19:40:00.000000
+
+The old image_urls / contract_image_urls columns are left in place (no longer
+read by the app) but cleared once copied, so a photo deleted later is not
+brought back by 'flask backfill-customer-images', which picks up rows loaded
+into them afterwards. customer_images.url is TEXT, like the legacy columns, so
+every URL is copied intact before its source is cleared. The downgrade writes the
+URLs back before dropping the table.
+"""
+import os
+from datetime import UTC, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2b7e4f1c83'
+down_revision = '5a9f3b8c6e12'
+branch_labels = None
+depends_on = None
+
+
+def _public_id(url):
+    if '/upload/' not in url:
+        return None
+    return os.path.splitext('/'.join(url.split('/')[-2:]))[0]
+
+
+def _backfill(bind, images, owner_table, url_column, owner_column):
+    rows = []
+    now = datetime.now(UTC).replace(tzinfo=None)
+    for owner_id, value in bind.execute(sa.text(
+            f"SELECT id, {url_column} FROM {owner_table} WHERE {url_column} IS NOT NULL AND {url_column} <> ''")):
+        urls = list(dict.fromkeys(url.strip() for url in value.split(',') if url.strip()))
+        rows.extend({owner_column: owner_id, 'url': url, 'public_id': _public_id(url), 'position': position,
+                     'created_at': now} for position, url in enumerate(urls))
+    for start in range(0, len(rows), 1000):
+        bind.execute(images.insert(), rows[start:start + 1000])
+    # Same transaction as the copy: the legacy value is never left behind to be backfilled twice
+    bind.execute(sa.text(f"UPDATE {owner_table} SET {url_column} = NULL WHERE {url_column} IS NOT NULL"))
+
+
+def _restore(bind, owner_table, url_column, owner_column):
+    urls = {}
+    for owner_id, url in bind.execute(sa.text(
+            f"SELECT {owner_column}, url FROM customer_images WHERE {owner_column} IS NOT NULL ORDER BY {owner_column}, position")):
+        urls.setdefault(owner_id, []).append(url)
+    update = sa.text(f"UPDATE {owner_table} SET {url_column} = :urls WHERE id = :owner_id")
+    params = [{'owner_id': owner_id, 'urls': ','.join(values)} for owner_id, values in urls.items()]
+    for start in range(0, len(params), 1000):
+        bind.execute(update, params[start:start + 1000])
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'customer_images' in sa.inspect(bind).get_table_names():
+        return
+    images = op.create_table(
+        'customer_images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('customer_record_id', sa.Integer(), nullable=True),
+        sa.Column('approval_id', sa.Integer(), nullable=True),
+        sa.Column('url', sa.Text(), nullable=False),
+        sa.Column('public_id', sa.String(length=255), nullable=True),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('bytes', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['customer_record_id'], ['customer_records.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['approval_id'], ['approvals.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_customer_images_customer_position', 'customer_images', ['customer_record_id', 'position'])
+    op.create_index('ix_customer_images_approval_position', 'customer_images', ['approval_id', 'position'])
+
+    _backfill(bind, images, 'customer_records', 'image_urls', 'customer_record_id')
+    _backfill(bind, images, 'approvals', 'contract_image_urls', 'approval_id')
+
+
+def downgrade():
+    bind = op.get_bind()
+    _restore(bind, 'customer_records', 'image_urls', 'customer_record_id')
+    _restore(bind, 'approvals', 'contract_image_urls', 'approval_id')
+    op.drop_index('ix_customer_images_approval_position', table_name='customer_images')
+    op.drop_index('ix_customer_images_customer_position', table_name='customer_images')
+    op.drop_table('customer_images')
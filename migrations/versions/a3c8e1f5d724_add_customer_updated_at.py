@@ -0,0 +1,33 @@
+"""add customer_records.updated_at, the change watermark of the search index
+
+Revision ID: a3c8e1f5d724
+Revises: e6a1c9d4b257
+Create Date: 2026-10-17 21:30:00.000000
+
+Each worker's n-gram index re-checks rows changed since its snapshot against
+the database, so edits made through other workers are never hidden by it.
+Existing rows stay NULL: any snapshot taken after this migration already
+holds them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c8e1f5d724'
+down_revision = 'e6a1c9d4b257'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'updated_at' not in {column['name'] for column in inspector.get_columns('customer_records')}:
+        op.add_column('customer_records', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    if 'ix_customer_records_updated_at' not in {index['name'] for index in inspector.get_indexes('customer_records')}:
+        op.create_index('ix_customer_records_updated_at', 'customer_records', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_customer_records_updated_at', table_name='customer_records')
+    op.drop_column('customer_records', 'updated_at')
@@ -0,0 +1,79 @@
+"""add customer_status_events and move the status notes out of customer_records.remarks
+
+Revision ID: e6a1c9d4b257
+Revises: 9d2b7e4f1c83
+Create Date: 2026-10-17 20:10:00.000000
+
+update_customer_status used to append "\n[สถานะ: <status>] <note>" to remarks.
+Each such entry becomes one event; its real time was never stored, so the
+record's timestamp is used and the actor is left empty. A note may span several
+lines, so it runs up to the next "\n[สถานะ: " marker (or the end of remarks);
+text typed into remarks after the last status note therefore stays with that
+note. The downgrade appends the notes back in the same format.
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a1c9d4b257'
+down_revision = '9d2b7e4f1c83'
+branch_labels = None
+depends_on = None
+
+
+STATUS_NOTE = re.compile(r'\n\[สถานะ: ([^\]\n]*)\] ?(.*?)(?=\n\[สถานะ: |\Z)', re.DOTALL)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'customer_status_events' in sa.inspect(bind).get_table_names():
+        return
+    op.create_table(
+        'customer_status_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('customer_record_id', sa.Integer(), nullable=False),
+        sa.Column('from_status', sa.String(length=100), nullable=True),
+        sa.Column('to_status', sa.String(length=100), nullable=True),
+        sa.Column('note', sa.Text(), nullable=True),
+        sa.Column('actor', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['customer_record_id'], ['customer_records.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_customer_status_events_customer_created', 'customer_status_events', ['customer_record_id', 'created_at'])
+
+    rows = bind.execute(sa.text(
+        "SELECT id, remarks, timestamp FROM customer_records WHERE remarks LIKE :marker"), {'marker': '%[สถานะ: %'}).all()
+    for record_id, remarks, timestamp in rows:
+        notes = STATUS_NOTE.findall(remarks)
+        if not notes:
+            continue
+        previous = None
+        for to_status, note in notes:
+            # The timestamp is passed through as the driver returned it (SQLite gives back a string).
+            bind.execute(sa.text(
+                "INSERT INTO customer_status_events (customer_record_id, from_status, to_status, note, created_at) "
+                "VALUES (:record_id, :from_status, :to_status, :note, COALESCE(:created_at, CURRENT_TIMESTAMP))"),
+                {'record_id': record_id, 'from_status': previous, 'to_status': to_status.strip(),
+                 'note': note.strip() or None, 'created_at': timestamp})
+            previous = to_status.strip()
+        cleaned = STATUS_NOTE.sub('', remarks).strip() or None
+        bind.execute(sa.text("UPDATE customer_records SET remarks = :remarks WHERE id = :id"), {'remarks': cleaned, 'id': record_id})
+
+
+def downgrade():
+    bind = op.get_bind()
+    notes = {}
+    for record_id, to_status, note in bind.execute(sa.text(
+            "SELECT customer_record_id, to_status, note FROM customer_status_events "
+            "WHERE note IS NOT NULL ORDER BY customer_record_id, created_at, id")):
+        notes.setdefault(record_id, []).append(f"\n[สถานะ: {to_status}] {note}")
+    for record_id, lines in notes.items():
+        remarks = bind.execute(sa.text("SELECT remarks FROM customer_records WHERE id = :id"), {'id': record_id}).scalar()
+        bind.execute(sa.text("UPDATE customer_records SET remarks = :remarks WHERE id = :id"),
+                     {'remarks': (remarks or '') + ''.join(lines), 'id': record_id})
+    op.drop_index('ix_customer_status_events_customer_created', table_name='customer_status_events')
+    op.drop_table('customer_status_events')
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregated COUNT(*) tables maintained alongside a fact table.
+
+A CountRollup holds one row per distinct key (e.g. year, month, group) with the
+number of fact rows carrying that key. track_rollups() hooks the session's
+before_flush so every ORM insert, delete, or change to a key column adjusts the
+affected counts in the same transaction as the write itself. Writes that bypass
+the ORM (bulk loads, manual SQL) are covered by rebuilding from the fact table.
+"""
+from sqlalchemy import delete, event, insert, inspect, update
+
+
+class CountRollup:
+    """One rollup table: key columns plus an integer `count_column`."""
+
+    def __init__(self, table, key_for, count_column='customer_count'):
+        self.table = table
+        # Callable(values: dict of the fact's fields) -> tuple of key column values, or None to skip the row.
+        self.key_for = key_for
+        self.count_column = count_column
+        self.key_columns = [c.name for c in table.primary_key.columns]
+
+    def apply(self, connection, deltas):
+        """Adds each non-zero delta to its key's count, creating missing rows."""
+        for key, delta in deltas.items():
+            if delta:
+                self._upsert(connection, dict(zip(self.key_columns, key)), delta)
+
+    def _upsert(self, connection, key_values, delta):
+        t = self.table
+        count = t.c[self.count_column]
+        dialect = connection.dialect.name
+        # Dialect modules are imported here, on first use, so only the one in use is ever loaded.
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(t).values(**key_values, **{self.count_column: delta})
+            connection.execute(stmt.on_duplicate_key_update({self.count_column: count + delta}))
+        elif dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            stmt = dialect_insert(t).values(**key_values, **{self.count_column: delta})
+            connection.execute(stmt.on_conflict_do_update(index_elements=self.key_columns, set_={self.count_column: count + delta}))
+        else:
+            key_filter = [t.c[name] == value for name, value in key_values.items()]
+            if not connection.execute(update(t).where(*key_filter).values({self.count_column: count + delta})).rowcount:
+                connection.execute(insert(t).values(**key_values, **{self.count_column: delta}))
+
+    def rebuild(self, connection, source_select):
+        """Replaces the table's contents with `source_select` (key columns then count, grouped by key)."""
+        connection.execute(delete(self.table))
+        connection.execute(insert(self.table).from_select(self.key_columns + [self.count_column], source_select))
+
+
+def track_rollups(session_class, model, fields, rollups):
+    """Keeps `rollups` in step with ORM writes to `model`, inside the flushing transaction."""
+
+    def old_values(state):
+        values = {}
+        for name in fields:
+            history = state.attrs[name].history
+            values[name] = history.deleted[0] if history.deleted else state.attrs[name].value
+        return values
+
+    # Make plain attribute sets record the value they replace, even when it was not loaded yet.
+    for name in fields:
+        event.listen(getattr(model, name), 'set', lambda *args: None, active_history=True)
+
+    def new_values(obj):
+        return {name: getattr(obj, name) for name in fields}
+
+    @event.listens_for(session_class, 'before_flush')
+    def _update_rollups(session, flush_context, instances):
+        deltas = [{} for _ in rollups]
+
+        def add(values, delta):
+            for rollup, rollup_deltas in zip(rollups, deltas):
+                key = rollup.key_for(values)
+                if key is not None:
+                    rollup_deltas[key] = rollup_deltas.get(key, 0) + delta
+
+        for obj in session.new:
+            if isinstance(obj, model):
+                add(new_values(obj), 1)
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                add(old_values(inspect(obj)), -1)
+        for obj in session.dirty:
+            if isinstance(obj, model) and obj not in session.deleted:
+                state = inspect(obj)
+                if any(state.attrs[name].history.has_changes() for name in fields):
+                    add(old_values(state), -1)
+                    add(new_values(obj), 1)
+
+        if any(deltas):
+            connection = session.connection()
+            for rollup, rollup_deltas in zip(rollups, deltas):
+                rollup.apply(connection, rollup_deltas)
+
+    return _update_rollups
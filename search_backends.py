@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Full-text search engines for customer keyword search.
+
+Each backend narrows a CustomerRecord query to the rows matching a keyword and
+returns the ORDER BY clauses that rank them, so both the result page and the
+pagination COUNT(*) are answered by the engine instead of a table scan:
+
+- MySQLFulltextBackend: MATCH ... AGAINST over ix_customer_records_fulltext
+  (declared WITH PARSER ngram so Thai text without spaces is tokenized).
+- SQLiteFTS5Backend: an external-content FTS5 table using the trigram tokenizer,
+  kept in sync with triggers. Used for tests and local runs.
+- DigitsSearchBackend: numeric keywords (phone, ID card, customer ID) become an
+  indexed prefix lookup on digits-only shadow columns.
+- LikeSearchBackend: the original ILIKE predicates; the fallback everywhere else.
+"""
+import time
+
+from sqlalchemy import DDL, and_, event, or_, select, table, column, literal_column, text
+from sqlalchemy.dialects.mysql import match
+
+
+def digits_only(value):
+    """Strips a free-form phone or ID card value ('081-111-1111', '-') down to its digits, or None."""
+    if value is None:
+        return None
+    digits = ''.join(ch for ch in str(value) if ch.isdigit())
+    return digits or None
+
+
+def looks_like_identifier(keyword):
+    """True for keywords that may be part of a customer ID, phone or ID card number ('PID-10', 'A12', 'PID')."""
+    return keyword.isascii() or any(ch.isdigit() for ch in keyword)
+
+
+class DigitsSearchBackend:
+    """Prefix match on digits-only columns, written as a B-tree range scan."""
+
+    name = 'digits'
+
+    def __init__(self, model, columns):
+        self.model = model
+        self.columns = columns
+
+    def is_available(self, session):
+        return True
+
+    def supports(self, keyword):
+        """True for keywords such as '081-111-1111' or '1 2345 67890 12 3'."""
+        return keyword.replace('-', '').replace(' ', '').isdigit()
+
+    def apply(self, query, keyword):
+        # ':' sorts right after '9', so [digits, digits + ':') holds exactly the values starting with digits.
+        # Unlike LIKE 'digits%', this range can use the index on every dialect.
+        lower = digits_only(keyword)
+        upper = lower + ':'
+        search_filter = or_(*[
+            and_(getattr(self.model, name) >= lower, getattr(self.model, name) < upper)
+            for name in self.columns
+        ])
+        return query.filter(search_filter), [self.model.timestamp.desc()]
+
+
+class LikeSearchBackend:
+    """ILIKE '%keyword%' over every searchable column."""
+
+    name = 'like'
+
+    def __init__(self, model, columns, candidates=None):
+        self.model = model
+        self.columns = columns
+        # Optional callable returning (candidate ids, recheck filter) or None to narrow the scan.
+        # Rows matching the recheck filter (ones the candidate source may not know about yet)
+        # are scanned as well, so a stale candidate set never hides a match.
+        self.candidates = candidates
+
+    def is_available(self, session):
+        return True
+
+    def supports(self, keyword):
+        return True
+
+    def apply(self, query, keyword):
+        like_term = f"%{keyword}%"
+        search_filter = or_(*[getattr(self.model, name).ilike(like_term) for name in self.columns])
+        narrowing = self.candidates(keyword) if self.candidates else None
+        if narrowing is not None:
+            candidate_ids, recheck = narrowing
+            query = query.filter(or_(self.model.id.in_(sorted(candidate_ids)), recheck))
+        return query.filter(search_filter), [self.model.timestamp.desc()]
+
+
+class MySQLFulltextBackend:
+    """MATCH ... AGAINST in boolean mode; the quoted keyword is a phrase of ngram tokens."""
+
+    name = 'mysql_fulltext'
+    # Matches the server default ngram_token_size.
+    min_keyword_length = 2
+    # Seconds between checks that the FULLTEXT index exists (it is created by `flask setup-fulltext`).
+    index_check_interval = 60
+
+    def __init__(self, model, columns, index_name):
+        self.model = model
+        self.columns = columns
+        self.index_name = index_name
+        self._index_exists = False
+        self._index_checked_at = None
+
+    def is_available(self, session):
+        """True on MySQL once the FULLTEXT index exists; MATCH fails without it, so LIKE is used until then."""
+        if session.get_bind().dialect.name != 'mysql':
+            return False
+        now = time.monotonic()
+        if self._index_checked_at is None or now - self._index_checked_at > self.index_check_interval:
+            self._index_exists = session.execute(
+                text("SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                     "AND table_name = :table AND index_name = :index LIMIT 1"),
+                {'table': self.model.__tablename__, 'index': self.index_name}
+            ).first() is not None
+            self._index_checked_at = now
+        return self._index_exists
+
+    def supports(self, keyword):
+        return len(keyword) >= self.min_keyword_length
+
+    def apply(self, query, keyword):
+        phrase = '"' + keyword.replace('"', ' ') + '"'
+        relevance = match(*[getattr(self.model, name) for name in self.columns], against=phrase).in_boolean_mode()
+        return query.filter(relevance > 0), [relevance.desc(), self.model.timestamp.desc()]
+
+
+class SQLiteFTS5Backend:
+    """FTS5 trigram index; keywords shorter than one trigram cannot be matched and fall back."""
+
+    name = 'sqlite_fts5'
+    min_keyword_length = 3
+
+    def __init__(self, model, columns, fts_table_name):
+        self.model = model
+        self.columns = columns
+        self.fts_table_name = fts_table_name
+        self.fts_table = table(fts_table_name, column('rowid'), column('rank'))
+
+    def is_available(self, session):
+        if session.get_bind().dialect.name != 'sqlite':
+            return False
+        exists = session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': self.fts_table_name}
+        ).first()
+        return exists is not None
+
+    def supports(self, keyword):
+        return len(keyword) >= self.min_keyword_length
+
+    def apply(self, query, keyword):
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        hits = select(self.fts_table.c.rowid, self.fts_table.c.rank).where(
+            literal_column(self.fts_table_name).op('MATCH')(phrase)
+        ).subquery()
+        query = query.join(hits, hits.c.rowid == self.model.id)
+        # FTS5 rank is bm25(), where lower is more relevant.
+        return query, [hits.c.rank.asc(), self.model.timestamp.desc()]
+
+    def ddl_statements(self, content_table):
+        """CREATE statements for the FTS5 table and the triggers that keep it in sync."""
+        cols = ', '.join(self.columns)
+        new_cols = ', '.join(f'new.{name}' for name in self.columns)
+        old_cols = ', '.join(f'old.{name}' for name in self.columns)
+        fts = self.fts_table_name
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{content_table}', content_rowid='id', tokenize='trigram')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {content_table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {content_table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {content_table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END",
+        ]
+
+    def rebuild_statement(self):
+        return f"INSERT INTO {self.fts_table_name}({self.fts_table_name}) VALUES ('rebuild')"
+
+    def register_ddl(self, sa_table):
+        """Creates the FTS table alongside sa_table whenever metadata.create_all() runs on SQLite."""
+        for statement in self.ddl_statements(sa_table.name):
+            event.listen(sa_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+        event.listen(sa_table, 'before_drop', DDL(f"DROP TABLE IF EXISTS {self.fts_table_name}").execute_if(dialect='sqlite'))
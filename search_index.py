@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+In-process character n-gram inverted index for customer search.
+
+Thai text has no spaces between words, so instead of tokenizing on words we index
+every overlapping character n-gram of each field. A keyword is resolved by
+intersecting the posting lists of its own n-grams, which yields a small *candidate*
+set of record ids. Candidates are a superset of the real matches *as of the last
+read*; the caller is expected to confirm them (e.g. with the original LIKE filter
+restricted to those ids) and to also scan rows added or changed elsewhere since
+then, which this index cannot know about (see max_id).
+
+Because candidates are always confirmed, postings are append-only arrays: an
+update simply appends the record id under its new n-grams and a delete is
+recorded in a tombstone set. Stale entries only cost a few false positives and are
+dropped by the next rebuild().
+"""
+from array import array
+import time
+
+
+class NgramIndex:
+    """Maps character n-grams to the ids of the records that contain them."""
+
+    def __init__(self, n=2):
+        self.n = n
+        self._postings = {}
+        self._removed = set()
+        self.max_id = 0
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._postings)
+
+    def _grams(self, values):
+        """Returns the set of n-grams across all values, never spanning two fields."""
+        grams = set()
+        n = self.n
+        for value in values:
+            if value is None:
+                continue
+            text = str(value).casefold()
+            for i in range(len(text) - n + 1):
+                grams.add(text[i:i + n])
+        return grams
+
+    def add(self, doc_id, values):
+        """Indexes (or re-indexes) one record from its searchable field values."""
+        for gram in self._grams(values):
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('I')
+            posting.append(doc_id)
+        self._removed.discard(doc_id)
+
+    def extend(self, rows):
+        """
+        Indexes (doc_id, values) pairs read in id order from the database and advances
+        max_id, the watermark used to pick up rows inserted since the last read.
+        """
+        for doc_id, values in rows:
+            self.add(doc_id, values)
+            if doc_id > self.max_id:
+                self.max_id = doc_id
+
+    def remove(self, doc_id):
+        """Hides a deleted record from future candidate sets."""
+        self._removed.add(doc_id)
+
+    def rebuild(self, rows):
+        """
+        Replaces the whole index from an iterable of (doc_id, values) pairs.
+        The new postings are built off to the side and swapped in at the end,
+        so searches running meanwhile keep using the previous index.
+        """
+        fresh = NgramIndex(self.n)
+        fresh.extend(rows)
+        self._postings, self._removed, self.max_id = fresh._postings, set(), fresh.max_id
+        self.built_at = time.monotonic()
+
+    def candidates(self, keyword):
+        """
+        Returns the set of record ids that may contain `keyword`, or None when the
+        keyword is shorter than one n-gram and the index cannot narrow it down.
+        """
+        grams = self._grams([keyword])
+        if not grams:
+            return None
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result.intersection_update(posting)
+            if not result:
+                break
+        result.difference_update(self._removed)
+        return result
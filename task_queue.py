@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Durable background task queue backed by one database table.
+
+Requests enqueue a task inside their own transaction, so a task exists exactly
+when the write that asked for it was committed, and return without waiting on
+the slow side effect (e.g. a Cloudinary API call). Worker threads or a separate
+`flask run-task-worker` process claim due tasks with one conditional UPDATE,
+which is safe with any number of workers, and run the registered handler.
+
+A failed task is retried with exponential backoff; after `max_attempts` it is
+parked with status 'dead' (the dead-letter list) until someone retries it. A
+task whose worker died mid-run is claimed again once `lock_timeout` passes.
+"""
+import json
+import logging
+import random
+import threading
+import traceback
+import uuid
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import and_, delete, event, insert, or_, select, update
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DEAD = 'dead'
+
+
+def _utcnow():
+    # Stored naive (UTC) so comparisons behave the same on MySQL and SQLite.
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class TaskQueue:
+    """Enqueues, claims and runs tasks stored in `table` (see BackgroundTask in app.py for the columns)."""
+
+    def __init__(self, table, max_attempts=6, base_delay=30, max_delay=3600, lock_timeout=600):
+        self.table = table
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock_timeout = lock_timeout
+        self.handlers = {}
+        self._wake = threading.Event()
+
+    def task(self, task_type):
+        """Decorator registering `handler(payload)` for `task_type`; raising an exception means 'retry later'."""
+        def register(handler):
+            self.handlers[task_type] = handler
+            return handler
+        return register
+
+    def enqueue(self, session, task_type, payload, delay=0):
+        """Adds a task in the session's current transaction; it becomes visible to workers on commit."""
+        if task_type not in self.handlers:
+            raise ValueError(f"No handler registered for task type '{task_type}'")
+        now = _utcnow()
+        session.execute(insert(self.table).values(
+            task_type=task_type, payload=json.dumps(payload, ensure_ascii=False), status=PENDING,
+            attempts=0, run_after=now + timedelta(seconds=delay), created_at=now))
+        session.info['task_queue_wake'] = True
+
+    def watch(self, session_class):
+        """Wakes this process's worker as soon as a transaction that enqueued something commits."""
+        @event.listens_for(session_class, 'after_commit')
+        def _wake_worker(session):
+            if session.info.pop('task_queue_wake', False):
+                self._wake.set()
+
+        @event.listens_for(session_class, 'after_rollback')
+        def _forget_wake(session):
+            session.info.pop('task_queue_wake', None)
+
+    def backoff(self, attempts):
+        """Seconds to wait before attempt number `attempts + 1`, with jitter so retries do not bunch up."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def claim(self, engine, limit=20):
+        """Marks up to `limit` due tasks as running for this caller and returns them as row mappings."""
+        t = self.table
+        now = _utcnow()
+        claimable = or_(
+            and_(t.c.status == PENDING, t.c.run_after <= now),
+            and_(t.c.status == RUNNING, t.c.locked_at < now - timedelta(seconds=self.lock_timeout)),
+        )
+        token = uuid.uuid4().hex
+        with engine.begin() as conn:
+            ids = conn.execute(select(t.c.id).where(claimable).order_by(t.c.run_after, t.c.id).limit(limit)).scalars().all()
+            if not ids:
+                return []
+            # Re-checking the condition in the UPDATE makes a row go to exactly one of several racing workers.
+            conn.execute(update(t).where(t.c.id.in_(ids), claimable)
+                         .values(status=RUNNING, locked_by=token, locked_at=now, attempts=t.c.attempts + 1))
+            return conn.execute(select(t).where(t.c.locked_by == token, t.c.status == RUNNING)
+                                .order_by(t.c.run_after, t.c.id)).mappings().all()
+
+    def run_pending(self, engine, limit=20):
+        """Claims and runs one batch of due tasks; returns (succeeded, failed) counts."""
+        t = self.table
+        succeeded = failed = 0
+        for task in self.claim(engine, limit):
+            try:
+                handler = self.handlers[task['task_type']]
+                handler(json.loads(task['payload']))
+            except Exception:
+                failed += 1
+                error = traceback.format_exc(limit=5)
+                if task['attempts'] >= self.max_attempts:
+                    values = {'status': DEAD}
+                else:
+                    values = {'status': PENDING, 'run_after': _utcnow() + timedelta(seconds=self.backoff(task['attempts']))}
+                with engine.begin() as conn:
+                    conn.execute(update(t).where(t.c.id == task['id'], t.c.locked_by == task['locked_by'])
+                                 .values(last_error=error, locked_by=None, locked_at=None, **values))
+            else:
+                succeeded += 1
+                with engine.begin() as conn:
+                    conn.execute(delete(t).where(t.c.id == task['id'], t.c.locked_by == task['locked_by']))
+        return succeeded, failed
+
+    def run_forever(self, engine, poll_interval=5, limit=20, stop_event=None):
+        """
+        Worker loop: drains due tasks, then sleeps until woken by an enqueue or `poll_interval` passes.
+        Errors outside a handler (e.g. the database is unreachable while claiming) are logged and the
+        loop tries again after `poll_interval`, so the worker thread never dies.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self._wake.clear()
+            try:
+                succeeded, failed = self.run_pending(engine, limit)
+            except Exception:
+                logger.exception("Task worker failed to run pending tasks; retrying in %s s", poll_interval)
+                stop_event.wait(poll_interval)
+                continue
+            if succeeded + failed < limit:
+                self._wake.wait(poll_interval)
+
+    def start_thread(self, target, name='task-queue-worker'):
+        """Starts `target` (normally a wrapper around run_forever with an app context) as a daemon thread."""
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def dead_tasks(self, engine, limit=100):
+        """The dead-letter list, most recent first."""
+        t = self.table
+        with engine.connect() as conn:
+            return conn.execute(select(t).where(t.c.status == DEAD).order_by(t.c.id.desc()).limit(limit)).mappings().all()
+
+    def retry(self, engine, task_id):
+        """Puts a dead task back in the queue with a fresh attempt budget; returns False if it is not dead."""
+        t = self.table
+        with engine.begin() as conn:
+            result = conn.execute(update(t).where(t.c.id == task_id, t.c.status == DEAD)
+                                  .values(status=PENDING, attempts=0, run_after=_utcnow()))
+        if result.rowcount:
+            self._wake.set()
+        return bool(result.rowcount)
@@ -1,8 +1,10 @@
+import hashlib
 import json
-from datetime import date, time
+from datetime import date, time, datetime, timedelta, UTC
 import io
 from unittest.mock import patch
-from app import db, AllPidJob, Approval, User, BadDebtRecord, PullPlugRecord, ReturnPrincipalRecord, ContractDocument, CustomerRecord
+from sqlalchemy import text, event, func
+from app import db, AllPidJob, Approval, User, BadDebtRecord, PullPlugRecord, ReturnPrincipalRecord, ContractDocument, CustomerRecord, CustomerLoanSummary, LedgerEntry, IdempotencyKey, IDEMPOTENCY_PENDING_TIMEOUT, IDEMPOTENCY_UNKNOWN_OUTCOME
 
 def test_get_daily_jobs_api(logged_in_client, app):
     """
@@ -65,6 +67,41 @@ def test_get_daily_jobs_api(logged_in_client, app):
     data_no_jobs = json.loads(response_no_jobs.data)
     assert len(data_no_jobs) == 0
 
+def test_get_daily_jobs_range_api(logged_in_client, app):
+    """
+    GIVEN jobs spread over several days and companies
+    WHEN '/api/daily-jobs' is requested with a from/to range
+    THEN check that the rows stream in date order with per-company and per-table subtotals
+    """
+    with app.app_context():
+        db.session.add_all([
+            AllPidJob(transaction_date=date(2025, 8, 1), transaction_time=time(9, 0), company_name='STARLOAN', customer_id='C-601', table1_opening_balance=1000),
+            AllPidJob(transaction_date=date(2025, 8, 15), transaction_time=time(10, 0), company_name='GLORYCASH', customer_id='C-602', table2_principal_returned=300),
+            AllPidJob(transaction_date=date(2025, 8, 31), transaction_time=time(8, 0), company_name='STARLOAN', customer_id='C-603', table1_opening_balance=500, table3_lost_amount=50),
+            AllPidJob(transaction_date=date(2025, 9, 1), transaction_time=time(8, 0), company_name='STARLOAN', customer_id='C-604', table1_opening_balance=9999),
+        ])
+        db.session.commit()
+
+    # 1. Whole month, all companies
+    response = logged_in_client.get('/api/daily-jobs?from=2025-08-01&to=2025-08-31')
+    assert response.status_code == 200
+    data = json.loads(response.get_data(as_text=True))
+    assert [job['CustomerID'] for job in data['jobs']] == ['C-601', 'C-602', 'C-603']
+    assert data['count'] == 3
+    assert data['subtotals']['by_company']['STARLOAN']['opening_balance'] == 1500.0
+    assert data['subtotals']['by_table']['Table2']['principal_returned'] == 300.0
+    assert data['subtotals']['total']['lost_amount'] == 50.0
+
+    # 2. One company, totals only
+    data = json.loads(logged_in_client.get('/api/daily-jobs?from=2025-08-01&to=2025-08-31&company=GLORYCASH&totals_only=1').get_data(as_text=True))
+    assert data['jobs'] == [] and data['count'] == 0
+    assert list(data['subtotals']['by_company']) == ['GLORYCASH']
+
+    # 3. Invalid ranges
+    assert logged_in_client.get('/api/daily-jobs?from=2025-08-31&to=2025-08-01').status_code == 400
+    assert logged_in_client.get('/api/daily-jobs?from=2024-01-01&to=2025-08-01').status_code == 400
+    assert logged_in_client.get('/api/daily-jobs?from=2025-08-01').status_code == 400
+
 def test_get_customer_balance_api(logged_in_client, app):
     """
     GIVEN a Flask application configured for testing
@@ -100,6 +137,36 @@ def test_get_customer_balance_api(logged_in_client, app):
     data_no_trans = json.loads(response_no_trans.data)
     assert data_no_trans['total_transactions_value'] == 0
 
+def test_get_customer_balances_batch_api(logged_in_client, app):
+    """
+    GIVEN ledger rows for several customers
+    WHEN '/api/customer-balances' is called with a list of customer IDs
+    THEN check that every balance and latest interest comes back in one response
+    """
+    with app.app_context():
+        db.session.add_all([
+            AllPidJob(customer_id='C-301', transaction_date=date(2025, 1, 1), interest=10, table1_opening_balance=8000),
+            AllPidJob(customer_id='C-301', transaction_date=date(2025, 2, 1), interest=12, table1_principal_returned=3000),
+            AllPidJob(customer_id='C-301', transaction_date=date(2025, 3, 1), interest=None, table2_net_opening=1000),
+            AllPidJob(customer_id='C-302', transaction_date=date(2025, 1, 5), table3_opening_balance=4000),
+        ])
+        db.session.commit()
+
+    response = logged_in_client.post('/api/customer-balances', json={'customer_ids': ['C-301', 'C-302', 'C-999']})
+    assert response.status_code == 200
+    customers = json.loads(response.data)['customers']
+    # C-301: (8000 + 1000) - 3000; latest non-empty interest is February's
+    assert customers['C-301']['total_transactions_value'] == 6000.0
+    assert customers['C-301']['interest'] == 12.0
+    assert customers['C-302'] == {'total_given_out': 4000.0, 'total_returned': 0.0, 'outstanding_balance': 4000.0,
+                                  'interest': None, 'total_transactions_value': 4000.0}
+    assert customers['C-999']['total_transactions_value'] == 0
+
+    # The single-customer endpoints agree with the batch
+    assert json.loads(logged_in_client.get('/api/latest-interest/C-301').data)['interest'] == 12.0
+
+    assert logged_in_client.post('/api/customer-balances', json={'customer_ids': 'C-301'}).status_code == 400
+
 def test_save_approved_data_api(logged_in_client, app):
     """
     GIVEN a Flask application and an approved customer record
@@ -154,6 +221,235 @@ def test_save_approved_data_api(logged_in_client, app):
         assert new_jobs[1].company_name == 'GLORYCASH'
         assert new_jobs[1].table2_net_opening == 5000.00
 
+    # 7. A malformed amount or interest is rejected with 400 before anything is written
+    bad_amount = dict(payload, transactions=[dict(payload['transactions'][0], amount='15,000 baht')])
+    response = logged_in_client.post('/save-approved-data', json=bad_amount)
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'].startswith("Transaction 1: invalid amount '15,000 baht'")
+    assert logged_in_client.post('/save-approved-data', json=dict(payload, interest='abc')).status_code == 400
+    with app.app_context():
+        assert AllPidJob.query.filter_by(customer_id='C-202').count() == 2
+
+def test_customer_loan_summary_projection(logged_in_client, app, runner):
+    """
+    GIVEN a customer with ledger rows booked before the summary existed
+    WHEN new close-job transactions and a status change are saved
+    THEN check that the summary holds the full totals and the reconcile command finds no drift
+    """
+    with app.app_context():
+        db.session.add(Approval(customer_id='C-401', full_name='สมชาย ใจดี', status='รอปิดจ๊อบ'))
+        db.session.add(AllPidJob(customer_id='C-401', transaction_date=date(2025, 1, 10), interest=15, table1_opening_balance=10000))
+        db.session.commit()
+
+    # 1. The first write seeds the summary from the existing ledger, then adds the new rows
+    payload = {
+        "customer_id": "C-401", "fullname": "สมชาย ใจดี", "interest": "18", "transaction_date": "2025-02-01",
+        "transactions": [
+            {"company": "STARLOAN", "action_type": "เปิดยอด", "table_select": "โต๊ะ2", "amount": "4000"},
+            {"company": "STARLOAN", "action_type": "คืนต้น", "table_select": "โต๊ะ1", "amount": "2500"}
+        ]
+    }
+    assert logged_in_client.post('/save-approved-data', json=payload).status_code == 200
+    # A backdated transaction adds to the totals but does not replace the latest interest
+    payload.update(interest="9", transaction_date="2024-12-01",
+                   transactions=[{"company": "STARLOAN", "action_type": "เปิดยอด", "table_select": "โต๊ะ3", "amount": "1000"}])
+    assert logged_in_client.post('/save-approved-data', json=payload).status_code == 200
+    assert logged_in_client.post('/mark_as_bad_debt', json={'customer_id': 'C-401'}).status_code == 200
+
+    with app.app_context():
+        summary = db.session.get(CustomerLoanSummary, 'C-401')
+        assert float(summary.total_given_out) == 15000.0
+        assert float(summary.total_returned) == 2500.0
+        assert float(summary.last_interest) == 18.0
+        assert summary.last_transaction_date == date(2025, 2, 1)
+        assert summary.status == 'หนี้เสีย'
+
+    response = logged_in_client.post('/api/customer-balances', json={'customer_ids': ['C-401']})
+    assert json.loads(response.data)['customers']['C-401']['total_transactions_value'] == 12500.0
+
+    # 2. Reconcile agrees with the incrementally maintained row, and repairs drift
+    result = runner.invoke(args=['reconcile-loan-summary'])
+    assert '0 rows corrected' in result.output
+    with app.app_context():
+        db.session.get(CustomerLoanSummary, 'C-401').total_given_out = 1
+        db.session.commit()
+    result = runner.invoke(args=['reconcile-loan-summary'])
+    assert '1 rows corrected' in result.output
+    with app.app_context():
+        assert float(db.session.get(CustomerLoanSummary, 'C-401').total_given_out) == 15000.0
+
+def test_ledger_entries_dual_write_and_backfill(logged_in_client, app, runner):
+    """
+    GIVEN close-job transactions saved through the API and a job inserted with raw SQL
+    WHEN the long-format ledger is read
+    THEN check that each non-zero wide amount has exactly one ledger entry
+    """
+    payload = {
+        "customer_id": "C-501", "fullname": "ทดสอบ บัญชี", "interest": "10", "transaction_date": "2025-03-03",
+        "transactions": [
+            {"company": "STARLOAN", "action_type": "เปิดยอด", "table_select": "โต๊ะ1", "amount": "7000"},
+            {"company": "STARLOAN", "action_type": "คืนต้น", "table_select": "โต๊ะ3", "amount": "1500"}
+        ]
+    }
+    assert logged_in_client.post('/save-approved-data', json=payload).status_code == 200
+
+    with app.app_context():
+        entries = LedgerEntry.query.filter_by(customer_id='C-501').order_by(LedgerEntry.table_no).all()
+        assert [(e.table_no, e.action, float(e.amount)) for e in entries] == [(1, 'opening_balance', 7000.0), (3, 'principal_returned', 1500.0)]
+        assert all(e.job.customer_id == 'C-501' and e.transaction_date == date(2025, 3, 3) for e in entries)
+
+        # A row written outside the ORM is picked up by the backfill, once
+        db.session.execute(text("INSERT INTO all_pid_jobs (customer_id, table2_net_opening, table2_lost_amount) VALUES ('C-501', 2000, 0)"))
+        db.session.commit()
+    result = runner.invoke(args=['backfill-ledger'])
+    assert 'Backfilled 1 ledger entries' in result.output
+    assert 'Backfilled 0 ledger entries' in runner.invoke(args=['backfill-ledger']).output
+
+    # The loan summary then catches up from the ledger
+    runner.invoke(args=['reconcile-loan-summary'])
+    response = logged_in_client.post('/api/customer-balances', json={'customer_ids': ['C-501']})
+    assert json.loads(response.data)['customers']['C-501']['total_transactions_value'] == 7500.0
+
+def test_bulk_close_jobs_api(logged_in_client, app):
+    """
+    GIVEN several approvals waiting to be closed
+    WHEN '/api/close-jobs/bulk' is called with one valid and one invalid item per customer
+    THEN check that valid items are booked together and each invalid one is reported
+    """
+    with app.app_context():
+        db.session.add_all([
+            Approval(customer_id='C-701', full_name='ลูกค้า หนึ่ง', status='รอปิดจ๊อบ', approved_amount=10000),
+            Approval(customer_id='C-702', full_name='ลูกค้า สอง', status='รอปิดจ๊อบ', approved_amount=20000),
+            Approval(customer_id='C-703', full_name='ลูกค้า สาม', status='รอปิดจ๊อบ'),
+        ])
+        # An old job written outside the ORM: not in the ledger, so not in the summary the bulk close seeds
+        db.session.execute(AllPidJob.__table__.insert(), {'customer_id': 'C-701', 'transaction_date': date(2025, 1, 1), 'table1_opening_balance': 999})
+        db.session.commit()
+
+    payload = {'jobs': [
+        {'customer_id': 'C-701', 'fullname': 'ลูกค้า หนึ่ง', 'interest': '15', 'transaction_date': '2025-10-01',
+         'transactions': [{'company': 'STARLOAN', 'action_type': 'เปิดยอด', 'table_select': 'โต๊ะ1', 'amount': '8000'},
+                          {'company': 'STARLOAN', 'action_type': 'เปิดสุทธิ', 'table_select': 'โต๊ะ2', 'amount': '500'}]},
+        {'customer_id': 'C-702', 'approved_amount': 25000, 'transaction_date': '2025-10-01',
+         'transactions': [{'company': 'GLORYCASH', 'action_type': 'เปิดยอด', 'table_select': 'โต๊ะ3', 'amount': '25000'}]},
+        {'customer_id': 'C-703', 'transactions': [{'company': 'STARLOAN', 'action_type': 'เปิดยอด', 'table_select': 'โต๊ะ9', 'amount': '1'}]},
+    ]}
+    response = logged_in_client.post('/api/close-jobs/bulk', json=payload)
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result['booked'] == ['C-701', 'C-702'] and result['transactions'] == 3
+    assert result['errors'] == [{'index': 2, 'customer_id': 'C-703', 'error': "Transaction 1: unknown table 'โต๊ะ9'"}]
+
+    with app.app_context():
+        statuses = {a.customer_id: a.status for a in Approval.query.filter(Approval.customer_id.in_(['C-701', 'C-702', 'C-703']))}
+        assert statuses == {'C-701': 'ปิดจ๊อบแล้ว', 'C-702': 'ปิดจ๊อบแล้ว', 'C-703': 'รอปิดจ๊อบ'}
+        assert float(Approval.query.filter_by(customer_id='C-702').first().approved_amount) == 25000.0
+        assert AllPidJob.query.filter_by(customer_id='C-701').count() == 3
+        # Only the rows booked here are mirrored, so the ledger agrees with the summary
+        assert LedgerEntry.query.filter(LedgerEntry.customer_id.in_(['C-701', 'C-702'])).count() == 3
+        ledger_total = db.session.query(func.sum(LedgerEntry.amount)).filter_by(customer_id='C-701').scalar()
+        assert float(ledger_total) == float(db.session.get(CustomerLoanSummary, 'C-701').total_given_out) == 8500.0
+        assert float(db.session.get(CustomerLoanSummary, 'C-701').last_interest) == 15.0
+
+    balances = json.loads(logged_in_client.post('/api/customer-balances', json={'customer_ids': ['C-701', 'C-702']}).data)['customers']
+    assert balances['C-701']['total_transactions_value'] == 8500.0
+    assert balances['C-702']['total_transactions_value'] == 25000.0
+
+    # Nothing valid: rejected as a whole
+    response = logged_in_client.post('/api/close-jobs/bulk', json={'jobs': [{'customer_id': 'C-703', 'transactions': []}]})
+    assert response.status_code == 400
+
+    # Malformed transactions and non-finite or out-of-range numbers are per-item errors, not a 500
+    valid = {'company': 'STARLOAN', 'action_type': 'เปิดยอด', 'table_select': 'โต๊ะ1', 'amount': '1'}
+    response = logged_in_client.post('/api/close-jobs/bulk', data=json.dumps({'jobs': [
+        {'customer_id': 'C-703', 'transactions': ['not an object']},
+        {'customer_id': 'C-703', 'approved_amount': 'lots', 'transactions': [valid]},
+        {'customer_id': 'C-703', 'approved_amount': 10 ** 15, 'transactions': [valid]},
+        {'customer_id': 'C-703', 'interest': float('nan'), 'transactions': [valid]},
+        {'customer_id': 'C-703', 'transactions': [dict(valid, amount='Infinity')]},
+        {'customer_id': 'C-703', 'transactions': [dict(valid, amount='')]},
+    ]}), content_type='application/json')
+    assert response.status_code == 400
+    errors = [error['error'] for error in json.loads(response.data)['errors']]
+    assert errors[0] == 'Transaction 1: must be an object'
+    assert errors[1].startswith("Invalid approved_amount 'lots'") and errors[2].startswith('Invalid approved_amount')
+    assert errors[3].startswith('Invalid interest')
+    assert errors[4:] == ["Transaction 1: invalid amount 'Infinity'", "Transaction 1: invalid amount ''"]
+
+def test_idempotency_key_absorbs_double_submit(logged_in_client, app):
+    """
+    GIVEN an approval waiting to be closed
+    WHEN the same close-job and bad-debt requests are sent twice with the same Idempotency-Key
+    THEN check that each is booked once and the repeat gets the stored response back
+    """
+    with app.app_context():
+        db.session.add(Approval(customer_id='C-801', full_name='ลูกค้า ซ้ำ', status='รอปิดจ๊อบ'))
+        db.session.commit()
+
+    payload = {'customer_id': 'C-801', 'transaction_date': '2025-10-02',
+               'transactions': [{'company': 'STARLOAN', 'action_type': 'เปิดยอด', 'table_select': 'โต๊ะ1', 'amount': '5000'}]}
+    headers = {'Idempotency-Key': 'close-C-801-1'}
+
+    # 1. The first request books the job; the repeat is replayed without a second row
+    first = logged_in_client.post('/save-approved-data', json=payload, headers=headers)
+    second = logged_in_client.post('/save-approved-data', json=payload, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert second.data == first.data and second.headers['Idempotent-Replayed'] == 'true'
+    with app.app_context():
+        assert AllPidJob.query.filter_by(customer_id='C-801').count() == 1
+        assert float(db.session.get(CustomerLoanSummary, 'C-801').total_given_out) == 5000.0
+
+    # 2. Reusing the key for a different body is refused
+    changed = dict(payload, transactions=[dict(payload['transactions'][0], amount='6000')])
+    assert logged_in_client.post('/save-approved-data', json=changed, headers=headers).status_code == 422
+
+    # 3. A failed request stores nothing, so the retry with the same key really runs
+    with patch('app._mark_status_and_log', side_effect=RuntimeError('db down')):
+        failed = logged_in_client.post('/mark_as_bad_debt', json={'customer_id': 'C-801'}, headers={'Idempotency-Key': 'bad-C-801'})
+    assert failed.status_code == 500
+    for _ in range(2):
+        response = logged_in_client.post('/mark_as_bad_debt', json={'customer_id': 'C-801'}, headers={'Idempotency-Key': 'bad-C-801'})
+        assert response.status_code == 200
+    with app.app_context():
+        assert BadDebtRecord.query.filter_by(customer_id='C-801').count() == 1
+        assert IdempotencyKey.query.filter(IdempotencyKey.idempotency_key.in_(['close-C-801-1', 'bad-C-801'])).count() == 2
+
+    # 4. Without the header nothing changes
+    logged_in_client.post('/mark_as_bad_debt', json={'customer_id': 'C-801'})
+    with app.app_context():
+        assert BadDebtRecord.query.filter_by(customer_id='C-801').count() == 2
+
+def test_idempotency_key_left_unfinished_is_never_rerun(logged_in_client, app):
+    """
+    GIVEN an Idempotency-Key whose writes committed but whose response was never stored (e.g. its worker was killed)
+    WHEN the client retries with the same key, before and after the pending timeout
+    THEN check that the view never runs again and the stale key is closed with an "outcome unknown" 409
+    """
+    body = json.dumps({'customer_id': 'C-802'})
+    headers = {'Idempotency-Key': 'bad-C-802'}
+    with app.app_context():
+        db.session.add(Approval(customer_id='C-802', full_name='ลูกค้า ค้าง', status='รอปิดจ๊อบ'))
+        db.session.add(IdempotencyKey(username='testuser', idempotency_key='bad-C-802', endpoint='mark_as_bad_debt',
+                                      request_hash=hashlib.sha256(body.encode()).hexdigest()))
+        db.session.commit()
+
+    # 1. A fresh unfinished claim still means "in progress"
+    response = logged_in_client.post('/mark_as_bad_debt', data=body, content_type='application/json', headers=headers)
+    assert response.status_code == 409
+
+    # 2. Once it is older than the pending timeout, the key is completed as "outcome unknown" instead of re-running
+    with app.app_context():
+        record = IdempotencyKey.query.filter_by(idempotency_key='bad-C-802').one()
+        record.created_at = datetime.now(UTC).replace(tzinfo=None) - IDEMPOTENCY_PENDING_TIMEOUT - timedelta(seconds=1)
+        db.session.commit()
+    for _ in range(2):
+        response = logged_in_client.post('/mark_as_bad_debt', data=body, content_type='application/json', headers=headers)
+        assert response.status_code == 409
+        assert json.loads(response.data) == IDEMPOTENCY_UNKNOWN_OUTCOME
+    with app.app_context():
+        assert BadDebtRecord.query.filter_by(customer_id='C-802').count() == 0
+        assert IdempotencyKey.query.filter_by(idempotency_key='bad-C-802').one().status_code == 409
+
 def test_update_customer_status_api(logged_in_client, app):
     """
     GIVEN a logged-in user and an existing customer record
@@ -213,8 +509,83 @@ def test_update_customer_status_api(logged_in_client, app):
     with app.app_context():
         updated_customer_3 = db.session.get(CustomerRecord, customer_db_id)
         assert updated_customer_3.status == 'ยกเลิก'
-        assert 'Initial remark.' in updated_customer_3.remarks
-        assert '[สถานะ: ยกเลิก] ลูกค้าไม่รับสาย' in updated_customer_3.remarks
+        # REVISED: โน้ตสถานะเก็บใน customer_status_events แทนการต่อท้าย remarks
+        assert updated_customer_3.remarks == 'Initial remark.'
+        events = updated_customer_3.status_events.all()
+        assert [e.to_status for e in events] == ['ยกเลิก', 'รอตรวจ', 'รออนุมัติ']
+        assert events[0].from_status == 'รอตรวจ'
+        assert events[0].note == 'ลูกค้าไม่รับสาย'
+
+    # 5. NEW: ประวัติสถานะผ่าน API (ล่าสุดก่อน, จำกัดจำนวนด้วย limit)
+    response_events = logged_in_client.get(f'/api/customers/{customer_db_id}/status-events?limit=2')
+    assert response_events.status_code == 200
+    events_json = json.loads(response_events.data)['events']
+    assert [e['to_status'] for e in events_json] == ['ยกเลิก', 'รอตรวจ']
+    assert events_json[0]['note'] == 'ลูกค้าไม่รับสาย'
+    assert logged_in_client.get('/api/customers/999999/status-events').status_code == 404
+
+def test_patch_customer_updates_only_changed_fields(logged_in_client, app):
+    """
+    GIVEN a logged-in user and an existing customer record
+    WHEN the 'PATCH /api/customers/<id>' endpoint is called with changed, unchanged and invalid fields
+    THEN check that only the differing columns are written and only the caches they feed are invalidated
+    """
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-PATCH-1', first_name='แพตช์', mobile_phone='081-111-1111',
+                                  province='ขอนแก่น', desired_credit_limit=50000)
+        db.session.add(customer)
+        db.session.commit()
+        customer_db_id = customer.id
+
+    updates = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE CUSTOMER_RECORDS'):
+            updates.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            with patch('app.tagged_cache.invalidate') as invalidate:
+                # 1. Same values as stored (commas and whitespace included): no-op fast path
+                response = logged_in_client.patch(f'/api/customers/{customer_db_id}',
+                                                  json={'mobile_phone': ' 081-111-1111 ', 'desired_credit_limit': '50,000'})
+                assert response.status_code == 200
+                assert json.loads(response.data)['changed'] == []
+                assert updates == [] and not invalidate.called
+
+                # 2. Phone changes, first name does not: one UPDATE of the phone, its digits column and updated_at only
+                response = logged_in_client.patch(f'/api/customers/{customer_db_id}',
+                                                  json={'mobile_phone': '089-999-9999', 'first_name': 'แพตช์'})
+                assert json.loads(response.data)['changed'] == ['mobile_phone']
+                assert len(updates) == 1
+                set_clause = updates[0].split(' SET ')[1].split(' WHERE ')[0]
+                assert sorted(part.split('=')[0].strip() for part in set_clause.split(',')) == ['mobile_phone', 'mobile_phone_digits', 'updated_at']
+                # The phone feeds no cached view, so nothing is invalidated
+                assert not invalidate.called
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        customer = db.session.get(CustomerRecord, customer_db_id)
+        assert customer.mobile_phone == '089-999-9999' and customer.mobile_phone_digits == '0899999999'
+
+    # 3. A grouped column also invalidates the chart it feeds; dates and times are coerced
+    with patch('app.tagged_cache.invalidate') as invalidate:
+        response = logged_in_client.patch(f'/api/customers/{customer_db_id}',
+                                          json={'province': 'เชียงใหม่', 'inspection_time': '09:30'})
+        assert sorted(json.loads(response.data)['changed']) == ['inspection_time', 'province']
+        assert 'charts:channel_province' in invalidate.call_args.args
+
+    # 4. Invalid or unknown fields are rejected without writing anything
+    response = logged_in_client.patch(f'/api/customers/{customer_db_id}',
+                                      json={'desired_credit_limit': 'abc', 'status': 'อนุมัติ', 'application_date': '2025-13-40'})
+    assert response.status_code == 400
+    assert set(json.loads(response.data)['errors']) == {'desired_credit_limit', 'status', 'application_date'}
+    assert logged_in_client.patch('/api/customers/999999', json={'remarks': 'x'}).status_code == 404
+
+    with app.app_context():
+        customer = db.session.get(CustomerRecord, customer_db_id)
+        assert customer.province == 'เชียงใหม่' and customer.inspection_time == time(9, 30)
+        assert customer.status is None
 
 def test_dashboard_chart_apis(logged_in_client, app):
     """
@@ -1,6 +1,18 @@
 import json
-from datetime import date
-from app import User, db, CustomerRecord, Approval, generate_password_hash
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import create_engine, event, text, update
+from datetime import date, datetime, time
+from decimal import Decimal
+from unittest.mock import MagicMock
+from app import (User, db, CustomerRecord, CustomerImage, Approval, IdSequence, AllPidJob, ContractDocument, BadDebtRecord, LoginHistory,
+                 create_app, generate_password_hash, encode_customer_cursor, get_search_backend)
+from id_allocator import BlockIdAllocator
+from search_backends import MySQLFulltextBackend
+from coercion import clean_decimal, parse_date, parse_decimal, parse_time
 
 def test_login_page(client):
     """
@@ -201,6 +213,126 @@ def test_delete_customer(logged_in_client, app):
         deleted_customer = db.session.get(CustomerRecord, customer_db_id)
         assert deleted_customer is None
 
+def test_form_coercion_without_pandas(logged_in_client, app):
+    """
+    GIVEN amounts, dates and times as typed into the customer forms (Thai digits, commas, baht)
+    WHEN they are coerced by coercion.py and saved through '/enter_customer_data'
+    THEN check that the stored values are exact Decimal / date / time objects and bad input is rejected
+    """
+    assert parse_decimal('1,234.50') == Decimal('1234.50')
+    assert parse_decimal('฿ 50,000') == Decimal('50000')
+    assert parse_decimal('๑๒,๕๐๐ บาท') == Decimal('12500')
+    assert parse_decimal('  ') is None and clean_decimal('abc') is None
+    with pytest.raises(ValueError):
+        parse_decimal('1,2a')
+    for not_finite in ['NaN', 'Infinity', Decimal('NaN'), Decimal('-Infinity')]:
+        with pytest.raises(ValueError):
+            parse_decimal(not_finite)
+    assert parse_date('2025-1-5') == date(2025, 1, 5) and parse_date('') is None
+    with pytest.raises(ValueError):
+        parse_date('2025-02-30')
+    with pytest.raises(ValueError):
+        parse_date(None, required=True)
+    assert parse_time('9:30') == time(9, 30) and parse_time('14:30:15') == time(14, 30, 15)
+    with pytest.raises(ValueError):
+        parse_time('25:00')
+
+    response = logged_in_client.post('/enter_customer_data', data={
+        'customer_name': 'แปลงค่า', 'last_name': 'ทดสอบ', 'desired_credit_limit': '๑๐๐,๐๐๐',
+        'processing_fee': 'ไม่ทราบ', 'application_date': '2025-10-01', 'inspection_date': '2025-10-20',
+        'inspection_time': '14:30:00'})
+    customer_id = json.loads(response.data)['customer_id']
+    with app.app_context():
+        customer = CustomerRecord.query.filter_by(customer_id=customer_id).first()
+        assert customer.desired_credit_limit == Decimal('100000') and customer.processing_fee is None
+        assert customer.application_date == date(2025, 10, 1) and customer.inspection_date == date(2025, 10, 20)
+        assert customer.inspection_time == time(14, 30)
+
+def test_import_needs_no_secrets_and_defers_heavy_modules():
+    """
+    GIVEN an environment without SECRET_KEY, DB_PASSWORD or DATABASE_URL
+    WHEN app.py is imported with CREATE_APP_ON_IMPORT=0 (as conftest does)
+    THEN check that the import succeeds, binds no database and loads neither pandas, Cloudinary nor Alembic
+    """
+    env = {key: value for key, value in os.environ.items() if key not in ('SECRET_KEY', 'DB_PASSWORD', 'DATABASE_URL')}
+    env['CREATE_APP_ON_IMPORT'] = '0'
+    code = ("import sys, app; "
+            "print(sorted(app.app.extensions), [m for m in ('pandas', 'numpy', 'cloudinary', 'alembic') if m in sys.modules])")
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(__file__), env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[] []'
+
+def test_create_app_refuses_a_different_config(app):
+    """
+    GIVEN the app already configured by create_app() (in conftest)
+    WHEN create_app() is called again
+    THEN check that it returns the same app without settings, and raises instead of ignoring different ones
+    """
+    assert create_app() is app
+    with pytest.raises(RuntimeError):
+        create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///other.sqlite', 'SECRET_KEY': 'other'})
+    assert app.config['SQLALCHEMY_DATABASE_URI'] == 'sqlite:///:memory:'
+
+def test_customer_images_edit_only_touches_changed_rows(logged_in_client, app, runner):
+    """
+    GIVEN a customer with three photos in customer_images
+    WHEN the edit form removes one, adds one and reorders the rest, then approves the customer
+    THEN check that kept rows survive, only the changes are written, and the approval gets its own copies
+    """
+    base = 'https://res.cloudinary.com/demo/image/upload/v1/customer_app_images/'
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-PHOTO-1', first_name='รูป', last_name='หลายใบ', status='รอตรวจ',
+                                  images=CustomerImage.from_urls([f'{base}a.jpg', f'{base}b.jpg', f'{base}c.jpg']))
+        db.session.add(customer)
+        db.session.commit()
+        customer_db_id = customer.id
+        ids_before = {image.url: image.id for image in customer.images}
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'customer_images' in statement and not statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement.split()[0].upper())
+
+    form = {'customer_name': 'รูป', 'last_name': 'หลายใบ', 'status': 'อนุมัติ',
+            'final_image_urls': f'{base}b.jpg, {base}a.jpg, {base}d.jpg',
+            'image_sizes': json.dumps({f'{base}d.jpg': 2048})}
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            logged_in_client.post(f'/edit_customer_data/{customer_db_id}', data=form)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        customer = db.session.get(CustomerRecord, customer_db_id)
+        assert [image.url for image in customer.images] == [f'{base}b.jpg', f'{base}a.jpg', f'{base}d.jpg']
+        assert customer.images[0].id == ids_before[f'{base}b.jpg'] and customer.images[1].id == ids_before[f'{base}a.jpg']
+        assert customer.images[2].bytes == 2048 and customer.images[2].public_id == 'customer_app_images/d'
+        # 1 delete (c), position updates for a and b only (possibly batched), inserts for d and the approval's copies
+        assert statements.count('DELETE') == 1 and 1 <= statements.count('UPDATE') <= 2
+
+        approval = Approval.query.filter_by(customer_id='PID-PHOTO-1').first()
+        assert [image.url for image in approval.contract_images] == [image.url for image in customer.images]
+        assert {image.id for image in approval.contract_images}.isdisjoint(image.id for image in customer.images)
+
+    # Rows loaded into the legacy column (e.g. by migrate_data.py) are moved over by the backfill command
+    with app.app_context():
+        legacy = CustomerRecord(customer_id='PID-PHOTO-2')
+        db.session.add(legacy)
+        db.session.commit()
+        db.session.execute(text("UPDATE customer_records SET image_urls = :urls WHERE id = :id"),
+                           {'urls': f'{base}x.jpg, {base}y.jpg, {base}x.jpg', 'id': legacy.id})
+        db.session.commit()
+    assert 'Backfilled 2 customer images.' in runner.invoke(args=['backfill-customer-images']).output
+    assert 'Backfilled 0 customer images.' in runner.invoke(args=['backfill-customer-images']).output
+    with app.app_context():
+        legacy = CustomerRecord.query.filter_by(customer_id='PID-PHOTO-2').first()
+        assert legacy.image_urls == f'{base}x.jpg,{base}y.jpg'
+        # The legacy column is cleared, so photos deleted afterwards stay deleted
+        assert db.session.execute(text("SELECT image_urls FROM customer_records WHERE id = :id"), {'id': legacy.id}).scalar() is None
+        CustomerImage.query.filter_by(customer_record_id=legacy.id).delete()
+        db.session.commit()
+    assert 'Backfilled 0 customer images.' in runner.invoke(args=['backfill-customer-images']).output
+
 def test_loan_management_page(logged_in_client, app):
     """
     GIVEN a logged-in user and an approval record in the database
@@ -231,4 +363,301 @@ def test_loan_management_page(logged_in_client, app):
     assert 'จัดการสินเชื่อ' in response_text
     assert 'PID-LOAN-1' in response_text
     assert 'ผู้กู้ ทดสอบ' in response_text
-    assert '50,000.00' in response_text # Check for formatted amount
\ No newline at end of file
+    assert '50,000.00' in response_text # Check for formatted amount
+
+
+def test_customer_data_keyset_pagination(logged_in_client, app):
+    """
+    GIVEN a logged-in user and customer records sharing the same timestamp
+    WHEN '/customer_data' is requested in streaming mode and in keyset-page mode
+    THEN check that every record is streamed and pages follow (timestamp, id) without gaps or repeats
+    """
+    # 1. Setup: Three records with identical timestamps so the id tie-breaker matters
+    with app.app_context():
+        same_time = datetime(2099, 1, 1, 12, 0, 0)
+        db.session.add_all([
+            CustomerRecord(customer_id=f'PID-PAGE-{i}', first_name=f'หน้า{i}', timestamp=same_time)
+            for i in range(1, 4)
+        ])
+        db.session.commit()
+
+    # 2. Streaming mode returns every record
+    response_stream = logged_in_client.get('/customer_data')
+    assert response_stream.status_code == 200
+    response_text_stream = response_stream.get_data(as_text=True)
+    for i in range(1, 4):
+        assert f'PID-PAGE-{i}' in response_text_stream
+
+    # 3. Keyset mode: newest (highest id) first, two per page
+    response_page1 = logged_in_client.get('/customer_data?limit=2')
+    response_text_page1 = response_page1.data.decode('utf-8')
+    assert 'PID-PAGE-3' in response_text_page1
+    assert 'PID-PAGE-2' in response_text_page1
+    assert 'PID-PAGE-1' not in response_text_page1
+
+    with app.app_context():
+        second = CustomerRecord.query.filter_by(customer_id='PID-PAGE-2').first()
+        cursor = encode_customer_cursor(second)
+
+    response_page2 = logged_in_client.get('/customer_data', query_string={'limit': 2, 'after': cursor})
+    response_text_page2 = response_page2.data.decode('utf-8')
+    assert 'PID-PAGE-1' in response_text_page2
+    assert 'PID-PAGE-2' not in response_text_page2
+    assert 'PID-PAGE-3' not in response_text_page2
+
+    # 4. A malformed cursor redirects back to the first page
+    response_bad = logged_in_client.get('/customer_data?after=not-a-cursor')
+    assert response_bad.status_code == 302
+
+def test_search_index_follows_edits(logged_in_client, app, runner):
+    """
+    GIVEN a built in-process search index
+    WHEN a customer is renamed through '/edit_customer_data' and later deleted
+    THEN check that searches reflect each change without a manual rebuild
+    """
+    # 1. Setup: Create a customer and build the index via the CLI command
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-INDEX-1', first_name='ดัชนีเดิม', last_name='ค้นหา', status='รอติดต่อ')
+        db.session.add(customer)
+        db.session.commit()
+        customer_db_id = customer.id
+
+    # The n-gram index narrows the LIKE backend, so force it instead of the SQLite FTS5 engine.
+    app.config['SEARCH_BACKEND'] = 'like'
+
+    result = runner.invoke(args=['rebuild-search-index'])
+    assert result.exit_code == 0
+    assert 'distinct n-grams' in result.output
+
+    response_old = logged_in_client.get('/search_customer_data?search_keyword=ดัชนีเดิม')
+    assert 'PID-INDEX-1' in response_old.data.decode('utf-8')
+
+    # 2. Rename the customer through the edit form
+    logged_in_client.post(f'/edit_customer_data/{customer_db_id}', data={'customer_name': 'ดัชนีใหม่', 'last_name': 'ค้นหา'})
+
+    response_new = logged_in_client.get('/search_customer_data?search_keyword=ดัชนีใหม่')
+    assert 'PID-INDEX-1' in response_new.data.decode('utf-8')
+    response_stale = logged_in_client.get('/search_customer_data?search_keyword=ดัชนีเดิม')
+    assert 'PID-INDEX-1' not in response_stale.data.decode('utf-8')
+
+    # 3. Delete the customer
+    logged_in_client.post(f'/delete_customer/{customer_db_id}', follow_redirects=True)
+    response_deleted = logged_in_client.get('/search_customer_data?search_keyword=ดัชนีใหม่')
+    assert 'PID-INDEX-1' not in response_deleted.data.decode('utf-8')
+
+    app.config['SEARCH_BACKEND'] = 'auto'
+
+def test_search_index_sees_edits_from_other_workers(logged_in_client, app, runner):
+    """
+    GIVEN a built in-process search index
+    WHEN a customer is inserted and another renamed without going through this worker's index
+    THEN check that searches still find both from the database
+    """
+    # 1. Setup: Index one customer
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-WORKER-1', first_name='ก่อนแก้', last_name='ข้ามเครื่อง')
+        db.session.add(customer)
+        db.session.commit()
+        customer_db_id = customer.id
+
+    app.config['SEARCH_BACKEND'] = 'like'
+    assert runner.invoke(args=['rebuild-search-index']).exit_code == 0
+
+    # 2. Another worker renames it and inserts a new customer; this worker's index is not told
+    with app.app_context():
+        db.session.execute(update(CustomerRecord).where(CustomerRecord.id == customer_db_id).values(first_name='หลังแก้'))
+        db.session.add(CustomerRecord(customer_id='PID-WORKER-2', first_name='หลังแก้', last_name='ลูกค้าใหม่'))
+        db.session.commit()
+
+    response = logged_in_client.get('/search_customer_data?search_keyword=หลังแก้')
+    response_text = response.data.decode('utf-8')
+    assert 'PID-WORKER-1' in response_text
+    assert 'PID-WORKER-2' in response_text
+
+    app.config['SEARCH_BACKEND'] = 'auto'
+
+def test_search_fulltext_backend(logged_in_client, app, runner):
+    """
+    GIVEN customer records in a SQLite database
+    WHEN a text keyword is searched
+    THEN check that the FTS5 backend is chosen, stays in sync with edits and ranks better matches first
+    """
+    # 1. Setup: Both records mention the keyword, but only the first in its name
+    with app.app_context():
+        db.session.add_all([
+            CustomerRecord(customer_id='PID-FTS-1', first_name='ทองคำ', last_name='ทองคำ', business_name='ร้านทองคำ'),
+            CustomerRecord(customer_id='PID-FTS-2', first_name='สุดา', last_name='ใจดี', remarks='เคยซื้อทองคำ'),
+        ])
+        db.session.commit()
+
+        assert get_search_backend('ทองคำ').name == 'sqlite_fts5'
+        assert get_search_backend('081-111-1111').name == 'digits'
+        # Keywords shorter than a trigram cannot use FTS5
+        assert get_search_backend('ทอ').name == 'like'
+        # ID-shaped keywords need the customer_id / phone / ID card columns the FTS table does not cover
+        assert get_search_backend('PID-FTS').name == 'like'
+        assert get_search_backend('ทองคำ1').name == 'like'
+
+    # 2. The setup command is idempotent on an existing database
+    result = runner.invoke(args=['setup-fulltext'])
+    assert result.exit_code == 0
+    assert 'sqlite' in result.output
+
+    # 3. Both records are found, the stronger match first
+    response = logged_in_client.get('/search_customer_data?search_keyword=ทองคำ')
+    response_text = response.data.decode('utf-8')
+    assert 'PID-FTS-1' in response_text
+    assert 'PID-FTS-2' in response_text
+    assert response_text.index('PID-FTS-1') < response_text.index('PID-FTS-2')
+
+    # 4. A customer ID fragment still finds the records
+    response_text = logged_in_client.get('/search_customer_data?search_keyword=PID-FTS').data.decode('utf-8')
+    assert 'PID-FTS-1' in response_text and 'PID-FTS-2' in response_text
+
+def test_mysql_fulltext_backend_waits_for_its_index():
+    """
+    GIVEN a MySQL database where `flask setup-fulltext` has not created the FULLTEXT index yet
+    WHEN the MySQL backend is asked whether it can serve searches
+    THEN check that it declines until information_schema lists the index, re-checking at most once per interval
+    """
+    backend = MySQLFulltextBackend(CustomerRecord, ('first_name',), 'ix_customer_records_fulltext')
+    session = MagicMock()
+    session.get_bind.return_value.dialect.name = 'mysql'
+    session.execute.return_value.first.return_value = None
+    assert not backend.is_available(session)
+
+    # The index appears; the cached answer holds until the interval has passed
+    session.execute.return_value.first.return_value = (1,)
+    assert not backend.is_available(session)
+    backend._index_checked_at -= backend.index_check_interval + 1
+    assert backend.is_available(session)
+    assert session.execute.call_count == 2
+
+def test_search_by_phone_and_id_card_digits(logged_in_client, app, runner):
+    """
+    GIVEN customers whose phone / ID card numbers are stored with dashes and spaces
+    WHEN a numeric keyword is searched in any formatting
+    THEN check that the digits-only columns are maintained and matched by prefix
+    """
+    # 1. Setup: The ORM fills the digits-only columns on write
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-DIGITS-1', first_name='ตัวเลข', mobile_phone='086 555-1234', id_card_number='3-1001-00123-45-6')
+        placeholder = CustomerRecord(customer_id='PID-DIGITS-2', first_name='ไม่มีเบอร์', mobile_phone='-')
+        db.session.add_all([customer, placeholder])
+        db.session.commit()
+        assert customer.mobile_phone_digits == '0865551234'
+        assert customer.id_card_digits == '3100100123456'
+        assert placeholder.mobile_phone_digits is None
+
+    # 2. Exact and prefix searches in different formatting
+    for keyword in ['0865551234', '086-555-1234', '086 555', '3100100123456', '3-1001']:
+        response = logged_in_client.get('/search_customer_data', query_string={'search_keyword': keyword})
+        assert 'PID-DIGITS-1' in response.data.decode('utf-8'), keyword
+
+    # 3. The backfill command recomputes the columns for rows written outside the ORM
+    with app.app_context():
+        db.session.execute(db.update(CustomerRecord).where(CustomerRecord.customer_id == 'PID-DIGITS-1').values(mobile_phone_digits=None))
+        db.session.commit()
+
+    result = runner.invoke(args=['backfill-customer-digits'])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        assert CustomerRecord.query.filter_by(customer_id='PID-DIGITS-1').first().mobile_phone_digits == '0865551234'
+
+def test_concurrent_customer_ids_never_collide(tmp_path):
+    """
+    GIVEN many threads submitting '/enter_customer_data' at the same time
+    WHEN each request takes its customer ID from the block allocator
+    THEN check that every submission succeeds with a distinct numeric ID
+    """
+    # The shared test app uses one in-memory SQLite connection for every thread, so this runs a
+    # fresh app on a file database (one connection per thread) in its own process. A block size
+    # of 2 set through create_app() makes the threads race on the sequence row constantly.
+    env = {key: value for key, value in os.environ.items() if key not in ('SECRET_KEY', 'DB_PASSWORD', 'DATABASE_URL')}
+    env.update(CREATE_APP_ON_IMPORT='0', TASK_WORKER_ENABLED='0')
+    code = f"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from app import create_app, db, User, generate_password_hash
+
+app = create_app({{'TESTING': True, 'SECRET_KEY': 'concurrency', 'CUSTOMER_ID_BLOCK_SIZE': 2,
+                  'SQLALCHEMY_DATABASE_URI': 'sqlite:///{tmp_path / 'concurrency.sqlite'}',
+                  'SQLALCHEMY_ENGINE_OPTIONS': {{'connect_args': {{'timeout': 30}}}}}})
+with app.app_context():
+    db.create_all()
+    db.session.add(User(user_id='testuser', password=generate_password_hash('password123')))
+    db.session.commit()
+
+def submit(thread_no):
+    # Each thread gets its own logged-in client, like separate browser sessions.
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+        sess['username'] = 'testuser'
+    ids = []
+    for i in range(5):
+        response = client.post('/enter_customer_data', data={{'customer_name': f'พร้อมกัน{{thread_no}}-{{i}}', 'last_name': 'ทดสอบ'}})
+        assert response.status_code == 200, response.data
+        ids.append(json.loads(response.data)['customer_id'])
+    return ids
+
+with ThreadPoolExecutor(max_workers=8) as executor:
+    print(json.dumps([customer_id for ids in executor.map(submit, range(8)) for customer_id in ids]))
+"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(__file__), env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    all_ids = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert len(all_ids) == 40
+    assert len(set(all_ids)) == 40
+    assert all(customer_id.isdigit() for customer_id in all_ids)
+
+def test_block_id_allocator_under_contention(tmp_path):
+    """
+    GIVEN several allocators (one per simulated worker) sharing a sequence table
+    WHEN many threads draw IDs with tiny blocks so they race on the sequence row constantly
+    THEN check that no ID is ever handed out twice
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'sequences.sqlite'}")
+    IdSequence.__table__.create(engine)
+    workers = [BlockIdAllocator(IdSequence.__table__, 'customer_id', block_size=3, initial_value=lambda conn: 1001) for _ in range(4)]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        values = list(executor.map(lambda i: workers[i % 4].next_id(engine), range(400)))
+
+    assert len(set(values)) == 400
+    assert min(values) == 1001
+
+    # Imported IDs push the sequence forward
+    BlockIdAllocator(IdSequence.__table__, 'customer_id').advance_past(engine, 50000)
+    assert BlockIdAllocator(IdSequence.__table__, 'customer_id').next_id(engine) == 50001
+
+# (expected index, query builder) for the hot lookups of each route
+HOT_QUERIES = [
+    ('ix_customer_records_timestamp_id', lambda: CustomerRecord.query.order_by(CustomerRecord.timestamp.desc(), CustomerRecord.id.desc()).limit(50)),
+    ('ix_customer_records_status_timestamp', lambda: CustomerRecord.query.filter(CustomerRecord.status == 'รอติดต่อ').order_by(CustomerRecord.timestamp.desc())),
+    ('ix_approvals_customer_id', lambda: Approval.query.filter_by(customer_id='C-001')),
+    ('ix_approvals_approval_date', lambda: Approval.query.order_by(Approval.approval_date.desc())),
+    ('ix_all_pid_jobs_customer_date_time', lambda: AllPidJob.query.filter(AllPidJob.customer_id == 'C-001', AllPidJob.interest.isnot(None))
+        .order_by(AllPidJob.transaction_date.desc(), AllPidJob.transaction_time.desc())),
+    ('ix_all_pid_jobs_date_company_time', lambda: AllPidJob.query.filter(AllPidJob.transaction_date == date(2025, 9, 18), AllPidJob.company_name == 'STARLOAN')
+        .order_by(AllPidJob.transaction_time)),
+    ('ix_contract_documents_customer_uploaded', lambda: ContractDocument.query.filter_by(customer_id='C-001').order_by(ContractDocument.upload_timestamp.asc())),
+    ('ix_bad_debt_records_timestamp', lambda: BadDebtRecord.query.order_by(BadDebtRecord.timestamp.desc())),
+    ('ix_login_history_login_timestamp', lambda: LoginHistory.query.order_by(LoginHistory.login_timestamp.desc()).limit(100)),
+]
+
+@pytest.mark.parametrize('index_name, build_query', HOT_QUERIES, ids=[name for name, _ in HOT_QUERIES])
+def test_hot_queries_use_an_index(app, index_name, build_query):
+    """
+    GIVEN the composite indexes declared on the models
+    WHEN the query planner explains each hot route query
+    THEN check that it reads through the matching index instead of scanning the table
+    """
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            pytest.skip('EXPLAIN QUERY PLAN output is SQLite-specific')
+        sql = str(build_query().statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = ' | '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)))
+    assert f'INDEX {index_name}' in plan, plan
@@ -0,0 +1,178 @@
+import json
+from datetime import date
+from app import db, CustomerRecord, CustomerMonthlyRollup, CustomerChannelProvinceRollup, tagged_cache
+from two_tier_cache import TwoTierCache
+
+def test_chart_cache_tag_invalidation(logged_in_client, app):
+    """
+    GIVEN cached dashboard chart data
+    WHEN customers are edited through the app
+    THEN check that only the charts fed by the changed columns are recomputed
+    """
+    # 1. Setup: A customer counted in both charts; start from fresh chart generations
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-TAG-1', application_date=date(2023, 3, 1), main_customer_group='ค้าขาย',
+                                  province='ขอนแก่น', application_channel='อีเมล', status='รอติดต่อ')
+        db.session.add(customer)
+        db.session.commit()
+        customer_db_id = customer.id
+    tagged_cache.invalidate('charts:monthly', 'charts:channel_province')
+
+    logged_in_client.get('/get_customer_chart_data')
+    logged_in_client.get('/get_channel_province_chart_data')
+    hits_before = tagged_cache.hits
+
+    # 2. A status change feeds neither chart, so both stay cached
+    logged_in_client.post('/update_customer_status', json={'row_index': customer_db_id, 'new_status': 'รออนุมัติ'})
+    logged_in_client.get('/get_customer_chart_data')
+    logged_in_client.get('/get_channel_province_chart_data')
+    assert tagged_cache.hits == hits_before + 2
+
+    # 3. Changing the province only invalidates the channel/province chart
+    logged_in_client.post(f'/edit_customer_data/{customer_db_id}', data={'customer_name': 'แท็ก', 'last_name': 'ทดสอบ', 'province': 'ภูเก็ต', 'application_date': '2023-03-01'})
+    hits_before = tagged_cache.hits
+    response_monthly = logged_in_client.get('/get_customer_chart_data')
+    response_channel = logged_in_client.get('/get_channel_province_chart_data')
+    assert tagged_cache.hits == hits_before + 1
+
+    assert json.loads(response_monthly.data)['chart_data']['2023']['03']['ค้าขาย'] == 1
+    chart_channel = json.loads(response_channel.data)['chart_data']['2023']['03']
+    assert chart_channel['ภูเก็ต']['อีเมล']['ค้าขาย'] == 1
+    assert 'ขอนแก่น' not in chart_channel
+
+def test_cache_stats_api(logged_in_client, client, app):
+    """
+    GIVEN a logged-in user
+    WHEN '/api/cache-stats' is requested
+    THEN check that only the superadmin can read the counters
+    """
+    response_forbidden = logged_in_client.get('/api/cache-stats')
+    assert response_forbidden.status_code == 403
+
+    with client.session_transaction() as sess:
+        sess['username'] = 'khanhommha'
+    response = client.get('/api/cache-stats')
+    assert response.status_code == 200
+    stats = json.loads(response.data)
+    assert {'hits', 'misses', 'invalidations', 'hit_rate'} <= set(stats)
+
+def test_two_tier_cache_invalidation_reaches_other_workers(tmp_path):
+    """
+    GIVEN two cache instances sharing one L2 file (as two gunicorn workers would)
+    WHEN one worker overwrites or deletes an entry the other holds in its L1
+    THEN check that the other worker never serves the stale value
+    """
+    path = str(tmp_path / 'cache.sqlite')
+    worker_a = TwoTierCache(path)
+    worker_b = TwoTierCache(path)
+
+    # 1. A value set by one worker is warm for the other (read through L2, kept in L1)
+    worker_a.set('customer_chart_data', {'2023': 1})
+    assert worker_b.get('customer_chart_data') == {'2023': 1}
+
+    # 2. Overwrites, deletes and clears fan out to the other worker's L1
+    worker_a.set('customer_chart_data', {'2023': 2})
+    assert worker_b.get('customer_chart_data') == {'2023': 2}
+    worker_a.delete('customer_chart_data')
+    assert worker_b.get('customer_chart_data') is None
+    worker_b.set('user_login_data', {'admin': 'hash'})
+    assert worker_a.get('user_login_data') == {'admin': 'hash'}
+    worker_b.clear()
+    assert worker_a.get('user_login_data') is None
+
+    # 3. Counters are atomic across workers; add() only succeeds for the first worker
+    assert worker_a.inc('counter') == 1
+    assert worker_b.inc('counter') == 2
+    assert worker_a.add('generation', 1, timeout=0) is True
+    assert worker_b.add('generation', 2, timeout=0) is False
+    assert worker_b.get('generation') == 1
+
+def test_chart_rollups_follow_writes(logged_in_client, app, runner):
+    """
+    GIVEN customers created, edited and deleted through the ORM
+    WHEN the chart rollup tables are read
+    THEN check that they match a full rebuild from customer_records
+    """
+    def rollup_rows():
+        with app.app_context():
+            monthly = {(r.year, r.month, r.main_customer_group): r.customer_count
+                       for r in CustomerMonthlyRollup.query.filter(CustomerMonthlyRollup.customer_count > 0)}
+            channel = {(r.year, r.month, r.province, r.application_channel, r.main_customer_group): r.customer_count
+                       for r in CustomerChannelProvinceRollup.query.filter(CustomerChannelProvinceRollup.customer_count > 0)}
+            return monthly, channel
+
+    # 1. Inserts, including a record without an application date
+    with app.app_context():
+        db.session.add_all([
+            CustomerRecord(customer_id='PID-ROLL-1', application_date=date(2024, 5, 2), main_customer_group='ค้าขาย', province='ตาก', application_channel='อีเมล'),
+            CustomerRecord(customer_id='PID-ROLL-2', application_date=date(2024, 5, 20), main_customer_group='ค้าขาย', province='ตาก', application_channel='อีเมล'),
+            CustomerRecord(customer_id='PID-ROLL-3', application_date=None, main_customer_group='บริการ'),
+        ])
+        db.session.commit()
+    monthly, channel = rollup_rows()
+    assert monthly[(2024, 5, 'ค้าขาย')] == 2
+    assert channel[(2024, 5, 'ตาก', 'อีเมล', 'ค้าขาย')] == 2
+
+    # 2. An edit moves one count between keys (old value not loaded yet); a delete removes one
+    with app.app_context():
+        customer = CustomerRecord.query.filter_by(customer_id='PID-ROLL-2').first()
+        db.session.expire(customer)
+        customer.application_date = date(2024, 6, 1)
+        customer.main_customer_group = None
+        db.session.commit()
+        db.session.delete(CustomerRecord.query.filter_by(customer_id='PID-ROLL-1').first())
+        db.session.commit()
+    monthly, channel = rollup_rows()
+    assert (2024, 5, 'ค้าขาย') not in monthly
+    assert monthly[(2024, 6, '')] == 1
+
+    # 3. The incrementally maintained rows equal a full rebuild
+    result = runner.invoke(args=['rebuild-chart-rollups'])
+    assert 'Rebuilt chart rollups' in result.output
+    assert rollup_rows() == (monthly, channel)
+
+    response = logged_in_client.get('/get_customer_chart_data')
+    assert json.loads(response.data)['chart_data']['2024']['06']['ไม่ระบุ'] == 1
+
+def test_channel_province_slice_api(logged_in_client, app):
+    """
+    GIVEN customers in several provinces, channels and months
+    WHEN '/api/charts/channel-province' is requested with filters
+    THEN check that only the requested slice comes back, as column arrays
+    """
+    with app.app_context():
+        db.session.add_all([
+            CustomerRecord(customer_id='PID-SLICE-1', application_date=date(2022, 1, 5), province='น่าน', application_channel='อีเมล', main_customer_group='ค้าขาย'),
+            CustomerRecord(customer_id='PID-SLICE-2', application_date=date(2022, 2, 5), province='น่าน', application_channel='อีเมล', main_customer_group='บริการ'),
+            CustomerRecord(customer_id='PID-SLICE-3', application_date=date(2022, 2, 9), province='น่าน', application_channel='ไลน์@สตาร์โลน', main_customer_group=None),
+            CustomerRecord(customer_id='PID-SLICE-4', application_date=date(2022, 7, 1), province='แพร่', application_channel='อีเมล', main_customer_group='ค้าขาย'),
+        ])
+        db.session.commit()
+
+    # 1. One year and province, months 2-6, summed per channel
+    response = logged_in_client.get('/api/charts/channel-province?year=2022&province=น่าน&month_from=2&month_to=6&group_by=channel')
+    assert response.status_code == 200
+    payload = json.loads(response.data)
+    assert payload['columns'] == ['channel', 'count']
+    assert dict(zip(payload['data']['channel'], payload['data']['count'])) == {'อีเมล': 1, 'ไลน์@สตาร์โลน': 1}
+
+    # 2. Full rows by default; the 'ไม่ระบุ' label filters the customers without a group
+    payload = json.loads(logged_in_client.get('/api/charts/channel-province?year=2022&group=ไม่ระบุ').data)
+    assert payload['rows'] == 1
+    assert payload['data']['province'] == ['น่าน'] and payload['data']['month'] == [2]
+
+    # 3. The dashboard's summary slice: counts per year, month and channel
+    payload = json.loads(logged_in_client.get('/api/charts/channel-province?province=น่าน&group_by=year,month,channel').data)
+    assert payload['columns'] == ['year', 'month', 'channel', 'count']
+    assert list(zip(payload['data']['year'], payload['data']['month'], payload['data']['channel'], payload['data']['count'])) == [
+        (2022, 1, 'อีเมล', 1), (2022, 2, 'อีเมล', 1), (2022, 2, 'ไลน์@สตาร์โลน', 1)]
+
+    # 4. Bad parameters are rejected
+    assert logged_in_client.get('/api/charts/channel-province?year=abc').status_code == 400
+    assert logged_in_client.get('/api/charts/channel-province?month_from=7&month_to=3').status_code == 400
+    assert logged_in_client.get('/api/charts/channel-province?group_by=customer_id').status_code == 400
+
+    # 5. Facets list the filter values
+    facets = json.loads(logged_in_client.get('/api/charts/channel-province/facets').data)
+    assert '2022' in facets['unique_years']
+    assert {'น่าน', 'แพร่'} <= set(facets['unique_provinces'])
@@ -0,0 +1,234 @@
+import json
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+from sqlalchemy.exc import OperationalError
+from app import db, ContractDocument, BackgroundTask, CustomerRecord, CustomerImage, Approval, task_queue, cloudinary_sdk
+from cloudinary_cleanup import DELETE_BATCH_SIZE
+
+class FakeCloudinaryApi:
+    """Stands in for cloudinary.api; holds a folder of resources and fails while any id in `failing` is requested."""
+    def __init__(self, resources=(), failing=()):
+        self.resources_by_id = {r['public_id']: r for r in resources}
+        self.failing = set(failing)
+        self.delete_calls = []
+
+    def delete_resources(self, public_ids):
+        if self.failing & set(public_ids):
+            raise ConnectionError('Cloudinary unreachable')
+        self.delete_calls.append(list(public_ids))
+        return {'deleted': {pid: 'deleted' if self.resources_by_id.pop(pid, None) else 'not_found' for pid in public_ids}}
+
+    def resources(self, type, prefix, max_results, next_cursor=None):
+        ids = sorted(pid for pid in self.resources_by_id if pid.startswith(prefix))
+        start = int(next_cursor or 0)
+        page = ids[start:start + max_results]
+        more = start + max_results < len(ids)
+        return {'resources': [self.resources_by_id[pid] for pid in page], 'next_cursor': str(start + max_results) if more else None}
+
+    @property
+    def destroyed(self):
+        return [pid for call in self.delete_calls for pid in call]
+
+def test_delete_contract_doc_queues_cloudinary_deletion(logged_in_client, app):
+    """
+    GIVEN a contract document stored on Cloudinary
+    WHEN '/delete_contract_doc' is called
+    THEN check that the request only queues the Cloudinary deletion and a worker performs it later
+    """
+    url = 'https://res.cloudinary.com/demo/image/upload/v1/customer_app_images/contract-1.jpg'
+    with app.app_context():
+        db.session.add(ContractDocument(customer_id='C-901', document_url=url, uploaded_by='testuser'))
+        db.session.commit()
+
+    fake = FakeCloudinaryApi()
+    with patch.object(cloudinary_sdk(), 'api', fake):
+        response = logged_in_client.post('/delete_contract_doc', json={'customer_id': 'C-901', 'image_url_to_delete': url})
+        assert response.status_code == 200
+        assert fake.destroyed == []  # nothing remote happened on the request path
+
+        with app.app_context():
+            assert ContractDocument.query.filter_by(customer_id='C-901').count() == 0
+            assert task_queue.run_pending(db.engine) == (1, 0)
+            assert BackgroundTask.query.count() == 0
+    assert fake.destroyed == ['customer_app_images/contract-1']
+
+def test_background_task_retries_then_dead_letters(logged_in_client, app):
+    """
+    GIVEN a queued Cloudinary deletion whose remote call keeps failing
+    WHEN the worker runs it repeatedly
+    THEN check that it backs off between attempts, lands in the dead-letter list, and can be retried
+    """
+    fake = FakeCloudinaryApi(failing={'customer_app_images/stuck'})
+    with app.app_context():
+        task_queue.enqueue(db.session, 'cloudinary.delete_resources', {'public_ids': ['customer_app_images/stuck']})
+        db.session.commit()
+
+        with patch.object(cloudinary_sdk(), 'api', fake):
+            # 1. A failure reschedules the task into the future instead of retrying at once
+            assert task_queue.run_pending(db.engine) == (0, 1)
+            assert task_queue.run_pending(db.engine) == (0, 0)
+            task = BackgroundTask.query.one()
+            assert task.status == 'pending' and task.attempts == 1 and 'Cloudinary unreachable' in task.last_error
+            assert task.run_after - task.created_at >= timedelta(seconds=task_queue.base_delay * 0.8)
+
+            # 2. After max_attempts it becomes dead
+            for _ in range(task_queue.max_attempts - 1):
+                BackgroundTask.query.update({'run_after': task.created_at})
+                db.session.commit()
+                task_queue.run_pending(db.engine)
+            db.session.expire_all()
+            task = BackgroundTask.query.one()
+            assert task.status == 'dead' and task.attempts == task_queue.max_attempts
+            task_id = task.id
+
+    # 3. The superadmin sees it in the dead-letter list and retries it once the remote side is back
+    assert logged_in_client.get('/api/background-tasks/dead').status_code == 403
+    with logged_in_client.session_transaction() as sess:
+        sess['username'] = 'khanhommha'
+    dead = json.loads(logged_in_client.get('/api/background-tasks/dead').data)
+    assert dead['count'] == 1 and dead['tasks'][0]['payload'] == {'public_ids': ['customer_app_images/stuck']}
+
+    assert logged_in_client.post(f'/api/background-tasks/{task_id}/retry').status_code == 200
+    fake.failing.clear()
+    with app.app_context(), patch.object(cloudinary_sdk(), 'api', fake):
+        assert task_queue.run_pending(db.engine) == (1, 0)
+    assert fake.destroyed == ['customer_app_images/stuck']
+    assert logged_in_client.post(f'/api/background-tasks/{task_id}/retry').status_code == 404
+
+def test_task_worker_survives_a_failed_claim(app):
+    """
+    GIVEN a queued task and a database error on the worker's first claim
+    WHEN the worker loop runs
+    THEN check that the error is logged, the loop keeps going and the task still runs
+    """
+    fake = FakeCloudinaryApi()
+    stop = threading.Event()
+    real_claim = task_queue.claim
+    calls = []
+
+    def flaky_claim(engine, limit=20):
+        calls.append(limit)
+        if len(calls) == 1:
+            raise OperationalError('SELECT', {}, Exception('database is unavailable'))
+        claimed = real_claim(engine, limit)
+        stop.set()
+        return claimed
+
+    with app.app_context():
+        task_queue.enqueue(db.session, 'cloudinary.delete_resources', {'public_ids': ['customer_app_images/flaky']})
+        db.session.commit()
+        with patch.object(cloudinary_sdk(), 'api', fake), patch.object(task_queue, 'claim', flaky_claim), \
+                patch('task_queue.logger') as logger:
+            task_queue.run_forever(db.engine, poll_interval=0, stop_event=stop)
+        assert len(calls) == 2
+        assert logger.exception.call_count == 1
+        assert BackgroundTask.query.count() == 0
+    assert fake.destroyed == ['customer_app_images/flaky']
+
+def test_delete_customer_and_orphan_sweep_batch_deletions(logged_in_client, app, runner):
+    """
+    GIVEN customers with photos on Cloudinary and a folder holding unreferenced uploads
+    WHEN a customer is deleted and the orphan sweeper runs
+    THEN check that assets are removed in delete_resources chunks and referenced ones are kept
+    """
+    base = 'https://res.cloudinary.com/demo/image/upload/v1/customer_app_images/'
+    old = '2020-01-01T00:00:00Z'
+    with app.app_context():
+        gone = CustomerRecord(customer_id='PID-IMG-1', images=CustomerImage.from_urls([f'{base}gone-1.jpg', f'{base}gone-2.jpg']))
+        loan = CustomerRecord(customer_id='PID-IMG-2', images=CustomerImage.from_urls([f'{base}loan-1.jpg', f'{base}extra.jpg']))
+        # Not backfilled yet: its photos are only in the legacy comma-joined column
+        legacy = CustomerRecord(customer_id='PID-IMG-3', legacy_image_urls=f'{base}legacy-1.jpg, {base}legacy-2.jpg')
+        db.session.add_all([gone, loan, legacy, Approval(customer_id='PID-IMG-2', status='รอปิดจ๊อบ', contract_images=CustomerImage.from_urls([f'{base}loan-1.jpg'])),
+                            ContractDocument(customer_id='PID-IMG-1', document_url=f'{base}contract-9.jpg', uploaded_by='testuser')])
+        db.session.commit()
+        gone_id, loan_id = gone.id, loan.id
+
+    # 1. Deleting customers queues their assets; a live loan keeps the photos it references
+    fake = FakeCloudinaryApi()
+    with patch.object(cloudinary_sdk(), 'api', fake):
+        logged_in_client.post(f'/delete_customer/{gone_id}')
+        logged_in_client.post(f'/delete_customer/{loan_id}')
+        with app.app_context():
+            assert ContractDocument.query.filter_by(customer_id='PID-IMG-1').count() == 0
+            task_queue.run_pending(db.engine)
+    assert sorted(fake.destroyed) == ['customer_app_images/contract-9', 'customer_app_images/extra',
+                                      'customer_app_images/gone-1', 'customer_app_images/gone-2']
+
+    # 2. The sweeper pages through the folder and deletes only old, unreferenced uploads, 100 per call
+    orphans = [{'public_id': f'customer_app_images/orphan-{i:03d}', 'created_at': old} for i in range(DELETE_BATCH_SIZE + 20)]
+    fake = FakeCloudinaryApi(resources=orphans + [
+        {'public_id': 'customer_app_images/loan-1', 'created_at': old},
+        {'public_id': 'customer_app_images/legacy-2', 'created_at': old},
+        {'public_id': 'customer_app_images/just-uploaded', 'created_at': '2999-01-01T00:00:00Z'},
+    ])
+    with patch.object(cloudinary_sdk(), 'api', fake):
+        assert 'Found 120 orphaned images' in runner.invoke(args=['sweep-cloudinary-orphans', '--dry-run']).output
+        assert 'Queued deletion of 120 orphaned images' in runner.invoke(args=['sweep-cloudinary-orphans']).output
+        with app.app_context():
+            assert task_queue.run_pending(db.engine) == (2, 0)
+    assert [len(call) for call in fake.delete_calls] == [DELETE_BATCH_SIZE, 20]
+    assert set(fake.resources_by_id) == {'customer_app_images/loan-1', 'customer_app_images/legacy-2', 'customer_app_images/just-uploaded'}
+
+def test_cloudinary_signatures_batch_api(logged_in_client, monkeypatch):
+    """
+    GIVEN a user about to upload several photos
+    WHEN '/api/cloudinary-signatures' is requested once for the whole batch
+    THEN check that every file gets its own public_id and a signature covering it
+    """
+    import cloudinary.utils
+    monkeypatch.setenv('CLOUDINARY_API_SECRET', 'test-secret')
+    response = logged_in_client.get('/api/cloudinary-signatures?count=15')
+    assert response.status_code == 200
+    payload = json.loads(response.data)
+    assert len(payload['uploads']) == 15
+    assert len({upload['public_id'] for upload in payload['uploads']}) == 15
+    assert payload['expires_at'] > payload['timestamp']
+    for upload in payload['uploads']:
+        params = {'timestamp': payload['timestamp'], 'folder': payload['folder'],
+                  'transformation': payload['transformation'], 'public_id': upload['public_id']}
+        assert upload['signature'] == cloudinary.utils.api_sign_request(params, 'test-secret')
+
+    assert logged_in_client.get('/api/cloudinary-signatures?count=0').status_code == 400
+    assert logged_in_client.get('/api/cloudinary-signatures?count=500').status_code == 400
+
+    # Later batches come from the same cached per-user pool (same timestamp) but never repeat a public_id;
+    # once the pool is used up, a fresh one is signed
+    second = json.loads(logged_in_client.get('/api/cloudinary-signatures?count=10').data)
+    assert second['timestamp'] == payload['timestamp']
+    third = json.loads(logged_in_client.get('/api/cloudinary-signatures?count=10').data)
+    public_ids = [upload['public_id'] for batch in (payload, second, third) for upload in batch['uploads']]
+    assert len(set(public_ids)) == 35
+    for upload in third['uploads']:
+        params = {'timestamp': third['timestamp'], 'folder': third['folder'],
+                  'transformation': third['transformation'], 'public_id': upload['public_id']}
+        assert upload['signature'] == cloudinary.utils.api_sign_request(params, 'test-secret')
+
+    # The single-signature endpoint is reused per user within its validity window
+    first = json.loads(logged_in_client.get('/api/cloudinary-signature').data)
+    second = json.loads(logged_in_client.get('/api/cloudinary-signature').data)
+    assert first == second
+
+def test_image_variants_in_gallery_apis(logged_in_client, app):
+    """
+    GIVEN a customer with a stored Cloudinary photo and a contract document
+    WHEN the edit page and '/get-customer-info' are loaded
+    THEN check that galleries get thumbnail URLs while the stored URL is kept for keep/delete logic
+    """
+    url = 'https://res.cloudinary.com/demo/image/upload/v1/customer_app_images/photo-1.jpg'
+    with app.app_context():
+        customer = CustomerRecord(customer_id='PID-VAR-1', first_name='รูป', last_name='ทดสอบ', images=CustomerImage.from_urls([url]))
+        db.session.add_all([customer, Approval(customer_id='PID-VAR-1', full_name='รูป ทดสอบ', status='รอปิดจ๊อบ'),
+                            ContractDocument(customer_id='PID-VAR-1', document_url=url, uploaded_by='testuser')])
+        db.session.commit()
+        customer_db_id = customer.id
+
+    thumb = 'https://res.cloudinary.com/demo/image/upload/c_fill,g_auto,w_200,h_200,f_auto,q_auto/v1/customer_app_images/photo-1.jpg'
+    page = logged_in_client.get(f'/edit_customer_data/{customer_db_id}').data.decode('utf-8')
+    assert f'src="{thumb}"' in page and f'data-url="{url}"' in page
+    assert 'c_limit,w_800,f_auto,q_auto/v1/customer_app_images/photo-1.jpg 800w' in page
+
+    info = json.loads(logged_in_client.get('/get-customer-info/PID-VAR-1').data)
+    image = info['images'][0]
+    assert image['url'] == url and image['thumb'] == thumb
+    assert image['full'] == 'https://res.cloudinary.com/demo/image/upload/f_auto,q_auto/v1/customer_app_images/photo-1.jpg'
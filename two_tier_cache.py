@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Two-tier cache backend for flask_caching: a small in-process L1 in front of a
+SQLite file (L2) shared by every worker on the host.
+
+Every write to L2 also appends the key to a change log. Before serving a read,
+each worker replays the log entries it has not seen yet and drops those keys
+from its L1, so an invalidation made by one gunicorn worker is seen by all the
+others on their next request. L1 entries also live at most L1_TIMEOUT seconds,
+well inside the change log's retention, so a worker can never miss an entry.
+
+Select it with CACHE_TYPE = 'two_tier_cache.TwoTierCache'; CACHE_DIR sets where
+the shared file lives and CACHE_THRESHOLD the number of L1 entries.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from cachelib import SimpleCache as CachelibSimpleCache
+from flask_caching.backends.base import BaseCache
+
+L1_TIMEOUT = 60
+CHANGE_LOG_RETENTION = 3600
+CLEAR_ALL = '*'
+
+
+class TwoTierCache(BaseCache):
+    """In-process L1 plus a SQLite-file L2 shared across worker processes."""
+
+    def __init__(self, path, default_timeout=300, threshold=500):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self._l1 = CachelibSimpleCache(threshold=threshold, default_timeout=L1_TIMEOUT)
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._writes = 0
+        self._last_seq = self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        cache_dir = config.get('CACHE_DIR') or app.instance_path
+        os.makedirs(cache_dir, exist_ok=True)
+        kwargs.update(path=os.path.join(cache_dir, 'cache.sqlite'), threshold=config['CACHE_THRESHOLD'])
+        return cls(*args, **kwargs)
+
+    def _conn(self):
+        """One autocommit connection per thread; WAL lets readers run alongside a writer."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, created REAL NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _expires_at(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return 0 if timeout == 0 else time.time() + timeout
+
+    def _sync(self):
+        """Drops from L1 every key another worker (or this one) changed since the last sync."""
+        with self._sync_lock:
+            rows = self._conn().execute("SELECT seq, key FROM changes WHERE seq > ? ORDER BY seq", (self._last_seq,)).fetchall()
+            for seq, key in rows:
+                if key == CLEAR_ALL:
+                    self._l1.clear()
+                else:
+                    self._l1.delete(key)
+                self._last_seq = seq
+
+    def _log_change(self, conn, key):
+        conn.execute("INSERT INTO changes (key, created) VALUES (?, ?)", (key, time.time()))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            now = time.time()
+            conn.execute("DELETE FROM changes WHERE created < ?", (now - CHANGE_LOG_RETENTION,))
+            conn.execute("DELETE FROM entries WHERE expires != 0 AND expires < ?", (now,))
+
+    def _read_l2(self, key):
+        row = self._conn().execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] != 0 and row[1] < time.time()):
+            return None
+        return row
+
+    def get(self, key):
+        self._sync()
+        value = self._l1.get(key)
+        if value is not None:
+            return value
+        row = self._read_l2(key)
+        if row is None:
+            return None
+        value = pickle.loads(row[0])
+        l1_timeout = L1_TIMEOUT if row[1] == 0 else max(1, min(L1_TIMEOUT, int(row[1] - time.time())))
+        self._l1.set(key, value, timeout=l1_timeout)
+        return value
+
+    def has(self, key):
+        self._sync()
+        return self._l1.has(key) or self._read_l2(key) is not None
+
+    def set(self, key, value, timeout=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)",
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires_at(timeout)))
+            self._log_change(conn, key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def add(self, key, value, timeout=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE key = ? AND expires != 0 AND expires < ?", (key, time.time()))
+            added = conn.execute("INSERT OR IGNORE INTO entries (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires_at(timeout))).rowcount == 1
+            if added:
+                self._log_change(conn, key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = conn.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount == 1
+            self._log_change(conn, key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._l1.delete(key)
+        return deleted
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries")
+            self._log_change(conn, CLEAR_ALL)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._l1.clear()
+        return True
+
+    def inc(self, key, delta=1):
+        """Atomic across workers: the read-modify-write runs inside one IMMEDIATE transaction."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            live = row is not None and (row[1] == 0 or row[1] >= time.time())
+            value = (pickle.loads(row[0]) if live else 0) + delta
+            expires = row[1] if live else self._expires_at(None)
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)",
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires))
+            self._log_change(conn, key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)